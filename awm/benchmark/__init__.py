@@ -0,0 +1,339 @@
+#!/usr/bin/python3
+# Copyright (c) 2020 Thomas Bechtold <thomasbechtold@jpberlin.de>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""
+Benchmark the crawler and the persister
+
+The crawler checks a local HTTP server and publishes to an in-process
+kafka stand-in. The persister consumes from an in-process kafka
+stand-in and writes to an in-process database stand-in, so the
+benchmarks measure the cost of awm itself and not of the infrastructure.
+The `imports` benchmark measures the startup time of the command line
+tools in fresh interpreters. The reports are written as JSON so they can
+be compared between releases.
+"""
+
+import argparse
+import asyncio
+import datetime
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Dict, List, Optional
+
+import awm
+from ..common import config
+from ..common import kafka_utils
+from ..common.result import WIRE_FORMATS, Result, ResultStatus
+from ..crawler import scheduler
+from ..crawler import service as crawler_service
+from ..crawler import urls as crawler_urls
+from ..persister import service as persister_service
+from . import server
+from . import standins
+
+logger = logging.getLogger(__name__)
+
+TOPIC = 'awm-benchmark'
+#: the dependencies which should only be imported when they are used
+HEAVY_MODULES = ('aiohttp', 'aiokafka', 'aiopg', 'dateutil', 'multiprocessing')
+
+
+def _percentiles(values: List[float]) -> Dict[str, Optional[float]]:
+    """the p50, p90 and p99 of the values"""
+    values = sorted(values)
+    ret: Dict[str, Optional[float]] = {}
+    for p in (50, 90, 99):
+        ret[f'p{p}'] = values[min(len(values) - 1, len(values) * p // 100)] if values else None
+    return ret
+
+
+def _conf(crawler_conf: Optional[Dict] = None, persister_conf: Optional[Dict] = None,
+          wire_format: str = 'json') -> Dict:
+    return {
+        'kafka': {'servers': 'in-process', 'ssl': {}, 'topic_name': TOPIC, 'format': wire_format},
+        'crawler': crawler_conf or {},
+        'persister': persister_conf or {},
+    }
+
+
+async def _memory_per_url(conf: Dict) -> float:
+    """the memory in bytes needed for the configuration and the schedule of a url"""
+    async def check(key, due):
+        pass
+
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        url_confs = crawler_urls.url_configs(conf)
+        sched = scheduler.Scheduler(check, 1)
+        for url, url_conf in url_confs.items():
+            sched.add(url, url_conf.interval)
+        return (tracemalloc.get_traced_memory()[0] - before) / max(len(url_confs), 1)
+    finally:
+        tracemalloc.stop()
+
+
+async def crawler_benchmark(urls: int = 1000, interval: float = 5.0, duration: float = 15.0,
+                            latency: float = 0.05, body_size: int = 1024, error_rate: float = 0.0,
+                            concurrency: int = 100, regex: Optional[str] = None, wire_format: str = 'json',
+                            kafka_latency: float = 0.0) -> Dict:
+    """check `urls` urls of a local server every `interval` seconds for `duration` seconds
+
+    :return: the measured values
+    :rtype: dict
+    """
+    producer = standins.Producer(kafka_latency)
+    loop = asyncio.get_event_loop()
+    async with server.TargetServer(latency, body_size, error_rate, seed=0) as target:
+        url_conf = {'regex': regex} if regex else {}
+        conf = _conf({'interval': interval, 'concurrency': concurrency,
+                      'urls': {target.url(i): url_conf for i in range(urls)}}, wire_format=wire_format)
+        memory_per_url = await _memory_per_url(conf)
+        cpu = time.process_time()
+        start = loop.time()
+        task = asyncio.create_task(crawler_service._crawl(conf, producer_factory=standins.producer_factory(producer)))
+        await asyncio.sleep(duration)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        elapsed = loop.time() - start
+        cpu = time.process_time() - cpu
+    results = [Result.decode(value, dict(headers).get(kafka_utils.CONTENT_TYPE_HEADER, b'').decode() or None)
+               for _, _, value, headers in producer.messages]
+    successful = [r for r in results if r.status == ResultStatus.SUCCESSFUL]
+    return {
+        'checks': len(results),
+        'checks_per_second': len(results) / elapsed,
+        'expected_checks_per_second': urls / interval,
+        'requests': target.requests,
+        'statuses': {status.value: sum(1 for r in results if r.status == status) for status in ResultStatus},
+        'http_errors': sum(1 for r in successful if r.response_status >= 500),
+        'fetch_ms': _percentiles([r.duration.total_seconds() * 1000 for r in successful]),
+        'lateness_ms': _percentiles([r.lateness.total_seconds() * 1000 for r in results if r.lateness is not None]),
+        'cpu_seconds': cpu,
+        'cpu_us_per_check': cpu / len(results) * 1e6 if results else None,
+        'memory_per_url_bytes': memory_per_url,
+    }
+
+
+def _messages(count: int, urls: int, wire_format: str) -> List:
+    """encoded results of `urls` urls checked once per second. Every 50th check of a url fails"""
+    content_type = WIRE_FORMATS[wire_format]
+    headers = kafka_utils.content_type_headers(content_type)
+    start = datetime.datetime.now(datetime.timezone.utc)
+    messages = []
+    for i in range(count):
+        url = f'http://127.0.0.1/{i % urls}'
+        start_dt = start + datetime.timedelta(seconds=i // urls)
+        if (i // urls + i % urls) % 50:
+            res = Result(url, start_dt, start_dt + datetime.timedelta(milliseconds=50), 200, True,
+                         ResultStatus.SUCCESSFUL, None, False)
+        else:
+            res = Result(url, start_dt, None, None, None, ResultStatus.TIMEOUT, 'timeout')
+        messages.append((url.encode(), res.encode(content_type), headers))
+    return messages
+
+
+async def persister_benchmark(messages: int = 100000, urls: int = 1000, partitions: int = 4,
+                              batch_size: int = 500, wire_format: str = 'json', mode: str = 'all') -> Dict:
+    """persist `messages` results of `urls` urls from `partitions` partitions
+
+    :return: the measured values
+    :rtype: dict
+    """
+    consumer = standins.Consumer(TOPIC, _messages(messages, urls, wire_format), partitions, batch_size)
+    db = standins.Database()
+    conf = _conf(persister_conf={'postgres': {'uri': 'in-process'}, 'batch_size': batch_size,
+                                 'batch_timeout': 0.01, 'mode': mode})
+    loop = asyncio.get_event_loop()
+    cpu = time.process_time()
+    start = loop.time()
+    task = asyncio.create_task(persister_service._consume(conf, standins.consumer_factory(consumer),
+                                                          standins.pool_factory(db)))
+    await asyncio.wait([task, asyncio.create_task(consumer.done.wait())], return_when=asyncio.FIRST_COMPLETED)
+    elapsed = loop.time() - start
+    cpu = time.process_time() - cpu
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+    return {
+        'messages': messages,
+        'seconds': elapsed,
+        'messages_per_second': messages / elapsed,
+        'cpu_seconds': cpu,
+        'cpu_us_per_message': cpu / messages * 1e6 if messages else None,
+        'rows': db.rows,
+        'statements': db.statements,
+        'transactions': db.transactions,
+    }
+
+
+def _python(args: List[str]) -> subprocess.CompletedProcess:
+    """run a fresh interpreter which can import awm"""
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [os.path.dirname(os.path.dirname(awm.__file__)),
+                                                      env.get('PYTHONPATH')]))
+    return subprocess.run([sys.executable] + args, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                          check=True)
+
+
+def _main_args(module: str, prog: str, args: List[str]) -> List[str]:
+    return ['-c', f'import sys; sys.argv[0] = "{prog}"; from {module} import main; main()'] + args
+
+
+def heavy_modules(module: str) -> List[str]:
+    """get the heavy dependencies which are loaded when the given module is imported in a fresh interpreter
+
+    :param module: the module name
+    :type module: str
+
+    :return: the names of the loaded modules of :data:`HEAVY_MODULES`
+    :rtype: list
+    """
+    out = _python(['-c', f'import sys, json, {module}; '
+                   f'print(json.dumps([m for m in {HEAVY_MODULES!r} if m in sys.modules]))']).stdout
+    return json.loads(out)
+
+
+def imports_benchmark(runs: int = 10, urls: int = 1000) -> Dict:
+    """measure the startup time of `--help` and of the config validation
+
+    The config contains `urls` urls with a regular expression.
+
+    :return: the measured values
+    :rtype: dict
+    """
+    with tempfile.NamedTemporaryFile('w', suffix='.json') as f:
+        conf = _conf({'interval': 5.0, 'urls': {f'https://localhost/{i}': {'regex': 'ok'} for i in range(urls)}},
+                     {'postgres': {'uri': 'postgres://localhost/awm'}})
+        conf['kafka']['ssl'] = {'enabled': False}
+        json.dump(conf, f)
+        f.flush()
+        commands = {
+            'python': ['-c', 'pass'],
+            'awm-crawler --help': _main_args('awm.crawler', 'awm-crawler', ['--help']),
+            'awm-crawler --check-config': _main_args('awm.crawler', 'awm-crawler', ['-t', '-c', f.name]),
+            'awm-persister --help': _main_args('awm.persister', 'awm-persister', ['--help']),
+            'awm-persister --check-config': _main_args('awm.persister', 'awm-persister', ['-t', '-c', f.name]),
+            'awm-query --help': _main_args('awm.query', 'awm-query', ['--help']),
+        }
+        timings = {}
+        for name, args in commands.items():
+            durations = []
+            for _ in range(runs):
+                start = time.perf_counter()
+                _python(args)
+                durations.append((time.perf_counter() - start) * 1000)
+            timings[name] = {'median_ms': statistics.median(durations), 'min_ms': min(durations)}
+    baseline = timings.pop('python')['median_ms']
+    for timing in timings.values():
+        timing['overhead_ms'] = timing['median_ms'] - baseline
+    return {
+        'python_ms': baseline,
+        'commands': timings,
+        'heavy_modules': {module: heavy_modules(module)
+                          for module in ('awm.crawler.service', 'awm.persister.service', 'awm.query.report')},
+    }
+
+
+def report(benchmark: str, parameters: Dict, results: Dict) -> Dict:
+    """create the JSON report of a benchmark run"""
+    return {
+        'benchmark': benchmark,
+        'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'parameters': parameters,
+        'results': results,
+    }
+
+
+def _parser():
+    parser = argparse.ArgumentParser(
+        description='Benchmark the crawler and the persister with in-process stand-ins for kafka and the database')
+    parser.add_argument('-d', '--debug', help="set loglevel to DEBUG",
+                        action="store_const", dest="loglevel", const=logging.DEBUG,
+                        default=logging.WARNING)
+    parser.add_argument('-v', '--verbose', help="set loglevel to INFO",
+                        action="store_const", dest="loglevel", const=logging.INFO)
+    parser.add_argument('-o', '--output', help="write the JSON report to the given file. Default: stdout")
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    p = subparsers.add_parser('crawler', help='check urls of a local HTTP server')
+    p.add_argument('--urls', type=int, default=1000, help='number of urls. Default: %(default)s')
+    p.add_argument('--interval', type=float, default=5.0, help='check interval in seconds. Default: %(default)s')
+    p.add_argument('--duration', type=float, default=15.0, help='run time in seconds. Default: %(default)s')
+    p.add_argument('--latency', type=float, default=0.05,
+                   help='response latency of the server in seconds. Default: %(default)s')
+    p.add_argument('--body-size', type=int, default=1024, help='response body size in bytes. Default: %(default)s')
+    p.add_argument('--error-rate', type=float, default=0.0,
+                   help='share of responses with status 500. Default: %(default)s')
+    p.add_argument('--concurrency', type=int, default=100,
+                   help='maximum number of concurrent checks. Default: %(default)s')
+    p.add_argument('--regex', help='check the response bodies against the regular expression')
+    p.add_argument('--format', dest='wire_format', choices=list(WIRE_FORMATS), default='json',
+                   help='kafka wire format. Default: %(default)s')
+    p.add_argument('--kafka-latency', type=float, default=0.0,
+                   help='delivery latency of the kafka stand-in in seconds. Default: %(default)s')
+
+    p = subparsers.add_parser('persister', help='persist results from an in-process kafka stand-in')
+    p.add_argument('--messages', type=int, default=100000, help='number of messages. Default: %(default)s')
+    p.add_argument('--urls', type=int, default=1000, help='number of urls. Default: %(default)s')
+    p.add_argument('--partitions', type=int, default=4, help='number of partitions. Default: %(default)s')
+    p.add_argument('--batch-size', type=int, default=500, help='persister batch size. Default: %(default)s')
+    p.add_argument('--format', dest='wire_format', choices=list(WIRE_FORMATS), default='json',
+                   help='kafka wire format. Default: %(default)s')
+    p.add_argument('--mode', choices=config.PERSISTER_MODES, default='all',
+                   help='persister mode. Default: %(default)s')
+
+    p = subparsers.add_parser('imports', help='measure the startup time of the command line tools')
+    p.add_argument('--runs', type=int, default=10, help='number of runs per command. Default: %(default)s')
+    p.add_argument('--urls', type=int, default=1000,
+                   help='number of urls in the validated config. Default: %(default)s')
+    return parser
+
+
+def main():
+    """main entry point for the benchmarks.
+    This is used by the executable `awm-benchmark`
+    """
+    parser = _parser()
+    args = parser.parse_args()
+    logging.basicConfig(level=args.loglevel)
+    parameters = {k: v for k, v in vars(args).items() if k not in ('loglevel', 'output', 'benchmark')}
+    if args.benchmark == 'imports':
+        results = imports_benchmark(**parameters)
+    else:
+        benchmark = crawler_benchmark if args.benchmark == 'crawler' else persister_benchmark
+        results = asyncio.run(benchmark(**parameters))
+    data = json.dumps(report(args.benchmark, parameters, results), indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(data + '\n')
+    else:
+        sys.stdout.write(data + '\n')
+
+
+# for debugging
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+# Copyright (c) 2020 Thomas Bechtold <thomasbechtold@jpberlin.de>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""
+A local HTTP server the crawler benchmark checks
+"""
+
+import asyncio
+import random
+from typing import Optional
+
+from aiohttp import web
+
+
+class TargetServer:
+    """
+    Serve every path with a configurable latency, body size and error rate
+
+    Use it as async context manager to start and stop the server.
+
+    :param latency: the seconds every response is delayed
+    :type latency: float
+    :param body_size: the size of the response body in bytes
+    :type body_size: int
+    :param error_rate: the share (0 to 1) of responses with status 500
+    :type error_rate: float
+    :param seed: the seed of the random errors
+    :type seed: int or None
+    """
+    def __init__(self, latency: float = 0.0, body_size: int = 1024, error_rate: float = 0.0,
+                 seed: Optional[int] = None):
+        self._latency = latency
+        self._body = b'x' * body_size
+        self._error_rate = error_rate
+        self._random = random.Random(seed)
+        self._runner: Optional[web.AppRunner] = None
+        self.port = 0
+        #: the number of handled requests
+        self.requests = 0
+
+    def url(self, index: int) -> str:
+        """get the url of the target with the given index"""
+        return f'http://127.0.0.1:{self.port}/{index}'
+
+    async def _handle(self, request):
+        self.requests += 1
+        if self._latency:
+            await asyncio.sleep(self._latency)
+        status = 500 if self._random.random() < self._error_rate else 200
+        return web.Response(status=status, body=self._body)
+
+    async def __aenter__(self):
+        app = web.Application()
+        app.router.add_route('*', '/{path:.*}', self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, '127.0.0.1', 0, backlog=1024)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        return self
+
+    async def __aexit__(self, *args):
+        if self._runner is not None:
+            await self._runner.cleanup()
@@ -0,0 +1,194 @@
+# Copyright (c) 2020 Thomas Bechtold <thomasbechtold@jpberlin.de>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""
+In-process stand-ins for kafka and PostgreSQL
+
+They implement the parts of the aiokafka and aiopg APIs awm uses, so the
+crawler and the persister can run without a broker or a database.
+"""
+
+import asyncio
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional, Set
+import zlib
+
+from aiokafka.structs import ConsumerRecord, TopicPartition
+
+from ..common.result import Result
+
+
+class Producer:
+    """
+    Keep the sent messages in memory instead of sending them to kafka
+
+    :param latency: the seconds until a message is delivered
+    :type latency: float
+    """
+    def __init__(self, latency: float = 0.0):
+        self._latency = latency
+        self.messages: List = []
+
+    async def send(self, topic: str, value: bytes, key: Optional[bytes] = None, headers: Optional[List] = None):
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+        self.messages.append((topic, key, value, headers))
+        if self._latency:
+            loop.call_later(self._latency, future.set_result, None)
+        else:
+            future.set_result(None)
+        return future
+
+
+def producer_factory(producer: Producer):
+    """get a replacement for :func:`awm.common.kafka_utils.kafka_producer` yielding the given producer"""
+    @asynccontextmanager
+    async def kafka_producer(servers, sslconf, options=None):
+        yield producer
+    return kafka_producer
+
+
+class Consumer:
+    """
+    Consume messages from memory instead of kafka
+
+    The messages are spread over the partitions like kafka does with
+    message keys. All partitions are assigned to the consumer.
+
+    :param topic: the topic
+    :type topic: str
+    :param messages: the messages as (key, value, headers) tuples
+    :type messages: list
+    :param partitions: the number of partitions
+    :type partitions: int
+    :param max_records: the maximum number of messages returned per partition by `getmany`
+    :type max_records: int
+    """
+    def __init__(self, topic: str, messages: List, partitions: int = 1, max_records: int = 500):
+        self._max_records = max_records
+        self._listener = None
+        self._assigned = False
+        self._records: Dict[TopicPartition, List[ConsumerRecord]] = defaultdict(list)
+        for key, value, headers in messages:
+            tp = TopicPartition(topic, zlib.crc32(key or b'') % partitions)
+            records = self._records[tp]
+            records.append(ConsumerRecord(tp.topic, tp.partition, len(records), 0, 0, key, value, None,
+                                          len(key or b''), len(value), headers))
+        self._positions = {tp: 0 for tp in self._records}
+        self._paused: Set[TopicPartition] = set()
+        self.committed: Dict[TopicPartition, int] = {}
+        #: set when all messages are committed
+        self.done = asyncio.Event()
+
+    def subscribe(self, topics: List[str], listener=None):
+        self._listener = listener
+
+    def pause(self, *partitions: TopicPartition):
+        self._paused.update(partitions)
+
+    def resume(self, *partitions: TopicPartition):
+        self._paused.difference_update(partitions)
+
+    def highwater(self, tp: TopicPartition) -> Optional[int]:
+        records = self._records.get(tp)
+        return None if records is None else len(records)
+
+    async def getmany(self, timeout_ms: int = 0) -> Dict:
+        if not self._assigned:
+            self._assigned = True
+            if self._listener is not None:
+                await self._listener.on_partitions_assigned(list(self._records))
+        data = {}
+        for tp, records in self._records.items():
+            position = self._positions[tp]
+            if position < len(records) and tp not in self._paused:
+                data[tp] = records[position:position + self._max_records]
+                self._positions[tp] = position + len(data[tp])
+        if not data:
+            # nothing left. Don't busy loop
+            await asyncio.sleep(min(timeout_ms / 1000, 0.01))
+        return data
+
+    async def commit(self, offsets: Dict):
+        self.committed.update(offsets)
+        if all(self.committed.get(tp) == len(records) for tp, records in self._records.items()):
+            self.done.set()
+
+
+def consumer_factory(consumer: Consumer):
+    """get a replacement for :func:`awm.common.kafka_utils.kafka_consumer` yielding the given consumer"""
+    @asynccontextmanager
+    async def kafka_consumer(servers, topics, group_id, sslconf, enable_auto_commit=True):
+        yield consumer
+    return kafka_consumer
+
+
+class Database:
+    """
+    Count the executed statements and written rows instead of storing them
+
+    Only the queries of :class:`awm.persister.store.ResultStore` are answered.
+    """
+    def __init__(self):
+        self.statements = 0
+        self.rows = 0
+        self.transactions = 0
+        self._urls: Dict[str, int] = {}
+
+    @asynccontextmanager
+    async def acquire(self):
+        yield self
+
+    @asynccontextmanager
+    async def cursor(self):
+        yield _Cursor(self)
+
+
+class _Cursor:
+    def __init__(self, db: Database):
+        self._db = db
+        self._fetch: List = []
+
+    async def execute(self, sql: str, args=None):
+        db = self._db
+        db.statements += 1
+        self._fetch = []
+        if sql.startswith('INSERT INTO urls'):
+            for url in args[0]:
+                db._urls.setdefault(url, len(db._urls) + 1)
+        elif sql.startswith('SELECT id, url FROM urls'):
+            self._fetch = [(db._urls[url], url) for url in args[0]]
+        elif sql.startswith('INSERT INTO crawler_results('):
+            db.rows += len(args) // len(Result.SQL_COLUMNS)
+        # give other tasks a chance like a real database roundtrip would
+        await asyncio.sleep(0)
+
+    async def fetchall(self):
+        return self._fetch
+
+    @asynccontextmanager
+    async def begin(self):
+        self._db.transactions += 1
+        yield
+
+
+def pool_factory(db: Database):
+    """get a replacement for :func:`aiopg.create_pool` returning the given database"""
+    @asynccontextmanager
+    async def create_pool(dsn, **kwargs):
+        yield db
+    return create_pool
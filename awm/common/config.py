@@ -18,26 +18,29 @@
 The config module is responsible to creating a config
 dict from an available configuration file.
 The configuration file needs to contain valid json.
+
+The configs of the services are validated here without importing the
+services (and without logging), so `awm-crawler -t` and
+`awm-persister -t` start fast.
 """
 
 import os
 import json
-import logging
-from pathlib import Path
-from typing import Dict
+from typing import Dict, Union
 
 from .exception import AwmConfigError
 
 
-logger = logging.getLogger(__name__)
+#: the persister modes. `all` writes every result, `changes` only state changes and heartbeats
+PERSISTER_MODES = ('all', 'changes')
 
 
-def get_config(config_path: Path) -> Dict:
+def get_config(config_path: Union[str, os.PathLike]) -> Dict:
     """Get a config dict from a configuration file
     The configuration file must be valid json
 
     :param config_path: the path to the config file
-    :type config_path: Path
+    :type config_path: str or Path
 
     :raises AwmConfigError: Raised when the file is not found or accessable or in an invalid format
 
@@ -45,13 +48,62 @@ def get_config(config_path: Path) -> Dict:
     :rtype: dict
     """
     if os.path.exists(config_path):
-        with open(config_path, 'r') as f:
-            try:
+        try:
+            with open(config_path, 'r') as f:
                 data = json.loads(f.read())
-                logger.info(f'using config {config_path}')
-                return data
-            except Exception as e:
-                logger.exception(e)
-                raise AwmConfigError(f'unable to read config {config_path}')
+        except (OSError, ValueError) as e:
+            raise AwmConfigError(f'unable to read config {config_path}: {e}')
+        return data
 
     raise AwmConfigError(f'config file {config_path} not found')
+
+
+def _require_kafka(conf: Dict):
+    for key in ('servers', 'topic_name', 'ssl'):
+        conf['kafka'][key]
+
+
+def validate_crawler(conf: Dict):
+    """validate the crawler config without connecting to any service
+
+    An inventory table is not read.
+
+    :param conf: the configuration dict
+    :type conf: dict
+
+    :raises AwmConfigError: Raised when the config is invalid
+    """
+    from ..crawler import urls
+    from .result import WIRE_FORMATS
+    try:
+        _require_kafka(conf)
+        urls.url_configs(conf, database=False)
+        wire_format = conf['kafka'].get('format', 'json')
+    except KeyError as e:
+        raise AwmConfigError(f'missing config key {e}')
+    except (TypeError, AttributeError) as e:
+        # e.g. a section which is not a map
+        raise AwmConfigError(f'invalid config: {e}')
+    if wire_format not in WIRE_FORMATS:
+        raise AwmConfigError(f'unknown kafka format {wire_format}. Use one of {", ".join(WIRE_FORMATS)}')
+
+
+def validate_persister(conf: Dict):
+    """validate the persister config without connecting to any service
+
+    :param conf: the configuration dict
+    :type conf: dict
+
+    :raises AwmConfigError: Raised when the config is invalid
+    """
+    try:
+        _require_kafka(conf)
+        conf['persister']['postgres']['uri']
+        mode = conf['persister'].get('mode', 'all')
+    except KeyError as e:
+        raise AwmConfigError(f'missing config key {e}')
+    except (TypeError, AttributeError) as e:
+        # e.g. a section which is not a map
+        raise AwmConfigError(f'invalid config: {e}')
+    if mode not in PERSISTER_MODES:
+        raise AwmConfigError(f'unknown persister mode {mode}. Use one of {", ".join(PERSISTER_MODES)}')
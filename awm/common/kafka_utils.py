@@ -15,20 +15,43 @@
 
 
 import asyncio
+import functools
 import logging
 from contextlib import asynccontextmanager
-from typing import Dict, List
+from typing import Dict, List, Optional, Set, Tuple
 
-from aiokafka import AIOKafkaProducer, AIOKafkaConsumer
-from aiokafka.helpers import create_ssl_context
+from . import metrics
+
+# aiokafka is imported when a producer or consumer is created. Importing it is
+# slow and not needed for e.g. the command line help or validating the config
 
 
 logger = logging.getLogger(__name__)
 
+_send_seconds = metrics.REGISTRY.histogram(
+    'awm_kafka_send_seconds', 'Time from sending a message until its delivery by topic', ('topic',))
+
+#: the kafka message header containing the content type of the message value
+CONTENT_TYPE_HEADER = 'content-type'
+
+
+def content_type_headers(content_type: str) -> List[Tuple[str, bytes]]:
+    """get the kafka message headers for the given content type"""
+    return [(CONTENT_TYPE_HEADER, content_type.encode())]
+
+
+def content_type(msg) -> Optional[str]:
+    """get the content type of a consumed kafka message. None if the header is missing"""
+    for key, value in msg.headers or ():
+        if key == CONTENT_TYPE_HEADER:
+            return value.decode()
+    return None
+
 
 def _kafka_ssl(sslconf: Dict):
     ret = {}
     if sslconf.get('enabled', False):
+        from aiokafka.helpers import create_ssl_context
         context = create_ssl_context(
             cafile=sslconf['cafile'],
             certfile=sslconf['certfile'],
@@ -41,13 +64,16 @@ def _kafka_ssl(sslconf: Dict):
 
 
 @asynccontextmanager
-async def kafka_producer(servers: str, sslconf: Dict):
+async def kafka_producer(servers: str, sslconf: Dict, options: Optional[Dict] = None):
+    from aiokafka import AIOKafkaProducer
     kwargs = {
         'loop': asyncio.get_event_loop(),
         'bootstrap_servers': servers,
         'client_id': 'awm'
     }
     kwargs.update(_kafka_ssl(sslconf))
+    # producer tuning (e.g. linger_ms, max_batch_size, compression_type)
+    kwargs.update(options or {})
 
     producer = AIOKafkaProducer(**kwargs)
     try:
@@ -59,12 +85,15 @@ async def kafka_producer(servers: str, sslconf: Dict):
 
 
 @asynccontextmanager
-async def kafka_consumer(servers: str, topics: List[str], group_id: str, sslconf: Dict):
+async def kafka_consumer(servers: str, topics: List[str], group_id: str, sslconf: Dict,
+                         enable_auto_commit: bool = True):
+    from aiokafka import AIOKafkaConsumer
     kwargs = {
         'loop': asyncio.get_event_loop(),
         'bootstrap_servers': servers,
         'client_id': 'awm',
         'group_id': group_id,
+        'enable_auto_commit': enable_auto_commit,
     }
     kwargs.update(_kafka_ssl(sslconf))
     consumer = AIOKafkaConsumer(*topics, **kwargs)
@@ -74,3 +103,64 @@ async def kafka_consumer(servers: str, topics: List[str], group_id: str, sslconf
         yield consumer
     finally:
         await consumer.stop()
+
+
+class Sender:
+    """
+    Send messages to a topic without waiting for their delivery
+
+    At most `max_in_flight` messages wait for their delivery. When the limit
+    is reached, :meth:`Sender.send` waits until a delivery finished.
+    Failed deliveries are logged and counted.
+
+    :param producer: the kafka producer
+    :type producer: :class:`aiokafka.AIOKafkaProducer`
+    :param topic: the topic
+    :type topic: str
+    :param max_in_flight: the maximum number of messages waiting for their delivery
+    :type max_in_flight: int
+    """
+    def __init__(self, producer, topic: str, max_in_flight: int):
+        self._producer = producer
+        self._topic = topic
+        self._semaphore = asyncio.Semaphore(max_in_flight)
+        self._pending: Set[asyncio.Future] = set()
+        self.failed = 0
+
+    @property
+    def in_flight(self) -> int:
+        """the number of messages waiting for their delivery"""
+        return len(self._pending)
+
+    def _delivered(self, start: float, future: asyncio.Future):
+        self._pending.discard(future)
+        self._semaphore.release()
+        _send_seconds.observe(asyncio.get_event_loop().time() - start, self._topic)
+        if not future.cancelled() and future.exception() is not None:
+            self.failed += 1
+            logger.error(f'sending message to {self._topic} failed: {future.exception()}')
+
+    async def send(self, value: bytes, key: Optional[bytes] = None, headers: Optional[List] = None):
+        """queue a message for sending
+
+        :param value: the message value
+        :type value: bytes
+        :param key: the message key. Messages with the same key go to the same partition
+        :type key: bytes or None
+        :param headers: the message headers
+        :type headers: list or None
+        """
+        await self._semaphore.acquire()
+        start = asyncio.get_event_loop().time()
+        try:
+            future = await self._producer.send(self._topic, value, key=key, headers=headers)
+        except BaseException:
+            # also when the send is cancelled, the slot is only kept for a queued message
+            self._semaphore.release()
+            raise
+        self._pending.add(future)
+        future.add_done_callback(functools.partial(self._delivered, start))
+
+    async def flush(self):
+        """wait until all queued messages are delivered (or failed)"""
+        await asyncio.gather(*self._pending, return_exceptions=True)
@@ -0,0 +1,253 @@
+# Copyright (c) 2020 Thomas Bechtold <thomasbechtold@jpberlin.de>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""
+The metrics module contains simple in-process metrics (counters, gauges and
+histograms) which can be rendered in the prometheus text exposition format
+and served over HTTP.
+"""
+
+import bisect
+from contextlib import asynccontextmanager
+import logging
+import math
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+
+logger = logging.getLogger(__name__)
+
+#: the default address the metrics are served on
+DEFAULT_HOST = '0.0.0.0'
+#: the content type of the prometheus text exposition format
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class _Metric:
+    """
+    base class for all metrics
+
+    :param name: the metric name
+    :type name: str
+    :param documentation: the metric description
+    :type documentation: str
+    :param labelnames: the names of the labels
+    :type labelnames: tuple of str
+    """
+    TYPE = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def _labels(self, labelvalues: Tuple[str, ...]) -> Tuple[str, ...]:
+        if len(labelvalues) != len(self.labelnames):
+            raise ValueError(f'{self.name} expects labels {self.labelnames}, got {labelvalues}')
+        return tuple(str(v) for v in labelvalues)
+
+    def _format_labels(self, labelvalues: Tuple[str, ...], extra: Optional[Dict[str, str]] = None) -> str:
+        pairs = list(zip(self.labelnames, labelvalues)) + list((extra or {}).items())
+        if not pairs:
+            return ''
+        return '{' + ','.join('{}="{}"'.format(k, v.replace('\\', '\\\\').replace('"', '\\"'))
+                              for k, v in pairs) + '}'
+
+    def remove(self, *labelvalues: str):
+        """remove the value of the given labels"""
+        self._values.pop(self._labels(labelvalues), None)
+
+    def samples(self) -> List[str]:
+        return [f'{self.name}{self._format_labels(k)} {v}' for k, v in sorted(self._values.items())]
+
+    def render(self) -> str:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.TYPE}']
+        lines.extend(self.samples())
+        return '\n'.join(lines)
+
+
+class Counter(_Metric):
+    """a monotonically increasing value"""
+    TYPE = 'counter'
+
+    def inc(self, amount: float = 1, *labelvalues: str):
+        if amount < 0:
+            raise ValueError('counters can only be increased')
+        key = self._labels(labelvalues)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, *labelvalues: str) -> float:
+        return self._values.get(self._labels(labelvalues), 0)
+
+
+class Gauge(_Metric):
+    """a value that can go up and down
+
+    Instead of setting the value, a function can be set with :meth:`Gauge.set_function`
+    which is called whenever the gauge is rendered.
+    """
+    TYPE = 'gauge'
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._function: Optional[Callable[[], float]] = None
+
+    def set(self, value: float, *labelvalues: str):
+        self._values[self._labels(labelvalues)] = value
+
+    def inc(self, amount: float = 1, *labelvalues: str):
+        key = self._labels(labelvalues)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, *labelvalues: str):
+        self.inc(-amount, *labelvalues)
+
+    def set_function(self, function: Callable[[], float]):
+        self._function = function
+
+    def get(self, *labelvalues: str) -> float:
+        if self._function is not None:
+            return self._function()
+        return self._values.get(self._labels(labelvalues), 0)
+
+    def samples(self) -> List[str]:
+        if self._function is not None:
+            return [f'{self.name} {self._function()}']
+        return super().samples()
+
+
+class Histogram(_Metric):
+    """the distribution of observed values in cumulative buckets
+
+    :param buckets: the upper bounds of the buckets. A `+Inf` bucket is always added
+    :type buckets: sequence of float
+    """
+    TYPE = 'histogram'
+    #: the default buckets, suitable for durations in seconds
+    DEFAULT_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(float(b) for b in buckets if b != math.inf))
+        # labels -> number of observations by bucket (not cumulative, the last one is +Inf)
+        self._counts: Dict[Tuple[str, ...], List[int]] = {}
+        self._sums: Dict[Tuple[str, ...], float] = {}
+
+    def observe(self, value: float, *labelvalues: str):
+        key = self._labels(labelvalues)
+        counts = self._counts.get(key)
+        if counts is None:
+            counts = self._counts[key] = [0] * (len(self.buckets) + 1)
+            self._sums[key] = 0
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        self._sums[key] += value
+
+    def count(self, *labelvalues: str) -> int:
+        return sum(self._counts.get(self._labels(labelvalues), ()))
+
+    def sum(self, *labelvalues: str) -> float:
+        return self._sums.get(self._labels(labelvalues), 0)
+
+    def remove(self, *labelvalues: str):
+        key = self._labels(labelvalues)
+        self._counts.pop(key, None)
+        self._sums.pop(key, None)
+
+    def samples(self) -> List[str]:
+        lines = []
+        for key, counts in sorted(self._counts.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                le = '+Inf' if bound == math.inf else str(bound)
+                lines.append(f'{self.name}_bucket{self._format_labels(key, {"le": le})} {cumulative}')
+            lines.append(f'{self.name}_sum{self._format_labels(key)} {self._sums[key]}')
+            lines.append(f'{self.name}_count{self._format_labels(key)} {cumulative}')
+        return lines
+
+
+class Registry:
+    """a collection of metrics"""
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def _get_or_create(self, cls, name: str, documentation: str, labelnames: Tuple[str, ...], **kwargs):
+        metric = self._metrics.get(name)
+        if metric is None:
+            metric = cls(name, documentation, labelnames, **kwargs)
+            self._metrics[name] = metric
+        elif not isinstance(metric, cls) or metric.labelnames != labelnames:
+            raise ValueError(f'metric {name} is already registered with a different type or labels')
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()) -> Counter:
+        """get or create a :class:`Counter`"""
+        return self._get_or_create(Counter, name, documentation, labelnames)
+
+    def gauge(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()) -> Gauge:
+        """get or create a :class:`Gauge`"""
+        return self._get_or_create(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                  buckets: Sequence[float] = Histogram.DEFAULT_BUCKETS) -> Histogram:
+        """get or create a :class:`Histogram`"""
+        return self._get_or_create(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def render(self) -> str:
+        """render all metrics in the prometheus text exposition format
+
+        :return: the rendered metrics
+        :rtype: str
+        """
+        return ''.join(m.render() + '\n' for m in self._metrics.values())
+
+
+#: the default registry
+REGISTRY = Registry()
+
+
+@asynccontextmanager
+async def http_server(conf: Optional[Dict], port_offset: int = 0, registry: Registry = REGISTRY):
+    """serve the metrics of the registry at `/metrics` while the context is active
+
+    :param conf: the metrics config with the `port` and the optional `host`. None to not serve the metrics
+    :type conf: dict or None
+    :param port_offset: added to the configured port (e.g. the number of a worker process)
+    :type port_offset: int
+    :param registry: the registry to serve
+    :type registry: :class:`Registry`
+    """
+    if conf is None:
+        yield
+        return
+    from aiohttp import web
+
+    async def handle(request):
+        return web.Response(body=registry.render().encode(), headers={'Content-Type': CONTENT_TYPE})
+
+    app = web.Application()
+    app.router.add_get('/metrics', handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    try:
+        host = conf.get('host', DEFAULT_HOST)
+        port = conf['port'] + port_offset
+        await web.TCPSite(runner, host, port).start()
+        logger.info(f'serving metrics on http://{host}:{port}/metrics')
+        yield
+    finally:
+        await runner.cleanup()
@@ -15,10 +15,10 @@
 
 
 from enum import Enum
-from typing import Optional, List, Tuple
+from typing import Dict, Iterable, Iterator, Optional, List, Tuple
 import json
 import datetime
-from dateutil import parser
+import struct
 
 
 class ResultStatus(str, Enum):
@@ -33,6 +33,123 @@ class ResultStatus(str, Enum):
     UNKNOWN_ERROR = 'UNKNOWN_ERROR'
 
 
+#: content type of results serialized with :meth:`Result.as_json`
+CONTENT_TYPE_JSON = 'application/json'
+#: content type of results serialized with :meth:`Result.as_bytes`
+CONTENT_TYPE_BINARY = 'application/vnd.awm.result'
+#: the available wire formats
+WIRE_FORMATS = {
+    'json': CONTENT_TYPE_JSON,
+    'binary': CONTENT_TYPE_BINARY,
+}
+
+# the binary format starts with a version byte, followed by the
+# fixed size fields and the length prefixed url and status message
+_BINARY_VERSION = 1
+_BINARY_HEADER = struct.Struct('<BHBqqHHI')
+# the binary format stores the status as index. New members must be appended
+_STATUS_CODES = {s: i for i, s in enumerate(ResultStatus)}
+_STATUSES = list(ResultStatus)
+_EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+_MICROSECOND = datetime.timedelta(microseconds=1)
+
+_FLAG_NAIVE = 1 << 0
+_FLAG_END_DT = 1 << 1
+_FLAG_RESPONSE_STATUS = 1 << 2
+_FLAG_REGEX_STATUS = 1 << 3
+_FLAG_REGEX_STATUS_VALUE = 1 << 4
+_FLAG_BODY_TRUNCATED = 1 << 5
+_FLAG_BODY_TRUNCATED_VALUE = 1 << 6
+_FLAG_STATUS_MESSAGE = 1 << 7
+# the scheduled time is appended after the status message. Older readers ignore it
+_FLAG_SCHEDULED_DT = 1 << 8
+_SCHEDULED_US = struct.Struct('<q')
+# the phase timings are appended after the scheduled time in microseconds. -1 for None
+_FLAG_TIMINGS = 1 << 9
+_TIMINGS_US = struct.Struct('<iiii')
+_MAX_TIMING_US = 2**31 - 1
+
+
+def _parse_dt(value: str) -> datetime.datetime:
+    """parse a datetime serialized by :meth:`Result.as_json`
+
+    :meth:`Result.as_json` writes `str(datetime)` which
+    :meth:`datetime.datetime.fromisoformat` parses much faster than
+    dateutil. dateutil is only used (and imported) for other formats.
+    """
+    try:
+        return datetime.datetime.fromisoformat(value)
+    except ValueError:
+        from dateutil import parser
+        return parser.parse(value)
+
+
+def _to_us(dt: datetime.datetime) -> int:
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=datetime.timezone.utc)
+    return (dt - _EPOCH) // _MICROSECOND
+
+
+def _from_us(us: int, naive: bool) -> datetime.datetime:
+    dt = _EPOCH + datetime.timedelta(microseconds=us)
+    return dt.replace(tzinfo=None) if naive else dt
+
+
+class Timings:
+    """
+    the durations of the phases of a check in seconds
+
+    The durations are measured with a monotonic clock. A phase that didn't
+    happen (e.g. connecting with a reused connection) is None.
+
+    :param dns: resolving the host name. 0 when the host name was cached
+    :type dns: float or None
+    :param connect: creating the connection, including the TLS handshake
+    :type connect: float or None
+    :param ttfb: the time to the first byte, from sending the request to receiving the response headers
+    :type ttfb: float or None
+    :param body: reading the checked part of the response body
+    :type body: float or None
+    """
+    __slots__ = ('dns', 'connect', 'ttfb', 'body')
+
+    #: the phases in the order of a check
+    PHASES = ('dns', 'connect', 'ttfb', 'body')
+
+    def __init__(self, dns: Optional[float] = None, connect: Optional[float] = None,
+                 ttfb: Optional[float] = None, body: Optional[float] = None):
+        self.dns = dns
+        self.connect = connect
+        self.ttfb = ttfb
+        self.body = body
+
+    def as_dict(self) -> Dict[str, Optional[float]]:
+        """get the durations with the phase as key"""
+        return {phase: getattr(self, phase) for phase in self.PHASES}
+
+    def as_us(self) -> Tuple[int, ...]:
+        """get the durations in microseconds. -1 for None"""
+        return tuple(-1 if v is None else min(int(v * 1e6), _MAX_TIMING_US)
+                     for v in (self.dns, self.connect, self.ttfb, self.body))
+
+    @staticmethod
+    def from_us(values: Iterable[int]) -> 'Timings':
+        """create :class:`Timings` from durations in microseconds. -1 for None"""
+        return Timings(*(None if v < 0 else v / 1e6 for v in values))
+
+    def __repr__(self):
+        return 'Timings({})'.format(', '.join(f'{k}={v}' for k, v in self.as_dict().items()))
+
+    def __eq__(self, other):
+        if isinstance(other, Timings):
+            return self.as_dict() == other.as_dict()
+        return False
+
+
+def _interval(seconds: Optional[float]) -> Optional[datetime.timedelta]:
+    return None if seconds is None else datetime.timedelta(seconds=seconds)
+
+
 class Result:
     """
     a crawler result
@@ -51,10 +168,29 @@ class Result:
     :type status: :class:`ResultStatus`
     :param status_message: optional status message. Only used when status is not :attr:`ResultStatus.SUCCESSFUL`
     :type status_message: str or None
+    :param response_body_truncated: True if the response body was not completely checked
+                                    because the configured size limit was reached
+    :type response_body_truncated: bool or None
+    :param scheduled_dt: the datetime the check was scheduled for
+    :type scheduled_dt: datetime or None
+    :param timings: the durations of the phases of the check
+    :type timings: :class:`Timings` or None
     """
+    __slots__ = ('_url', '_start_dt', '_end_dt', '_duration', '_response_status', '_response_regex_status',
+                 '_status', '_status_message', '_response_body_truncated', '_scheduled_dt', '_timings')
+
+    #: the `crawler_results` columns used by :meth:`Result.sql_values`
+    #: `repeats` is the number of identical results that were not written since the previous row
+    SQL_COLUMNS = ('url', 'start_time', 'end_time', 'response_time', 'response_status',
+                   'response_regex_status', 'status', 'status_message', 'response_body_truncated', 'repeats',
+                   'scheduled_time', 'dns_time', 'connect_time', 'ttfb', 'body_time')
+
     def __init__(self, url: str, start_dt: datetime.datetime, end_dt: Optional[datetime.datetime],
                  response_status: Optional[int], response_regex_status: Optional[bool],
-                 status: ResultStatus, status_message: Optional[str]):
+                 status: ResultStatus, status_message: Optional[str],
+                 response_body_truncated: Optional[bool] = None,
+                 scheduled_dt: Optional[datetime.datetime] = None,
+                 timings: Optional[Timings] = None):
         self._url = url
         self._start_dt = start_dt
         self._end_dt = end_dt
@@ -62,6 +198,10 @@ class Result:
         self._response_regex_status = response_regex_status
         self._status = status
         self._status_message = status_message
+        self._response_body_truncated = response_body_truncated
+        self._scheduled_dt = scheduled_dt
+        self._timings = timings
+        self._duration = end_dt - start_dt if start_dt and end_dt else None
 
     @property
     def url(self) -> str:
@@ -77,9 +217,23 @@ class Result:
 
     @property
     def duration(self) -> Optional[datetime.timedelta]:
-        if self._start_dt and self._end_dt:
-            return self._end_dt - self._start_dt
-        return None
+        return self._duration
+
+    @property
+    def scheduled_dt(self) -> Optional[datetime.datetime]:
+        return self._scheduled_dt
+
+    @property
+    def lateness(self) -> Optional[datetime.timedelta]:
+        """how late the check started compared to its scheduled time"""
+        if self._scheduled_dt is None:
+            return None
+        return self._start_dt - self._scheduled_dt
+
+    @property
+    def timings(self) -> Optional[Timings]:
+        """the durations of the phases of the check"""
+        return self._timings
 
     @property
     def response_status(self):
@@ -89,6 +243,10 @@ class Result:
     def response_regex_status(self):
         return self._response_regex_status
 
+    @property
+    def response_body_truncated(self) -> Optional[bool]:
+        return self._response_body_truncated
+
     @property
     def status(self) -> ResultStatus:
         return self._status
@@ -105,14 +263,126 @@ class Result:
         :return: a :class:`Result` instance
         :rtype: :class:`Result`
         """
-        start_dt = parser.parse(d['start_dt'])
+        start_dt = _parse_dt(d['start_dt'])
         end_dt = None
         if d['end_dt']:
-            end_dt = parser.parse(d['end_dt'])
+            end_dt = _parse_dt(d['end_dt'])
+        scheduled_dt = None
+        if d.get('scheduled_dt'):
+            scheduled_dt = _parse_dt(d['scheduled_dt'])
+        timings = None
+        if d.get('timings'):
+            timings = Timings(**d['timings'])
 
         return Result(d['url'], start_dt, end_dt,
                       d['response_status'], d['response_regex_status'],
-                      d['status'], d['status_message'])
+                      d['status'], d['status_message'], d.get('response_body_truncated'), scheduled_dt, timings)
+
+    @staticmethod
+    def from_bytes(data: bytes):
+        """create a :class:`Result` from data serialized with :meth:`Result.as_bytes`
+
+        :param data: the binary data
+
+        :raises ValueError: Raised when the data has an unknown version
+
+        :return: a :class:`Result` instance
+        :rtype: :class:`Result`
+        """
+        if not data or data[0] != _BINARY_VERSION:
+            raise ValueError(f'unknown binary result version {data[:1]!r}')
+        (_, flags, status, start_us, end_us, response_status,
+         url_len, msg_len) = _BINARY_HEADER.unpack_from(data)
+        pos = _BINARY_HEADER.size
+        url = data[pos:pos + url_len].decode()
+        pos += url_len
+        naive = bool(flags & _FLAG_NAIVE)
+        trailer = pos + msg_len
+        scheduled_dt = None
+        if flags & _FLAG_SCHEDULED_DT:
+            scheduled_dt = _from_us(_SCHEDULED_US.unpack_from(data, trailer)[0], naive)
+            trailer += _SCHEDULED_US.size
+        timings = None
+        if flags & _FLAG_TIMINGS:
+            timings = Timings.from_us(_TIMINGS_US.unpack_from(data, trailer))
+        return Result(
+            url, _from_us(start_us, naive),
+            _from_us(end_us, naive) if flags & _FLAG_END_DT else None,
+            response_status if flags & _FLAG_RESPONSE_STATUS else None,
+            bool(flags & _FLAG_REGEX_STATUS_VALUE) if flags & _FLAG_REGEX_STATUS else None,
+            _STATUSES[status],
+            data[pos:pos + msg_len].decode() if flags & _FLAG_STATUS_MESSAGE else None,
+            bool(flags & _FLAG_BODY_TRUNCATED_VALUE) if flags & _FLAG_BODY_TRUNCATED else None,
+            scheduled_dt, timings)
+
+    def as_bytes(self) -> bytes:
+        """serialize :class:`Result` in the compact binary format
+
+        Datetimes are stored as microseconds since the epoch
+
+        :return: the binary data
+        :rtype: bytes
+        """
+        flags = 0
+        if self._start_dt.tzinfo is None:
+            flags |= _FLAG_NAIVE
+        if self._end_dt is not None:
+            flags |= _FLAG_END_DT
+        if self._response_status is not None:
+            flags |= _FLAG_RESPONSE_STATUS
+        if self._response_regex_status is not None:
+            flags |= _FLAG_REGEX_STATUS
+            if self._response_regex_status:
+                flags |= _FLAG_REGEX_STATUS_VALUE
+        if self._response_body_truncated is not None:
+            flags |= _FLAG_BODY_TRUNCATED
+            if self._response_body_truncated:
+                flags |= _FLAG_BODY_TRUNCATED_VALUE
+        msg = b''
+        if self._status_message is not None:
+            flags |= _FLAG_STATUS_MESSAGE
+            msg = self._status_message.encode()
+        trailer = b''
+        if self._scheduled_dt is not None:
+            flags |= _FLAG_SCHEDULED_DT
+            trailer += _SCHEDULED_US.pack(_to_us(self._scheduled_dt))
+        if self._timings is not None:
+            flags |= _FLAG_TIMINGS
+            trailer += _TIMINGS_US.pack(*self._timings.as_us())
+        url = self._url.encode()
+        return _BINARY_HEADER.pack(
+            _BINARY_VERSION, flags, _STATUS_CODES[ResultStatus(self._status)],
+            _to_us(self._start_dt), _to_us(self._end_dt) if self._end_dt is not None else 0,
+            self._response_status or 0, len(url), len(msg)) + url + msg + trailer
+
+    def encode(self, content_type: str) -> bytes:
+        """serialize :class:`Result` for the given content type
+
+        :param content_type: :data:`CONTENT_TYPE_JSON` or :data:`CONTENT_TYPE_BINARY`
+        :type content_type: str
+
+        :return: the serialized result
+        :rtype: bytes
+        """
+        if content_type == CONTENT_TYPE_BINARY:
+            return self.as_bytes()
+        return self.as_json().encode()
+
+    @staticmethod
+    def decode(data: bytes, content_type: Optional[str]):
+        """create a :class:`Result` from data serialized with :meth:`Result.encode`
+
+        :param data: the serialized result
+        :type data: bytes
+        :param content_type: the content type. JSON is assumed when None
+        :type content_type: str or None
+
+        :return: a :class:`Result` instance
+        :rtype: :class:`Result`
+        """
+        if content_type == CONTENT_TYPE_BINARY:
+            return Result.from_bytes(data)
+        return Result.from_json(json.loads(data.decode()))
 
     def as_json(self) -> str:
         """serialize :class:`Result` as json
@@ -129,26 +399,42 @@ class Result:
             'response_regex_status': self.response_regex_status,
             'status': self._status,
             'status_message': self._status_message,
+            'response_body_truncated': self._response_body_truncated,
+            'scheduled_dt': self._scheduled_dt,
+            'lateness': self.lateness,
+            'timings': self._timings.as_dict() if self._timings is not None else None,
         }, default=str)
 
-    def sql(self) -> Tuple[str, List]:
+    def sql(self, url_ids: Dict[str, int]) -> Tuple[str, List]:
         """get a SQL statement and the needed arguments
 
+        :param url_ids: the ids of the urls in the `urls` table
+        :type url_ids: dict
+
         :return: a tuple with the sql statement and the needed arguments
         :rtype: (str, list)
         """
-        # INFO: remember https://www.psycopg.org/docs/usage.html#the-problem-with-the-query-parameters
+        return ResultBatch([self]).sql(url_ids)
+
+    def sql_values(self) -> Tuple:
+        """get the values for a row in the `crawler_results` table
+
+        The values are ordered like :attr:`Result.SQL_COLUMNS`
+
+        :return: a tuple with the column values
+        :rtype: tuple
+        """
+        # the phases before a failure (e.g. a timeout after connecting) are kept
+        phases: Tuple = (None, None, None, None)
+        if self._timings is not None:
+            phases = tuple(_interval(v) for v in (self._timings.dns, self._timings.connect,
+                                                  self._timings.ttfb, self._timings.body))
         if self.status == ResultStatus.SUCCESSFUL:
-            sql = """INSERT INTO crawler_results(url, start_time, end_time, response_time, response_status, response_regex_status, status)
-            VALUES (%s, %s, %s, %s, %s, %s, %s);"""
-            sql_args = [self.url, self.start_dt, self.end_dt, self.duration,
-                        self.response_status, self.response_regex_status, self.status]
-            return (sql, sql_args)
-        else:
-            sql = """INSERT INTO crawler_results(url, start_time, status, status_message)
-            VALUES (%s, %s, %s, %s);"""
-            sql_args = [self.url, self.start_dt, self.status, self.status_message or '']
-            return (sql, sql_args)
+            return (self.url, self.start_dt, self.end_dt, self.duration,
+                    self.response_status, self.response_regex_status, self.status, None,
+                    self.response_body_truncated, 0, self.scheduled_dt) + phases
+        return (self.url, self.start_dt, None, None, None, None, self.status, self.status_message or '', None, 0,
+                self.scheduled_dt) + phases
 
     def __repr__(self):
         msg = f'{self._url} ({self._status})'
@@ -166,5 +452,95 @@ class Result:
                 self.response_status == other.response_status and \
                 self.response_regex_status == other.response_regex_status and \
                 self.status == other.status and \
-                self.status_message == other.status_message
+                self.status_message == other.status_message and \
+                self.response_body_truncated == other.response_body_truncated and \
+                self.scheduled_dt == other.scheduled_dt and \
+                self.timings == other.timings
         return False
+
+
+class ResultBatch:
+    """
+    a columnar collection of results
+
+    The values are stored in one list per column of :attr:`Result.SQL_COLUMNS`
+    instead of keeping a :class:`Result` instance per result.
+
+    :param results: the initial results
+    :type results: iterable of :class:`Result`
+    """
+    __slots__ = ('_columns',)
+
+    def __init__(self, results: Iterable[Result] = ()):
+        self._columns: Tuple[List, ...] = tuple([] for _ in Result.SQL_COLUMNS)
+        self.extend(results)
+
+    def __len__(self) -> int:
+        return len(self._columns[0])
+
+    def append(self, res: Result):
+        """add a result to the batch
+
+        :param res: the result
+        :type res: :class:`Result`
+        """
+        self.append_row(res.sql_values())
+
+    def append_row(self, row: Tuple):
+        """add a row to the batch
+
+        :param row: the column values ordered like :attr:`Result.SQL_COLUMNS`
+        :type row: tuple
+        """
+        for column, value in zip(self._columns, row):
+            column.append(value)
+
+    def extend(self, results: Iterable[Result]):
+        """add multiple results to the batch
+
+        :param results: the results
+        :type results: iterable of :class:`Result`
+        """
+        for res in results:
+            self.append(res)
+
+    def column(self, name: str) -> List:
+        """get all values of a column
+
+        :param name: the column name. One of :attr:`Result.SQL_COLUMNS`
+        :type name: str
+
+        :return: the column values
+        :rtype: list
+        """
+        return self._columns[Result.SQL_COLUMNS.index(name)]
+
+    def rows(self) -> Iterator[Tuple]:
+        """iterate over the rows of the batch
+
+        :return: an iterator of tuples ordered like :attr:`Result.SQL_COLUMNS`
+        :rtype: iterator
+        """
+        return zip(*self._columns)
+
+    def sql(self, url_ids: Dict[str, int]) -> Tuple[str, List]:
+        """get a single multi-row SQL INSERT statement for all results in the batch
+
+        The `url` column is replaced by the `url_id` referencing the `urls` table
+
+        :param url_ids: the ids of the urls in the `urls` table
+        :type url_ids: dict
+
+        :return: a tuple with the sql statement and the needed arguments
+        :rtype: (str, list)
+        """
+        # INFO: remember https://www.psycopg.org/docs/usage.html#the-problem-with-the-query-parameters
+        columns = ['url_id' if c == 'url' else c for c in Result.SQL_COLUMNS]
+        row = '({})'.format(', '.join(['%s'] * len(columns)))
+        sql = 'INSERT INTO crawler_results({}) VALUES {};'.format(', '.join(columns), ', '.join([row] * len(self)))
+        url_index = Result.SQL_COLUMNS.index('url')
+        sql_args: List = []
+        for r in self.rows():
+            sql_args.extend(r)
+            sql_args[url_index - len(r)] = url_ids[r[url_index]]
+        return (sql, sql_args)
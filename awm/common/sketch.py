@@ -0,0 +1,104 @@
+# Copyright (c) 2020 Thomas Bechtold <thomasbechtold@jpberlin.de>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""
+A mergeable latency sketch with logarithmic buckets.
+
+Every bucket covers the values between two powers of :data:`GAMMA`, so
+quantiles have a relative error of at most (GAMMA - 1) / (GAMMA + 1).
+Sketches are merged by adding the bucket counts, which also works in SQL.
+"""
+
+import math
+from typing import Dict, Optional
+
+
+#: the ratio between the upper bounds of two consecutive buckets
+GAMMA = 1.1
+#: values up to this number of seconds are counted in bucket 0
+MIN_VALUE = 0.0001
+_LOG_GAMMA = math.log(GAMMA)
+
+
+class LatencySketch:
+    """
+    a mergeable histogram of latencies in seconds
+
+    :param buckets: the bucket counts by bucket index
+    :type buckets: dict or None
+    """
+    __slots__ = ('_buckets', '_count')
+
+    def __init__(self, buckets: Optional[Dict[int, int]] = None):
+        self._buckets: Dict[int, int] = dict(buckets or {})
+        self._count = sum(self._buckets.values())
+
+    @property
+    def count(self) -> int:
+        return self._count
+
+    def add(self, seconds: float):
+        """add a latency
+
+        :param seconds: the latency in seconds
+        :type seconds: float
+        """
+        index = 0
+        if seconds > MIN_VALUE:
+            index = math.ceil(math.log(seconds / MIN_VALUE) / _LOG_GAMMA)
+        self._buckets[index] = self._buckets.get(index, 0) + 1
+        self._count += 1
+
+    def merge(self, other: 'LatencySketch'):
+        """add the counts of another sketch to this sketch
+
+        :param other: the other sketch
+        :type other: :class:`LatencySketch`
+        """
+        for index, count in other._buckets.items():
+            self._buckets[index] = self._buckets.get(index, 0) + count
+        self._count += other._count
+
+    def quantile(self, q: float) -> Optional[float]:
+        """get the estimated latency at the given quantile
+
+        :param q: the quantile between 0 and 1 (e.g. 0.95 for p95)
+        :type q: float
+
+        :return: the latency in seconds or None if the sketch is empty
+        :rtype: float or None
+        """
+        if not self._count:
+            return None
+        rank = q * (self._count - 1)
+        seen = 0
+        for index in sorted(self._buckets):
+            seen += self._buckets[index]
+            if seen > rank:
+                break
+        if index == 0:
+            return MIN_VALUE
+        # the value between the bucket bounds with the lowest relative error
+        return MIN_VALUE * GAMMA ** index * 2 / (1 + GAMMA)
+
+    def to_json(self) -> Dict[str, int]:
+        """serialize the bucket counts as json object (json keys are strings)"""
+        return {str(index): count for index, count in self._buckets.items()}
+
+    @staticmethod
+    def from_json(d: Dict[str, int]) -> 'LatencySketch':
+        """create a :class:`LatencySketch` from :meth:`LatencySketch.to_json` data"""
+        return LatencySketch({int(index): int(count) for index, count in d.items()})
@@ -17,112 +17,62 @@
 
 """
 Periodically monitor website status and publish to kafka
-"""
 
+Only the command line is defined here. The service (see
+:mod:`awm.crawler.service`) and its dependencies are imported after the
+arguments are parsed, so `--help` starts fast.
+"""
 
-from pathlib import Path
 import argparse
-import datetime
-import logging
-import time
-import asyncio
-import aiohttp
-import re
-from typing import Optional
-
-from ..common import config
-from ..common import kafka_utils
-from ..common.result import Result, ResultStatus
-
-logger = logging.getLogger(__name__)
-
-
-def _response_regex_status(regex: Optional[str], response_text: str) -> Optional[bool]:
-    response_regex_status = None
-    if regex:
-        match = re.search(r'{}'.format(regex), response_text)
-        if match:
-            response_regex_status = True
-        else:
-            response_regex_status = False
-    return response_regex_status
-
-
-async def _fetch_url(session: aiohttp.ClientSession, url: str, response_regex: Optional[str]) -> Result:
-    """
-    Fetch the given url and get status
-    """
-    start = datetime.datetime.now(datetime.timezone.utc)
-    try:
-        async with session.get(url) as response:
-            response_text = await response.text()
-    except aiohttp.client_exceptions.ClientConnectorError as e:
-        logger.warning(f'{url}: connection error: {str(e)}')
-        return Result(url, start, None, None, None, ResultStatus.CLIENT_ERROR, str(e))
-    except asyncio.exceptions.TimeoutError as e:
-        logger.warning(f'{url}: timeout after {session.timeout}s')
-        return Result(url, start, None, None, None, ResultStatus.TIMEOUT, str(e))
-    except Exception as e:
-        logger.exception(e)
-        return Result(url, start, None, None, None, ResultStatus.UNKNOWN_ERROR, str(e))
-    else:
-        end = datetime.datetime.now(datetime.timezone.utc)
-
-        return Result(url, start, end, response.status, _response_regex_status(response_regex, response_text),
-                      ResultStatus.SUCCESSFUL, None)
-
-
-async def _handle_url(conf, kafka_producer, session: aiohttp.ClientSession, url: str):
-    # allow to override the check interval on a url base
-    interval = conf['crawler']['urls'][url].get('interval', conf['crawler']['interval'])
-    while True:
-        start = time.time()
-        try:
-            res = await asyncio.create_task(_fetch_url(session, url, conf['crawler']['urls'][url].get('regex')))
-            await kafka_producer.send(conf['kafka']['topic_name'], res.as_json().encode())
-        except Exception as e:
-            logging.exception(e)
-        else:
-            logger.info(res)
-        wait_for = max(0, interval - (time.time() - start))
-        logger.info(f'waiting {wait_for:.2f} s before checking {url} again...')
-        await asyncio.sleep(wait_for)
-
-
-async def _crawl(conf):
-    async with kafka_utils.kafka_producer(conf['kafka']['servers'], conf['kafka']['ssl']) as producer:
-        # make sure the check doesn't need longer than configured check interval
-        timeout = aiohttp.ClientTimeout(total=conf['crawler']['interval'])
-        async with aiohttp.ClientSession(timeout=timeout) as session:
-            tasks = []
-            for url, url_conf in conf['crawler']['urls'].items():
-                tasks.append(asyncio.create_task(_handle_url(conf, producer, session, url), name=url))
-            logger.info(f'scheduled {len(tasks)} tasks...')
-            await asyncio.gather(*tasks)
+import os
 
 
 def _parser():
     parser = argparse.ArgumentParser(
         description='Periodically monitor website status and publish to kafka')
+    # level names, so the logging module is not imported for --help
     parser.add_argument('-d', '--debug', help="set loglevel to DEBUG",
-                        action="store_const", dest="loglevel", const=logging.DEBUG,
-                        default=logging.WARNING)
+                        action="store_const", dest="loglevel", const='DEBUG',
+                        default='WARNING')
     parser.add_argument('-v', '--verbose', help="set loglevel to INFO",
-                        action="store_const", dest="loglevel", const=logging.INFO)
+                        action="store_const", dest="loglevel", const='INFO')
     parser.add_argument('-c', '--config', help="path to the config file. Default: %(default)s",
-                        default=f'{Path.home()}/.config/awm/config.json')
+                        default=os.path.expanduser('~/.config/awm/config.json'))
+    parser.add_argument('-w', '--workers', help="number of worker processes. The urls are split "
+                        "between the workers. Default: %(default)s", type=int, default=1)
+    parser.add_argument('-t', '--check-config', help="validate the config file and exit",
+                        action='store_true')
     return parser
 
 
 def main():
-    """main entry point for the persister service.
-    This is used by the executable `awm-persister`
+    """main entry point for the crawler service.
+    This is used by the executable `awm-crawler`
     """
     parser = _parser()
     args = parser.parse_args()
+    from ..common import config
+    from ..common.exception import AwmConfigError
+    try:
+        conf = config.get_config(args.config)
+        if args.check_config:
+            config.validate_crawler(conf)
+    except AwmConfigError as e:
+        parser.exit(1, f'invalid config {args.config}: {e}\n')
+    if args.check_config:
+        parser.exit(0, f'config {args.config} is valid\n')
+    # imported after the validation, so -t doesn't pay for logging and the service
+    import asyncio
+    import logging
+    from . import service
     logging.basicConfig(level=args.loglevel)
-    conf = config.get_config(args.config)
-    asyncio.run(_crawl(conf))
+    logging.getLogger(__name__).info(f'using config {args.config}')
+    if args.workers > 1:
+        from . import supervisor
+        supervisor.Supervisor(lambda worker: asyncio.run(service._crawl(conf, worker, args.workers, args.config)),
+                              args.workers).run()
+    else:
+        asyncio.run(service._crawl(conf, config_path=args.config))
 
 
 # for debugging
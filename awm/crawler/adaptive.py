@@ -0,0 +1,209 @@
+# Copyright (c) 2020 Thomas Bechtold <thomasbechtold@jpberlin.de>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""
+Adapt the check intervals to the results
+
+Urls which fail (timeouts, connection errors) over and over again are
+checked less often and the checks of a host that keeps failing are
+short-circuited, so dead targets don't use up the concurrency and the
+timeouts the healthy checks need.
+"""
+
+import logging
+import time
+from typing import Dict, Optional, Tuple
+from urllib.parse import urlsplit
+
+from ..common import metrics
+from ..common.result import Result, ResultStatus
+
+
+logger = logging.getLogger(__name__)
+
+#: the factor the interval of a failing url grows with every failed check
+BACKOFF_FACTOR = 2.0
+#: the default number of consecutive failed checks of a host that open its circuit
+DEFAULT_CIRCUIT_FAILURES = 5
+#: the default number of seconds a circuit stays open before a single check is let through
+DEFAULT_CIRCUIT_RESET_TIMEOUT = 60.0
+
+_circuit_skipped_total = metrics.REGISTRY.counter(
+    'awm_crawler_circuit_skipped_total', 'Number of checks skipped because the circuit of the host was open')
+
+
+def _failed(res: Result) -> bool:
+    return res.status != ResultStatus.SUCCESSFUL
+
+
+class _UrlState:
+    __slots__ = ('state', 'failures', 'confirming')
+
+    def __init__(self, state: Tuple, failures: int):
+        self.state = state
+        self.failures = failures
+        self.confirming = False
+
+
+class AdaptiveIntervals:
+    """
+    Per url check intervals which adapt to the results
+
+    A url that failed more than once in a row backs off: the interval grows
+    by :data:`BACKOFF_FACTOR` with every failed check, up to `max_interval`.
+    After a change of the result state (status, response status or regex
+    status), the url is checked again after `confirm_interval` seconds to
+    confirm the change. A confirmation check doesn't trigger another one,
+    so flapping urls get at most one extra check per regular check.
+
+    :param max_interval: the maximum interval in seconds of a failing url. None to disable the backoff
+    :type max_interval: float or None
+    :param confirm_interval: the number of seconds after a state change until the confirmation check.
+                             None to disable confirmation checks
+    :type confirm_interval: float or None
+    """
+    def __init__(self, max_interval: Optional[float] = None, confirm_interval: Optional[float] = None):
+        self._max_interval = max_interval
+        self._confirm_interval = confirm_interval
+        self._states: Dict[str, _UrlState] = {}
+
+    def __len__(self):
+        return len(self._states)
+
+    def delay(self, url: str, interval: float, res: Result) -> Optional[float]:
+        """get the number of seconds until the next check of a url
+
+        :param url: the url
+        :type url: str
+        :param interval: the configured check interval of the url in seconds
+        :type interval: float
+        :param res: the result of the last check
+        :type res: :class:`awm.common.result.Result`
+
+        :return: the delay or None for the next regular check
+        :rtype: float or None
+        """
+        state = (res.status, res.response_status, res.response_regex_status)
+        url_state = self._states.get(url)
+        if url_state is None:
+            url_state = self._states[url] = _UrlState(state, int(_failed(res)))
+            return None
+        changed = url_state.state != state
+        confirm = changed and not url_state.confirming and self._confirm_interval is not None and \
+            self._confirm_interval < interval
+        url_state.state = state
+        url_state.failures = url_state.failures + 1 if _failed(res) else 0
+        url_state.confirming = confirm
+        if confirm:
+            return self._confirm_interval
+        if self._max_interval is not None and url_state.failures > 1:
+            return min(interval * BACKOFF_FACTOR ** (url_state.failures - 1), max(self._max_interval, interval))
+        return None
+
+    def forget(self, url: str):
+        """drop the state of a url (e.g. when it is not checked anymore)
+
+        :param url: the url
+        :type url: str
+        """
+        self._states.pop(url, None)
+
+
+class _HostState:
+    __slots__ = ('failures', 'opened', 'probing')
+
+    def __init__(self):
+        self.failures = 0
+        self.opened: Optional[float] = None
+        # the start of the check let through while the circuit is open
+        self.probing: Optional[float] = None
+
+
+class CircuitBreaker:
+    """
+    A circuit breaker per host
+
+    After `failures` consecutive failed checks of the urls of a host, the
+    circuit of the host opens and its checks are skipped. After
+    `reset_timeout` seconds a single check is let through. Its success
+    closes the circuit, its failure keeps the circuit open for another
+    `reset_timeout` seconds. When no result of that check is recorded
+    within `reset_timeout` seconds (e.g. it was cancelled or its url was
+    removed), the next check is let through.
+
+    :param failures: the number of consecutive failed checks of a host that open its circuit
+    :type failures: int
+    :param reset_timeout: the number of seconds a circuit stays open before a single check is let through
+    :type reset_timeout: float
+    """
+    def __init__(self, failures: int = DEFAULT_CIRCUIT_FAILURES,
+                 reset_timeout: float = DEFAULT_CIRCUIT_RESET_TIMEOUT):
+        self._failures = failures
+        self._reset_timeout = reset_timeout
+        # only hosts with failed checks have a state
+        self._hosts: Dict[str, _HostState] = {}
+
+    @property
+    def open(self) -> int:
+        """the number of hosts with an open circuit"""
+        return sum(1 for h in self._hosts.values() if h.opened is not None)
+
+    @staticmethod
+    def host(url: str) -> str:
+        """get the host (with the port) of a url"""
+        return urlsplit(url).netloc
+
+    def allow(self, url: str) -> bool:
+        """check if a url can be checked
+
+        :param url: the url
+        :type url: str
+
+        :return: False if the circuit of the host of the url is open
+        :rtype: bool
+        """
+        host_state = self._hosts.get(self.host(url))
+        if host_state is None or host_state.opened is None:
+            return True
+        now = time.monotonic()
+        if now - host_state.opened >= self._reset_timeout and \
+                (host_state.probing is None or now - host_state.probing >= self._reset_timeout):
+            host_state.probing = now
+            return True
+        _circuit_skipped_total.inc()
+        return False
+
+    def record(self, url: str, res: Result):
+        """record the result of a check
+
+        :param url: the url
+        :type url: str
+        :param res: the result of the check
+        :type res: :class:`awm.common.result.Result`
+        """
+        host = self.host(url)
+        if not _failed(res):
+            host_state = self._hosts.pop(host, None)
+            if host_state is not None and host_state.opened is not None:
+                logger.warning(f'{host}: circuit closed')
+            return
+        host_state = self._hosts.setdefault(host, _HostState())
+        host_state.probing = None
+        host_state.failures += 1
+        if host_state.failures >= self._failures:
+            if host_state.opened is None:
+                logger.warning(f'{host}: circuit opened after {host_state.failures} failed checks')
+            host_state.opened = time.monotonic()
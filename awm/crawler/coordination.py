@@ -0,0 +1,146 @@
+# Copyright (c) 2020 Thomas Bechtold <thomasbechtold@jpberlin.de>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""
+Split the urls between multiple crawler nodes with the kafka consumer
+group protocol.
+
+Every node joins the same consumer group and subscribes to a coordination
+topic. Every url belongs to one partition of that topic (see
+:func:`awm.crawler.urls.shard`) and a node only checks the urls of the
+partitions kafka assigned to it. When nodes join or leave, kafka
+rebalances the partitions and the urls move with them.
+"""
+
+import logging
+from typing import Callable, Dict, List, Optional, Set
+
+from aiokafka import ConsumerRebalanceListener
+
+from ..common import kafka_utils
+from . import reload
+from . import scheduler
+from . import urls
+
+
+logger = logging.getLogger(__name__)
+
+#: the default coordination topic. The number of partitions limits the number of nodes
+DEFAULT_TOPIC = 'awm-crawler-coordination'
+#: the default consumer group of the crawler nodes
+DEFAULT_GROUP_ID = 'awm-crawler'
+
+
+class UrlAssignment(ConsumerRebalanceListener):
+    """
+    Keep the scheduled urls in sync with the assigned coordination topic partitions
+
+    The urls of a partition are looked up in `url_confs` on every
+    rebalance, so urls added to or removed from it (see
+    :mod:`awm.crawler.reload`) move with their partition. The number of
+    partitions is looked up again on every assignment, so partitions added
+    to the topic are used after the next rebalance.
+
+    :param consumer: the consumer of the coordination topic
+    :type consumer: :class:`aiokafka.AIOKafkaConsumer`
+    :param topic: the coordination topic
+    :type topic: str
+    :param url_confs: all configured urls
+    :type url_confs: dict
+    :param sched: the scheduler running the checks
+    :type sched: :class:`awm.crawler.scheduler.Scheduler`
+    :param forget: called with the urls of revoked partitions to drop the state kept for them
+    :type forget: callable or None
+    """
+    def __init__(self, consumer, topic: str, url_confs: Dict[str, urls.UrlConfig], sched: scheduler.Scheduler,
+                 forget: Optional[Callable[[str], None]] = None):
+        self._consumer = consumer
+        self._topic = topic
+        self._url_confs = url_confs
+        self._sched = sched
+        self._forget = forget or (lambda url: None)
+        self._num_partitions = 0
+        self._assigned: Set[int] = set()
+
+    def _partitions(self) -> int:
+        if not self._num_partitions:
+            self._num_partitions = len(self._consumer.partitions_for_topic(self._topic) or ())
+            if not self._num_partitions:
+                logger.error(f'no partitions found for coordination topic {self._topic}')
+        return self._num_partitions
+
+    def _urls(self, partitions: Set[int]) -> List[str]:
+        num_partitions = self._partitions()
+        if not num_partitions or not partitions:
+            return []
+        return [url for url in self._url_confs if urls.shard(url, num_partitions) in partitions]
+
+    def owns(self, url: str) -> bool:
+        """check if a url belongs to an assigned partition
+
+        :param url: the url
+        :type url: str
+
+        :rtype: bool
+        """
+        num_partitions = self._partitions()
+        return bool(num_partitions) and urls.shard(url, num_partitions) in self._assigned
+
+    async def on_partitions_revoked(self, revoked):
+        partitions = {tp.partition for tp in revoked if tp.topic == self._topic}
+        self._assigned -= partitions
+        for url in self._urls(partitions):
+            self._sched.remove(url)
+            self._forget(url)
+        logger.info(f'partitions revoked: {sorted(tp.partition for tp in revoked)}. {len(self._sched)} urls left')
+
+    async def on_partitions_assigned(self, assigned):
+        partitions = {tp.partition for tp in assigned if tp.topic == self._topic}
+        # the urls of the revoked partitions were removed with the previous number of partitions
+        self._num_partitions = 0
+        self._assigned |= partitions
+        for url in self._urls(partitions):
+            self._sched.add(url, self._url_confs[url].interval)
+        logger.info(f'partitions assigned: {sorted(tp.partition for tp in assigned)}. checking {len(self._sched)} urls')
+
+
+async def coordinate(conf, url_confs: Dict[str, urls.UrlConfig], sched: scheduler.Scheduler,
+                     reloader: Optional[reload.UrlReloader] = None, forget: Optional[Callable[[str], None]] = None):
+    """join the crawler group and schedule the urls of the assigned partitions until cancelled
+
+    :param conf: the configuration dict
+    :type conf: dict
+    :param url_confs: all configured urls
+    :type url_confs: dict
+    :param sched: the scheduler running the checks
+    :type sched: :class:`awm.crawler.scheduler.Scheduler`
+    :param reloader: the reloader of the url configuration. Only urls of assigned partitions get scheduled
+    :type reloader: :class:`awm.crawler.reload.UrlReloader` or None
+    :param forget: called with the urls of revoked partitions to drop the state kept for them
+    :type forget: callable or None
+    """
+    coordination_conf = conf['crawler']['coordination']
+    topic = coordination_conf.get('topic', DEFAULT_TOPIC)
+    async with kafka_utils.kafka_consumer(
+            conf['kafka']['servers'], [], coordination_conf.get('group_id', DEFAULT_GROUP_ID),
+            conf['kafka']['ssl']) as consumer:
+        listener = UrlAssignment(consumer, topic, url_confs, sched, forget)
+        if reloader is not None:
+            reloader.owns = listener.owns
+        consumer.subscribe([topic], listener=listener)
+        while True:
+            # the topic carries no data. Polling keeps the group membership alive
+            await consumer.getmany(timeout_ms=1000)
@@ -0,0 +1,317 @@
+# Copyright (c) 2020 Thomas Bechtold <thomasbechtold@jpberlin.de>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""
+Fetch the urls of the checks
+
+Checks of the same url (the same :func:`awm.crawler.urls.normalize` form
+and request method) which run at the same time share a single request.
+The response body is checked against the regexes of all of them. The
+scheduler derives the phase of a check from the normalized url, so the
+checks of the same url with the same interval are due at the same time.
+
+The `ETag` and `Last-Modified` validators of the last full response of a
+url are kept together with its regex statuses, so the next request is
+conditional (`If-None-Match`, `If-Modified-Since`). When the server
+answers `304 Not Modified`, the body is neither transferred nor checked
+and the results repeat the response status and the regex statuses of
+the last full response.
+"""
+
+import asyncio
+import datetime
+import logging
+from typing import TYPE_CHECKING, Dict, Optional, Pattern, Set, Tuple
+
+from ..common import metrics
+from ..common.result import Result, ResultStatus, Timings
+from . import timing
+from . import urls
+from .matcher import StreamMatcher
+
+if TYPE_CHECKING:
+    import aiohttp
+
+
+logger = logging.getLogger(__name__)
+
+#: the size of the body chunks the response regexes are checked against
+REGEX_CHUNK_SIZE = 64 * 1024
+
+_coalesced_total = metrics.REGISTRY.counter(
+    'awm_crawler_coalesced_total', 'Number of checks which shared the request of another check')
+_not_modified_total = metrics.REGISTRY.counter(
+    'awm_crawler_not_modified_total', 'Number of conditional requests answered with 304 Not Modified')
+
+# the regex, the overlap and the body limit of a check
+RegexKey = Tuple[Pattern, int, Optional[int]]
+# the regex status and if the body was truncated
+RegexStatus = Tuple[Optional[bool], Optional[bool]]
+
+
+def _regex_key(settings: urls.UrlSettings) -> Optional[RegexKey]:
+    if settings.regex is None:
+        return None
+    return (settings.regex, settings.regex_overlap, settings.max_body_bytes)
+
+
+async def _regex_statuses(response: 'aiohttp.ClientResponse',
+                          regexes: Set[RegexKey]) -> Dict[RegexKey, RegexStatus]:
+    """check the response body chunk by chunk against the regexes
+
+    Reading the body stops when every regex matched or reached its
+    `max_body_bytes`. The body is not read without a regex.
+
+    :return: the regex status and if the body was truncated per regex
+    :rtype: dict
+    """
+    statuses: Dict[RegexKey, RegexStatus] = {}
+    matchers = {}
+    for key in regexes:
+        regex, overlap, limit = key
+        matchers[key] = (StreamMatcher(regex, overlap, response.charset or 'utf-8'), limit)
+    if not matchers:
+        return statuses
+    read = 0
+    async for chunk in response.content.iter_chunked(REGEX_CHUNK_SIZE):
+        for key, (matcher, limit) in list(matchers.items()):
+            if limit is not None and read + len(chunk) > limit:
+                statuses[key] = (True, False) if matcher.feed(chunk[:limit - read]) else (matcher.finish(), True)
+                del matchers[key]
+            elif matcher.feed(chunk):
+                statuses[key] = (True, False)
+                del matchers[key]
+        if not matchers:
+            return statuses
+        read += len(chunk)
+    for key, (matcher, _) in matchers.items():
+        statuses[key] = (matcher.finish(), False)
+    return statuses
+
+
+class _Validators:
+    """the validators and the check results of the last full response of a url"""
+    __slots__ = ('etag', 'last_modified', 'response_status', 'regex_statuses')
+
+    def __init__(self, etag: Optional[str], last_modified: Optional[str], response_status: int,
+                 regex_statuses: Dict[RegexKey, RegexStatus]):
+        self.etag = etag
+        self.last_modified = last_modified
+        self.response_status = response_status
+        self.regex_statuses = regex_statuses
+
+
+class _Response:
+    """the outcome of a request, shared by the coalesced checks"""
+    __slots__ = ('start', 'end', 'response_status', 'status', 'status_message', 'regex_statuses', 'timings')
+
+    def __init__(self, start: datetime.datetime):
+        self.start = start
+        self.end: Optional[datetime.datetime] = None
+        self.response_status: Optional[int] = None
+        self.status = ResultStatus.SUCCESSFUL
+        self.status_message: Optional[str] = None
+        self.regex_statuses: Dict[RegexKey, RegexStatus] = {}
+        self.timings: Optional[Timings] = None
+
+    def regex_status(self, key: Optional[RegexKey]) -> Optional[RegexStatus]:
+        """get the status of a regex. None if the body wasn't checked against it"""
+        if key is None or self.status != ResultStatus.SUCCESSFUL:
+            return None, None
+        return self.regex_statuses.get(key)
+
+    def result(self, url: str, regex_status: RegexStatus, scheduled_dt: Optional[datetime.datetime]) -> Result:
+        return Result(url, self.start, self.end, self.response_status, regex_status[0], self.status,
+                      self.status_message, regex_status[1], scheduled_dt, self.timings)
+
+
+class _Request:
+    """a request in flight which checks can join"""
+    __slots__ = ('regexes', 'closed', 'future')
+
+    def __init__(self):
+        # the regexes the body is checked against
+        self.regexes: Set[RegexKey] = set()
+        # True once the body is read. Checks with other regexes can't join anymore
+        self.closed = False
+        self.future: asyncio.Future = asyncio.get_event_loop().create_future()
+
+
+class Fetcher:
+    """
+    Fetch the urls of the checks with coalesced and conditional requests
+
+    :param session: the session used for the requests
+    :type session: :class:`aiohttp.ClientSession`
+    :param coalesce: share a request between the concurrent checks of the same url
+    :type coalesce: bool
+    :param conditional: keep the validators of the responses and send conditional requests
+    :type conditional: bool
+    """
+    def __init__(self, session: 'aiohttp.ClientSession', coalesce: bool = True, conditional: bool = True):
+        self._session = session
+        self._coalesce = coalesce
+        self._conditional = conditional
+        # (normalized url, method) -> request in flight
+        self._requests: Dict[Tuple[str, str], _Request] = {}
+        # normalized url -> validators of the last full GET response
+        self._validators: Dict[str, _Validators] = {}
+
+    def __len__(self):
+        return len(self._validators)
+
+    @staticmethod
+    def _key(url_conf: urls.UrlConfig) -> Tuple[str, str]:
+        method = 'HEAD' if url_conf.regex is None and url_conf.head else 'GET'
+        return urls.normalize(url_conf.url), method
+
+    def forget(self, url: str):
+        """drop the validators of a url (e.g. when it is not checked anymore)
+
+        :param url: the url
+        :type url: str
+        """
+        self._validators.pop(urls.normalize(url), None)
+
+    async def fetch(self, url_conf: urls.UrlConfig, scheduled_dt: Optional[datetime.datetime] = None) -> Result:
+        """fetch a url and get the result of its check
+
+        Without a regex, only the response headers are awaited.
+        The phases of the request are measured when the session uses the
+        :func:`awm.crawler.timing.trace_config`
+
+        :param url_conf: the check configuration of the url
+        :type url_conf: :class:`awm.crawler.urls.UrlConfig`
+        :param scheduled_dt: the datetime the check was scheduled for
+        :type scheduled_dt: datetime or None
+
+        :rtype: :class:`awm.common.result.Result`
+        """
+        key = self._key(url_conf)
+        regex_key = _regex_key(url_conf.settings)
+        response = None
+        request = self._requests.get(key)
+        if request is not None and (not request.closed or regex_key is None or regex_key in request.regexes):
+            if regex_key is not None:
+                request.regexes.add(regex_key)
+            _coalesced_total.inc()
+            response = await self._wait(request)
+        if response is None:
+            response = await self._request(key, url_conf, self._conditional)
+        regex_status = response.regex_status(regex_key)
+        if regex_status is None:
+            # not modified since a full response which wasn't checked against this regex
+            response = await self._request(key, url_conf, False)
+            regex_status = response.regex_status(regex_key) or (None, None)
+        return response.result(url_conf.url, regex_status, scheduled_dt)
+
+    @staticmethod
+    async def _wait(request: _Request) -> Optional[_Response]:
+        try:
+            # a cancelled check must not cancel the shared request
+            return await asyncio.shield(request.future)
+        except asyncio.CancelledError:
+            if request.future.cancelled():
+                # the check which sent the request was cancelled
+                return None
+            raise
+
+    async def _request(self, key: Tuple[str, str], url_conf: urls.UrlConfig, conditional: bool) -> _Response:
+        request = _Request()
+        regex_key = _regex_key(url_conf.settings)
+        if regex_key is not None:
+            request.regexes.add(regex_key)
+        shared = self._coalesce and key not in self._requests
+        if shared:
+            self._requests[key] = request
+        try:
+            response = await self._send(url_conf.url, key, request, conditional)
+        except BaseException:
+            request.future.cancel()
+            raise
+        finally:
+            if shared:
+                del self._requests[key]
+        request.future.set_result(response)
+        return response
+
+    def _conditional_headers(self, url: str, request: _Request) -> Tuple[Optional[_Validators], Dict[str, str]]:
+        validators = self._validators.get(url)
+        if validators is None or not all(key in validators.regex_statuses for key in request.regexes):
+            # the body is needed for a regex
+            return None, {}
+        headers = {}
+        if validators.etag is not None:
+            headers['If-None-Match'] = validators.etag
+        if validators.last_modified is not None:
+            headers['If-Modified-Since'] = validators.last_modified
+        return validators, headers
+
+    def _remember(self, url: str, response: 'aiohttp.ClientResponse', regex_statuses: Dict[RegexKey, RegexStatus]):
+        """keep the validators of a full response"""
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        if response.status != 200 or (etag is None and last_modified is None):
+            self._validators.pop(url, None)
+            return
+        validators = self._validators.get(url)
+        if validators is not None and validators.etag == etag and validators.last_modified == last_modified:
+            # unchanged. Keep the statuses of the regexes this response wasn't checked against
+            validators.regex_statuses.update(regex_statuses)
+            return
+        self._validators[url] = _Validators(etag, last_modified, response.status, dict(regex_statuses))
+
+    async def _send(self, url: str, key: Tuple[str, str], request: _Request, conditional: bool) -> _Response:
+        import aiohttp
+        normalized, method = key
+        validators: Optional[_Validators] = None
+        headers: Dict[str, str] = {}
+        if conditional and method == 'GET':
+            validators, headers = self._conditional_headers(normalized, request)
+        res = _Response(datetime.datetime.now(datetime.timezone.utc))
+        timer = timing.PhaseTimer()
+        try:
+            async with self._session.request(method, url, headers=headers,
+                                             trace_request_ctx={'timer': timer}) as response:
+                # checks with other regexes can't join from now on
+                request.closed = True
+                if response.status == 304 and validators is not None:
+                    _not_modified_total.inc()
+                    res.response_status = validators.response_status
+                    # a copy, the validators get the statuses of other regexes later
+                    res.regex_statuses = dict(validators.regex_statuses)
+                else:
+                    res.response_status = response.status
+                    res.regex_statuses = await _regex_statuses(response, request.regexes)
+                    if request.regexes:
+                        timer.body_end()
+                    if self._conditional and method == 'GET':
+                        self._remember(normalized, response, res.regex_statuses)
+        except aiohttp.client_exceptions.ClientConnectorError as e:
+            logger.warning(f'{url}: connection error: {str(e)}')
+            res.status, res.status_message = ResultStatus.CLIENT_ERROR, str(e)
+        except asyncio.exceptions.TimeoutError as e:
+            logger.warning(f'{url}: timeout after {self._session.timeout}s')
+            res.status, res.status_message = ResultStatus.TIMEOUT, str(e)
+        except Exception as e:
+            logger.exception(e)
+            res.status, res.status_message = ResultStatus.UNKNOWN_ERROR, str(e)
+        else:
+            res.end = datetime.datetime.now(datetime.timezone.utc)
+        if res.status != ResultStatus.SUCCESSFUL:
+            res.response_status = None
+        res.timings = timer.timings()
+        return res
@@ -0,0 +1,213 @@
+# Copyright (c) 2020 Thomas Bechtold <thomasbechtold@jpberlin.de>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""
+Read the urls to check from an inventory
+
+Large numbers of urls don't need to be part of the config file. The
+`inventory` map of the `crawler` section points to a newline-delimited
+JSON file, a CSV file or a PostgreSQL table. The inventory is read entry
+by entry, so it is never held in memory as a whole.
+
+Every entry has the `url` and optionally the per url settings
+(see :data:`FIELDS`). Missing (or empty) settings use the defaults of the
+`crawler` section.
+"""
+
+import csv
+import json
+from typing import IO, Dict, Iterator, Optional, Tuple
+
+from ..common.exception import AwmConfigError
+
+
+#: the supported inventory file formats
+FORMATS = ('ndjson', 'csv')
+#: the fields of an inventory entry with the type of their values
+FIELDS = {
+    'url': str,
+    'interval': float,
+    'regex': str,
+    'regex_overlap': int,
+    'max_body_bytes': int,
+    'head': bool,
+}
+#: the number of rows fetched at once from an inventory table
+FETCH_ROWS = 10000
+
+Entry = Tuple[str, Dict]
+
+
+def _bool(value: str) -> bool:
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+def _entry(fields: Dict, where: str) -> Entry:
+    """get the url and its settings from the fields of an inventory entry"""
+    url = fields.get('url')
+    if not url:
+        raise AwmConfigError(f'{where}: missing url')
+    settings = {}
+    for name, value in fields.items():
+        if name == 'url' or value is None or value == '':
+            continue
+        if name not in FIELDS:
+            raise AwmConfigError(f'{where}: unknown field {name}')
+        if isinstance(value, str) and FIELDS[name] is not str:
+            try:
+                value = _bool(value) if FIELDS[name] is bool else FIELDS[name](value)
+            except ValueError as e:
+                raise AwmConfigError(f'{where}: invalid {name}: {e}')
+        settings[name] = value
+    return url, settings
+
+
+def read_ndjson(f: IO[str], name: str = '<ndjson>') -> Iterator[Entry]:
+    """read the entries of a newline-delimited JSON inventory. One JSON object per line
+
+    :param f: the file
+    :type f: file
+    :param name: the name of the file used in error messages
+    :type name: str
+
+    :raises AwmConfigError: Raised when an entry is invalid
+
+    :return: an iterator over the urls and their settings
+    :rtype: iterator
+    """
+    for lineno, line in enumerate(f, 1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        try:
+            fields = json.loads(line)
+        except ValueError as e:
+            raise AwmConfigError(f'{name}:{lineno}: invalid JSON: {e}')
+        if not isinstance(fields, dict):
+            raise AwmConfigError(f'{name}:{lineno}: not a JSON object')
+        yield _entry(fields, f'{name}:{lineno}')
+
+
+def read_csv(f: IO[str], name: str = '<csv>') -> Iterator[Entry]:
+    """read the entries of a CSV inventory. The first row contains the field names
+
+    :param f: the file
+    :type f: file
+    :param name: the name of the file used in error messages
+    :type name: str
+
+    :raises AwmConfigError: Raised when an entry is invalid
+
+    :return: an iterator over the urls and their settings
+    :rtype: iterator
+    """
+    reader = csv.DictReader(f)
+    for fields in reader:
+        yield _entry(fields, f'{name}:{reader.line_num}')
+
+
+def read_table(uri: str, table: str) -> Iterator[Entry]:
+    """read the entries of an inventory table
+
+    The rows are fetched with a server side cursor in chunks of
+    :data:`FETCH_ROWS`. The table needs a `url` column. The columns of the
+    other :data:`FIELDS` are optional, other columns are ignored.
+
+    :param uri: the PostgreSQL connection uri
+    :type uri: str
+    :param table: the table name, optionally with the schema (`schema.table`)
+    :type table: str
+
+    :return: an iterator over the urls and their settings
+    :rtype: iterator
+    """
+    # psycopg2 is the driver of aiopg. The inventory is read before the
+    # checks start and reloads read it in an executor, so a blocking
+    # connection doesn't stall the checks
+    import psycopg2
+    from psycopg2 import sql
+
+    try:
+        conn = psycopg2.connect(uri)
+    except psycopg2.Error as e:
+        raise AwmConfigError(f'unable to connect to the inventory database: {e}')
+    try:
+        with conn.cursor(name='awm_inventory') as cur:
+            cur.itersize = FETCH_ROWS
+            cur.execute(sql.SQL('SELECT * FROM {}').format(sql.Identifier(*table.split('.'))))
+            columns: Optional[list] = None
+            for row in cur:
+                if columns is None:
+                    columns = [c.name for c in cur.description]
+                yield _entry({c: v for c, v in zip(columns, row) if c in FIELDS}, table)
+    except psycopg2.Error as e:
+        raise AwmConfigError(f'unable to read inventory table {table}: {e}')
+    finally:
+        conn.close()
+
+
+def path(conf: Dict) -> Optional[str]:
+    """get the path of the inventory file
+
+    :param conf: the configuration dict
+    :type conf: dict
+
+    :return: the path or None without an inventory file
+    :rtype: str or None
+    """
+    return conf['crawler'].get('inventory', {}).get('path')
+
+
+def _file_format(inventory_conf: Dict) -> str:
+    file_format = inventory_conf.get('format', 'csv' if inventory_conf['path'].endswith('.csv') else 'ndjson')
+    if file_format not in FORMATS:
+        raise AwmConfigError(f'unknown inventory format {file_format}. Use one of {", ".join(FORMATS)}')
+    return file_format
+
+
+def entries(conf: Dict, database: bool = True) -> Iterator[Entry]:
+    """get the urls of the `crawler` section followed by the urls of the inventory
+
+    :param conf: the configuration dict
+    :type conf: dict
+    :param database: read an inventory table. False to skip it
+    :type database: bool
+
+    :raises AwmConfigError: Raised when the inventory is invalid
+
+    :return: an iterator over the urls and their settings
+    :rtype: iterator
+    """
+    crawler_conf = conf['crawler']
+    yield from crawler_conf.get('urls', {}).items()
+    inventory_conf = crawler_conf.get('inventory')
+    if inventory_conf is None:
+        return
+    if 'path' in inventory_conf:
+        file_format = _file_format(inventory_conf)
+        try:
+            # newline='' lets the csv module handle newlines in quoted fields
+            with open(inventory_conf['path'], newline='') as f:
+                yield from (read_csv if file_format == 'csv' else read_ndjson)(f, inventory_conf['path'])
+        except OSError as e:
+            raise AwmConfigError(f'unable to read inventory {inventory_conf["path"]}: {e}')
+    elif 'table' in inventory_conf:
+        if database:
+            # default to the database of the persister
+            uri = inventory_conf.get('uri') or conf['persister']['postgres']['uri']
+            yield from read_table(uri, inventory_conf['table'])
+    else:
+        raise AwmConfigError('the inventory needs a path or a table')
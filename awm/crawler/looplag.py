@@ -0,0 +1,70 @@
+# Copyright (c) 2020 Thomas Bechtold <thomasbechtold@jpberlin.de>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""
+Measure the event loop lag
+
+A monitor task sleeps for a short interval and measures how much later
+than requested it wakes up. A growing lag means callbacks (e.g. parsing
+responses or matching regular expressions) block the event loop and all
+checks start late.
+"""
+
+import asyncio
+import logging
+from typing import Callable, Optional
+
+from ..common import metrics
+
+
+logger = logging.getLogger(__name__)
+
+#: the default interval in seconds between two measurements
+DEFAULT_INTERVAL = 0.1
+
+_lag_seconds = metrics.REGISTRY.histogram(
+    'awm_crawler_loop_lag_seconds', 'Delay of the event loop in waking up a sleeping task',
+    buckets=(.001, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5))
+
+
+class LoopLagMonitor:
+    """
+    Periodically measure the event loop lag
+
+    :param callback: called with every measured lag in seconds
+    :type callback: callable or None
+    :param interval: the interval in seconds between two measurements
+    :type interval: float
+    """
+    def __init__(self, callback: Optional[Callable[[float], None]] = None, interval: float = DEFAULT_INTERVAL):
+        self._callback = callback
+        self._interval = interval
+        #: the last measured lag in seconds
+        self.lag = 0.0
+
+    async def run(self):
+        """measure the lag until the task gets cancelled"""
+        loop = asyncio.get_event_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self._interval)
+            self.lag = max(loop.time() - start - self._interval, 0.0)
+            _lag_seconds.observe(self.lag)
+            if self._callback is not None:
+                try:
+                    self._callback(self.lag)
+                except Exception as e:
+                    logger.exception(e)
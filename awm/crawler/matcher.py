@@ -0,0 +1,90 @@
+# Copyright (c) 2020 Thomas Bechtold <thomasbechtold@jpberlin.de>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""
+Search regular expressions in response bodies without keeping the
+whole body in memory
+"""
+
+import codecs
+from typing import Pattern
+
+
+class StreamMatcher:
+    """
+    Search a compiled regular expression in a body that is fed chunk by chunk.
+
+    Only the last `overlap` characters of the already fed chunks are kept,
+    so matches which span a chunk border must not be longer than `overlap`
+    characters. Note that `$` may also match at the end of a chunk.
+
+    :param pattern: the compiled regular expression
+    :type pattern: Pattern
+    :param overlap: the number of characters kept from the previous chunks
+    :type overlap: int
+    :param encoding: the encoding of the body
+    :type encoding: str
+    """
+    def __init__(self, pattern: Pattern, overlap: int, encoding: str = 'utf-8'):
+        self._pattern = pattern
+        self._overlap = overlap
+        self._decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+        self._tail = ''
+        # the position of the tail in the whole body
+        self._offset = 0
+        self._searched = False
+        self._matched = False
+
+    @property
+    def matched(self) -> bool:
+        return self._matched
+
+    def feed(self, data: bytes, final: bool = False) -> bool:
+        """feed the next chunk of the body
+
+        :param data: the next chunk
+        :type data: bytes
+        :param final: True if this is the last chunk
+        :type final: bool
+
+        :return: True if the regular expression matched
+        :rtype: bool
+        """
+        if self._matched:
+            return True
+        text = self._decoder.decode(data, final)
+        if not text and self._searched:
+            return False
+        buf = self._tail + text
+        # the first character of the tail was already searched. It is only kept
+        # so anchors like ^ and \b behave like they do on the whole body
+        pos = 0 if self._offset == 0 else 1
+        self._searched = True
+        if self._pattern.search(buf, pos):
+            self._matched = True
+            return True
+        keep = min(len(buf), self._overlap + 1)
+        self._offset += len(buf) - keep
+        self._tail = buf[len(buf) - keep:]
+        return False
+
+    def finish(self) -> bool:
+        """signal the end of the body
+
+        :return: True if the regular expression matched
+        :rtype: bool
+        """
+        return self.feed(b'', final=True)
@@ -0,0 +1,231 @@
+# Copyright (c) 2020 Thomas Bechtold <thomasbechtold@jpberlin.de>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""
+Apply changes of the configured urls to a running crawler
+
+Only the checks of added, removed or changed urls are touched. All other
+checks keep running with their phase and the shared HTTP session and
+kafka producer are not restarted.
+"""
+
+import asyncio
+import logging
+import os
+import signal
+from pathlib import Path
+from typing import Callable, Dict, Optional, Set, Tuple
+
+from ..common import config
+from ..common import metrics
+from ..common.exception import AwmConfigError
+from . import inventory
+from . import scheduler
+from . import urls
+
+
+logger = logging.getLogger(__name__)
+
+#: the default number of seconds between checks of the config file modification time
+DEFAULT_RELOAD_INTERVAL = 10.0
+#: the keys of the crawler section which are applied by a reload
+URL_KEYS = ('urls', 'inventory', 'interval', 'regex_overlap', 'max_body_bytes', 'head')
+
+_reloads_total = metrics.REGISTRY.counter(
+    'awm_crawler_config_reloads_total', 'Number of config reloads by result', ('result',))
+
+
+def diff(old: Dict[str, urls.UrlConfig],
+         new: Dict[str, urls.UrlConfig]) -> Tuple[Set[str], Set[str], Set[str]]:
+    """compare two url configurations
+
+    :param old: the current url configuration
+    :type old: dict
+    :param new: the new url configuration
+    :type new: dict
+
+    :return: a tuple with the added, the removed and the changed urls
+    :rtype: (set, set, set)
+    """
+    added = new.keys() - old.keys()
+    removed = old.keys() - new.keys()
+    changed = {url for url in old.keys() & new.keys() if old[url] != new[url]}
+    return added, removed, changed
+
+
+def _ignored_changes(old: Dict, new: Dict) -> Set[str]:
+    """the config keys which changed but need a restart"""
+    keys = {k for k in old.keys() | new.keys() if k != 'crawler' and old.get(k) != new.get(k)}
+    old_crawler, new_crawler = old.get('crawler', {}), new.get('crawler', {})
+    keys.update(f'crawler.{k}' for k in old_crawler.keys() | new_crawler.keys()
+                if k not in URL_KEYS and old_crawler.get(k) != new_crawler.get(k))
+    return keys
+
+
+class UrlReloader:
+    """
+    Reload the url configuration from the config file and the inventory
+
+    The url configuration is updated in place, so the running checks use
+    the new configuration of a url with their next run. Only urls for
+    which `owns` returns True are scheduled.
+
+    :param path: the path to the config file
+    :type path: str
+    :param conf: the currently used configuration dict
+    :type conf: dict
+    :param url_confs: the url configuration used by the checks. Updated in place
+    :type url_confs: dict
+    :param sched: the scheduler running the checks
+    :type sched: :class:`awm.crawler.scheduler.Scheduler`
+    :param owns: returns True if a url is checked by this process. Default is all urls
+    :type owns: callable or None
+    :param forget: called with every removed or changed url to drop the state kept for it
+                   (e.g. the validators of conditional requests and the adaptive interval)
+    :type forget: callable or None
+    """
+    def __init__(self, path: str, conf: Dict, url_confs: Dict[str, urls.UrlConfig],
+                 sched: scheduler.Scheduler, owns: Optional[Callable[[str], bool]] = None,
+                 forget: Optional[Callable[[str], None]] = None):
+        self._path = Path(path)
+        self._conf = conf
+        self._url_confs = url_confs
+        self._sched = sched
+        self.owns = owns or (lambda url: True)
+        self._forget = forget or (lambda url: None)
+        self._mtime = self._stat()
+
+    def _stat(self) -> Optional[Tuple[float, ...]]:
+        """the modification times of the config file and the inventory file"""
+        paths = [self._path]
+        inventory_path = inventory.path(self._conf)
+        if inventory_path is not None:
+            paths.append(Path(inventory_path))
+        try:
+            return tuple(os.stat(p).st_mtime for p in paths)
+        except OSError:
+            return None
+
+    def _read(self) -> Tuple[Dict, Dict[str, urls.UrlConfig]]:
+        """read the config file and build the url configuration. Blocking"""
+        conf = config.get_config(self._path)
+        return conf, urls.url_configs(conf)
+
+    async def reload(self) -> Tuple[Set[str], Set[str], Set[str]]:
+        """read the config file and the inventory and apply the changes of the urls
+
+        The complete new url configuration is built and checked before any
+        change is applied. Reading the files and an inventory table blocks,
+        so it runs in the default executor and only the changes are applied
+        on the event loop. An invalid config file is logged and the current
+        configuration is kept.
+
+        :return: a tuple with the added, the removed and the changed urls
+        :rtype: (set, set, set)
+        """
+        try:
+            conf, new = await asyncio.get_event_loop().run_in_executor(None, self._read)
+        except (AwmConfigError, KeyError) as e:
+            _reloads_total.inc(1, 'failure')
+            logger.error(f'config {self._path} not reloaded: {e}')
+            return set(), set(), set()
+        except Exception as e:
+            _reloads_total.inc(1, 'failure')
+            logger.exception(f'config {self._path} not reloaded: {e}')
+            return set(), set(), set()
+        ignored = _ignored_changes(self._conf, conf)
+        if ignored:
+            logger.warning(f'changes of {", ".join(sorted(ignored))} need a restart')
+        self._conf = conf
+        # the url configuration may have changed while the new one was read
+        added, removed, changed = diff(self._url_confs, new)
+        self._apply(new, added, removed, changed)
+        _reloads_total.inc(1, 'success')
+        logger.warning(f'config {self._path} reloaded: {len(added)} urls added, {len(removed)} removed, '
+                       f'{len(changed)} changed. checking {len(self._sched)} urls')
+        return added, removed, changed
+
+    def _apply(self, new: Dict[str, urls.UrlConfig], added: Set[str], removed: Set[str], changed: Set[str]):
+        """apply the diff of the checked url configuration"""
+        for url in removed:
+            self._sched.remove(url)
+            del self._url_confs[url]
+            self._forget(url)
+        for url in changed:
+            # the kept state (e.g. the regex statuses of a response) may not match the new config
+            self._forget(url)
+            interval = self._url_confs[url].interval
+            self._url_confs[url] = new[url]
+            # a new interval moves the check to its new phase. Other changes apply with the next run
+            if new[url].interval != interval and url in self._sched:
+                self._sched.add(url, new[url].interval)
+        for url in added:
+            self._url_confs[url] = new[url]
+            if self.owns(url):
+                self._sched.add(url, new[url].interval)
+
+    async def _reload(self):
+        """reload without raising, so a failed reload never stops the crawler"""
+        try:
+            await self.reload()
+        except Exception as e:
+            _reloads_total.inc(1, 'failure')
+            logger.exception(f'config {self._path} not reloaded: {e}')
+
+    def _changed(self) -> bool:
+        """check if the modification time of the config or the inventory file changed"""
+        mtime = self._stat()
+        if mtime is not None and mtime != self._mtime:
+            self._mtime = mtime
+            return True
+        return False
+
+    async def run(self, interval: Optional[float] = DEFAULT_RELOAD_INTERVAL):
+        """reload on SIGHUP and when the config or inventory file changes until cancelled
+
+        An inventory table is only reloaded on SIGHUP.
+
+        :param interval: the number of seconds between checks of the file
+                         modification times. None to only reload on SIGHUP
+        :type interval: float or None
+        """
+        loop = asyncio.get_event_loop()
+        wakeup = asyncio.Event()
+        hangup = False
+
+        def on_hangup():
+            nonlocal hangup
+            hangup = True
+            wakeup.set()
+        loop.add_signal_handler(signal.SIGHUP, on_hangup)
+        try:
+            while True:
+                # no wait_for, it can swallow the cancellation of the reloader
+                # when the wakeup event is set at the same time
+                due = loop.call_later(interval, wakeup.set) if interval is not None else None
+                try:
+                    await wakeup.wait()
+                finally:
+                    if due is not None:
+                        due.cancel()
+                wakeup.clear()
+                if not hangup and not self._changed():
+                    continue
+                # a SIGHUP during the reload triggers another one
+                hangup = False
+                await self._reload()
+        finally:
+            loop.remove_signal_handler(signal.SIGHUP)
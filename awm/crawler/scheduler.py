@@ -0,0 +1,284 @@
+# Copyright (c) 2020 Thomas Bechtold <thomasbechtold@jpberlin.de>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""
+A central scheduler for periodic checks
+"""
+
+import asyncio
+import datetime
+import heapq
+import itertools
+import logging
+import math
+import time
+import zlib
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from ..common import metrics
+
+
+logger = logging.getLogger(__name__)
+
+_drift_seconds = metrics.REGISTRY.histogram(
+    'awm_crawler_schedule_drift_seconds', 'Delay between the due time and the start of a check',
+    buckets=(.001, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10))
+_skipped_total = metrics.REGISTRY.counter(
+    'awm_crawler_checks_skipped_total', 'Number of check runs skipped because the checks fell behind')
+
+
+def phase(key: str, interval: float) -> float:
+    """get a stable start offset for the given key within the interval
+
+    The offset only depends on the key, so checks with the same interval
+    are spread over the whole interval. The offset is relative to the wall
+    clock (see :func:`next_run`), so a check keeps its phase across
+    restarts and when it moves to another process or node.
+
+    :param key: the key of the check
+    :type key: str
+    :param interval: the check interval in seconds
+    :type interval: float
+
+    :return: the offset in seconds
+    :rtype: float
+    """
+    return zlib.crc32(key.encode()) / 2**32 * interval
+
+
+def next_run(key: str, interval: float) -> float:
+    """get the event loop time of the next run of a check according to its :func:`phase`
+
+    :param key: the key of the check
+    :type key: str
+    :param interval: the check interval in seconds
+    :type interval: float
+
+    :return: the event loop time of the next run
+    :rtype: float
+    """
+    return asyncio.get_event_loop().time() + (phase(key, interval) - time.time()) % interval
+
+
+def wall_clock(due: float) -> datetime.datetime:
+    """convert an event loop time to a (UTC) datetime
+
+    :param due: the event loop time
+    :type due: float
+
+    :return: the datetime
+    :rtype: datetime
+    """
+    offset = asyncio.get_event_loop().time() - due
+    return datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(seconds=offset)
+
+
+class Scheduler:
+    """
+    Run periodic checks from a single timer heap with a bounded pool of workers
+
+    Only due checks are handed to the workers, so the number of running
+    checks never exceeds `workers`, independent of the number of scheduled keys.
+    The limit can be lowered temporarily with :meth:`Scheduler.throttle`.
+
+    A check that falls behind by a whole interval skips the missed runs and
+    continues at its next regular run, so overdue checks keep their phase
+    instead of all running at once.
+
+    A check can return the event loop time of its next run (e.g. to back
+    off). When it returns None again, it continues at its next regular
+    run according to its :func:`phase`.
+
+    :param check: the coroutine function called with the key and the due event loop time of a check.
+                  Returns the event loop time of the next run or None for the next regular run
+    :type check: callable
+    :param workers: the maximum number of concurrently running checks
+    :type workers: int
+    :param phase_key: get the key the :func:`phase` of a check is derived from. Default is the key itself.
+                      Checks with the same phase key and interval are due at the same time
+    :type phase_key: callable or None
+    """
+    def __init__(self, check: Callable[[str, float], Awaitable[Optional[float]]], workers: int,
+                 phase_key: Optional[Callable[[str], str]] = None):
+        self._check = check
+        self._workers = workers
+        self._phase_key = phase_key
+        self._limit = workers
+        self._running = 0
+        self._slot = asyncio.Event()
+        # (due time, generation, key)
+        self._heap: List[Tuple[float, int, str]] = []
+        # key -> (interval, generation)
+        self._entries: Dict[str, Tuple[float, int]] = {}
+        self._generation = itertools.count()
+        # keys which left their regular phase because the check returned its next run
+        self._adapted: Set[str] = set()
+        self._wakeup = asyncio.Event()
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=workers)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    @property
+    def queue_depth(self) -> int:
+        """the number of due checks waiting for a free worker"""
+        now = asyncio.get_event_loop().time()
+        return self._queue.qsize() + sum(1 for due, _, _ in self._heap if due <= now)
+
+    @property
+    def limit(self) -> int:
+        """the current maximum number of concurrently running checks"""
+        return self._limit
+
+    def throttle(self, overloaded: bool):
+        """adapt the maximum number of concurrently running checks
+
+        The limit is halved when overloaded and increased by one
+        otherwise, up to the configured number of workers.
+
+        :param overloaded: True if the process is overloaded (e.g. the event loop lags)
+        :type overloaded: bool
+        """
+        if overloaded:
+            limit = max(1, self._limit // 2)
+            if limit < self._limit:
+                logger.warning(f'overloaded. Limiting the concurrent checks to {limit}')
+            self._limit = limit
+        else:
+            self._limit = min(self._workers, self._limit + 1)
+            self._slot.set()
+
+    def _next_run(self, key: str, interval: float) -> float:
+        return next_run(key if self._phase_key is None else self._phase_key(key), interval)
+
+    def _push(self, key: str, due: float, generation: int):
+        heapq.heappush(self._heap, (due, generation, key))
+        self._wakeup.set()
+
+    def add(self, key: str, interval: float, first_run: Optional[float] = None):
+        """add (or replace) a periodic check
+
+        :param key: the key of the check. Passed to the `check` function
+        :type key: str
+        :param interval: the check interval in seconds
+        :type interval: float
+        :param first_run: the event loop time of the first run. Default is
+                          the :func:`next_run` of the phase key
+        :type first_run: float or None
+        """
+        if first_run is None:
+            first_run = self._next_run(key, interval)
+        generation = next(self._generation)
+        self._entries[key] = (interval, generation)
+        self._adapted.discard(key)
+        self._push(key, first_run, generation)
+
+    def remove(self, key: str):
+        """remove a periodic check. A currently running check is not cancelled
+
+        :param key: the key of the check
+        :type key: str
+        """
+        self._entries.pop(key, None)
+        self._adapted.discard(key)
+
+    def _next_due(self, due: float, interval: float) -> float:
+        """the next regular run after `due` which is not in the past. Missed runs are skipped"""
+        now = asyncio.get_event_loop().time()
+        if due + interval >= now:
+            return due + interval
+        runs = math.ceil((now - due) / interval)
+        _skipped_total.inc(runs - 1)
+        return due + runs * interval
+
+    def _reschedule(self, key: str, generation: int, due: float, next_due: Optional[float] = None):
+        entry = self._entries.get(key)
+        if entry is None or entry[1] != generation:
+            # removed or replaced while the check was running
+            return
+        if next_due is not None:
+            self._adapted.add(key)
+        elif key in self._adapted:
+            # back to the regular phase
+            self._adapted.discard(key)
+            next_due = self._next_run(key, entry[0])
+        else:
+            next_due = self._next_due(due, entry[0])
+        self._push(key, next_due, generation)
+
+    async def _worker(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            key, generation, due = await self._queue.get()
+            _drift_seconds.observe(max(loop.time() - due, 0))
+            self._running += 1
+            next_due = None
+            try:
+                next_due = await self._check(key, due)
+            except Exception as e:
+                logger.exception(e)
+            finally:
+                self._running -= 1
+                self._slot.set()
+                self._reschedule(key, generation, due, next_due)
+                self._queue.task_done()
+
+    async def _dispatch(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            self._wakeup.clear()
+            if not self._heap:
+                await self._wakeup.wait()
+                continue
+            due, generation, key = self._heap[0]
+            delay = due - loop.time()
+            if delay > 0:
+                # no wait_for, it can swallow the cancellation of the scheduler
+                # when the wakeup event is set at the same time
+                due_handle = loop.call_later(delay, self._wakeup.set)
+                try:
+                    await self._wakeup.wait()
+                finally:
+                    due_handle.cancel()
+                continue
+            # wait for a free worker before taking the check from the heap
+            if self._running + self._queue.qsize() >= self._limit:
+                self._slot.clear()
+                await self._slot.wait()
+                continue
+            heapq.heappop(self._heap)
+            entry = self._entries.get(key)
+            if entry is None or entry[1] != generation:
+                continue
+            if loop.time() - due >= entry[0]:
+                # fell behind by a whole interval. Shed this run
+                _skipped_total.inc()
+                self._push(key, self._next_due(due, entry[0]), generation)
+                continue
+            await self._queue.put((key, generation, due))
+
+    async def run(self):
+        """run the scheduler until it gets cancelled"""
+        workers = [asyncio.create_task(self._worker()) for _ in range(self._workers)]
+        try:
+            await self._dispatch()
+        finally:
+            for w in workers:
+                w.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
@@ -0,0 +1,310 @@
+# Copyright (c) 2020 Thomas Bechtold <thomasbechtold@jpberlin.de>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""
+Check the configured urls and publish the results to kafka
+
+The service behind `awm-crawler` (see :func:`awm.crawler.main`).
+"""
+
+
+import datetime
+import logging
+import os
+import asyncio
+from typing import TYPE_CHECKING, Any, Callable, Dict, Optional, Tuple
+
+from ..common import kafka_utils
+from ..common import metrics
+from ..common.exception import AwmConfigError
+from ..common.result import WIRE_FORMATS, Result, ResultStatus
+from . import adaptive
+from . import fetcher
+from . import looplag
+from . import reload
+from . import scheduler
+from . import spool
+from . import timing
+from . import urls
+
+# aiohttp (and aiokafka, multiprocessing) are imported when they are needed, so
+# the command line help and the config validation start fast
+if TYPE_CHECKING:
+    import aiohttp
+
+logger = logging.getLogger(__name__)
+
+
+#: the default maximum number of concurrently running checks
+DEFAULT_CONCURRENCY = 100
+#: the default maximum number of results waiting for the kafka delivery
+DEFAULT_MAX_IN_FLIGHT = 1000
+#: the default event loop lag in seconds above which the number of concurrent checks is reduced
+DEFAULT_MAX_LOOP_LAG = 0.5
+
+_fetch_seconds = metrics.REGISTRY.histogram(
+    'awm_crawler_fetch_seconds', 'Duration of the checks by result status', ('status',),
+    buckets=(.01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60))
+
+
+def _content_type(conf) -> str:
+    """get the content type of the results published to kafka"""
+    wire_format = conf['kafka'].get('format', 'json')
+    if wire_format not in WIRE_FORMATS:
+        raise AwmConfigError(f'unknown kafka format {wire_format}. Use one of {", ".join(WIRE_FORMATS)}')
+    return WIRE_FORMATS[wire_format]
+
+
+async def _check_url(sender: kafka_utils.Sender, url_fetcher: fetcher.Fetcher, url_conf: urls.UrlConfig,
+                     content_type: str, scheduled_dt: Optional[datetime.datetime] = None,
+                     breaker: Optional[adaptive.CircuitBreaker] = None) -> Optional[Result]:
+    """check a url and publish the result
+
+    :return: the result or None if it couldn't be published
+    :rtype: :class:`awm.common.result.Result` or None
+    """
+    try:
+        if breaker is not None and not breaker.allow(url_conf.url):
+            # the host keeps failing. Don't spend a connection and the timeout on it
+            res = Result(url_conf.url, datetime.datetime.now(datetime.timezone.utc), None, None, None,
+                         ResultStatus.CLIENT_ERROR, f'circuit open for {breaker.host(url_conf.url)}',
+                         scheduled_dt=scheduled_dt)
+        else:
+            loop = asyncio.get_event_loop()
+            start = loop.time()
+            res = await url_fetcher.fetch(url_conf, scheduled_dt)
+            _fetch_seconds.observe(loop.time() - start, res.status)
+            if breaker is not None:
+                breaker.record(url_conf.url, res)
+        # the delivery is not awaited. The url as key keeps the results of a url in one partition
+        await sender.send(res.encode(content_type), key=url_conf.url.encode(),
+                          headers=kafka_utils.content_type_headers(content_type))
+    except Exception as e:
+        logging.exception(e)
+        return None
+    logger.info(res)
+    return res
+
+
+def _connector(conf) -> 'aiohttp.TCPConnector':
+    """create the connector (connection pool) shared by all checks"""
+    import aiohttp
+    crawler_conf = conf['crawler']
+    connector_conf = crawler_conf.get('connector', {})
+    return aiohttp.TCPConnector(
+        limit=connector_conf.get('limit', crawler_conf.get('concurrency', DEFAULT_CONCURRENCY)),
+        limit_per_host=connector_conf.get('limit_per_host', 0),
+        keepalive_timeout=connector_conf.get('keepalive_timeout', 15.0),
+        use_dns_cache=True,
+        ttl_dns_cache=connector_conf.get('ttl_dns_cache', 10))
+
+
+def _trace_callback(function: Callable[[Any], None]):
+    async def callback(session, trace_config_ctx, params):
+        function(trace_config_ctx)
+    return callback
+
+
+def _connector_metrics(connector: 'aiohttp.TCPConnector') -> 'aiohttp.TraceConfig':
+    """expose the connection pool utilisation as metrics
+
+    The pool state isn't public, so the connection events of the requests are counted.
+
+    :return: the trace config of the session which reports the connection events
+    :rtype: :class:`aiohttp.TraceConfig`
+    """
+    import aiohttp
+    metrics.REGISTRY.gauge(
+        'awm_crawler_connections_limit', 'Maximum number of connections in the pool').set_function(
+            lambda: connector.limit)
+    created = metrics.REGISTRY.counter(
+        'awm_crawler_connections_created_total', 'Number of new connections')
+    reused = metrics.REGISTRY.counter(
+        'awm_crawler_connections_reused_total', 'Number of requests which reused a keep-alive connection')
+    queued = metrics.REGISTRY.histogram(
+        'awm_crawler_connections_queued_seconds', 'Time requests waited for a free connection of the pool')
+
+    def queued_start(trace_config_ctx):
+        trace_config_ctx.queued = asyncio.get_event_loop().time()
+
+    def queued_end(trace_config_ctx):
+        queued.observe(asyncio.get_event_loop().time() - trace_config_ctx.queued)
+
+    config = aiohttp.TraceConfig()
+    config.on_connection_create_end.append(_trace_callback(lambda ctx: created.inc()))
+    config.on_connection_reuseconn.append(_trace_callback(lambda ctx: reused.inc()))
+    config.on_connection_queued_start.append(_trace_callback(queued_start))
+    config.on_connection_queued_end.append(_trace_callback(queued_end))
+    return config
+
+
+def _spool_metrics(result_spool: spool.Spool):
+    """expose the spool state as metrics"""
+    metrics.REGISTRY.gauge(
+        'awm_crawler_spool_depth', 'Number of results in the spool waiting for kafka').set_function(
+            lambda: result_spool.depth)
+    metrics.REGISTRY.gauge(
+        'awm_crawler_spool_bytes', 'Size of the spool segments in bytes').set_function(
+            lambda: result_spool.size)
+    metrics.REGISTRY.gauge(
+        'awm_crawler_spool_segments', 'Number of spool segments').set_function(
+            lambda: result_spool.segments)
+    metrics.REGISTRY.gauge(
+        'awm_crawler_spool_dropped', 'Number of results dropped because the spool was full').set_function(
+            lambda: result_spool.dropped)
+
+
+async def _crawl(conf, worker: int = 0, workers: int = 1, config_path: Optional[str] = None,
+                 producer_factory: Callable = kafka_utils.kafka_producer):
+    """check the urls and publish the results until cancelled
+
+    :param config_path: the path of the config file. The urls are reloaded when it changes. None to disable
+    :type config_path: str or None
+    :param producer_factory: the async context manager factory of the kafka producer
+                             (see :func:`awm.common.kafka_utils.kafka_producer`)
+    :type producer_factory: callable
+    """
+    # compile the regular expressions once before any check runs
+    url_confs = urls.url_configs(conf)
+    content_type = _content_type(conf)
+    coordinated = 'coordination' in conf['crawler']
+    # with coordination, kafka assigns the urls to the processes
+    owns = _sharding(worker, workers) if not coordinated else None
+    async with metrics.http_server(conf['crawler'].get('metrics'), worker), \
+            producer_factory(conf['kafka']['servers'], conf['kafka']['ssl'],
+                             conf['kafka'].get('producer')) as producer:
+        max_in_flight = conf['kafka'].get('max_in_flight', DEFAULT_MAX_IN_FLIGHT)
+        spool_conf = conf['crawler'].get('spool')
+        if spool_conf is not None:
+            # every worker process has its own spool
+            result_spool = spool.Spool(os.path.join(spool_conf['directory'], str(worker)),
+                                       spool_conf.get('max_bytes', spool.DEFAULT_MAX_BYTES),
+                                       spool_conf.get('segment_bytes', spool.DEFAULT_SEGMENT_BYTES))
+            _spool_metrics(result_spool)
+            drain = asyncio.create_task(spool.drain(result_spool, producer, conf['kafka']['topic_name'],
+                                                    max_in_flight))
+            try:
+                await _run_checks(conf, url_confs, result_spool, content_type, coordinated, owns, config_path)
+            finally:
+                drain.cancel()
+                result_spool.close()
+            return
+        sender = kafka_utils.Sender(producer, conf['kafka']['topic_name'], max_in_flight)
+        metrics.REGISTRY.gauge(
+            'awm_crawler_kafka_in_flight', 'Number of results waiting for the kafka delivery').set_function(
+                lambda: sender.in_flight)
+        await _run_checks(conf, url_confs, sender, content_type, coordinated, owns, config_path)
+
+
+async def _run_checks(conf, url_confs: Dict[str, urls.UrlConfig], sender, content_type: str, coordinated: bool,
+                      owns: Optional[Callable[[str], bool]] = None, config_path: Optional[str] = None):
+    """schedule the checks and publish the results with the sender
+
+    :param sender: a :class:`awm.common.kafka_utils.Sender` or a :class:`awm.crawler.spool.Spool`
+    :param owns: returns True if a url is checked by this process. Default is all urls
+    :param config_path: the path of the config file the urls are reloaded from. None to disable reloading
+    """
+    import aiohttp
+    # make sure the check doesn't need longer than configured check interval
+    timeout = aiohttp.ClientTimeout(total=conf['crawler']['interval'])
+    connector = _connector(conf)
+    trace_configs = [timing.trace_config(), _connector_metrics(connector)]
+    async with aiohttp.ClientSession(timeout=timeout, connector=connector, trace_configs=trace_configs) as session:
+        intervals, breaker = _adaptive(conf)
+        url_fetcher = fetcher.Fetcher(session, conf['crawler'].get('coalesce', True),
+                                      conf['crawler'].get('conditional', True))
+
+        def forget(url):
+            """drop the state kept for a url which is not checked anymore or changed"""
+            if intervals is not None:
+                intervals.forget(url)
+            url_fetcher.forget(url)
+
+        async def check(url, due):
+            url_conf = url_confs.get(url)
+            if url_conf is None:
+                # removed by a reload while the check was waiting for a worker
+                forget(url)
+                return None
+            res = await _check_url(sender, url_fetcher, url_conf, content_type, scheduler.wall_clock(due), breaker)
+            if intervals is None or res is None:
+                return None
+            delay = intervals.delay(url, url_conf.interval, res)
+            return None if delay is None else asyncio.get_event_loop().time() + delay
+
+        # the checks of the same url are due at the same time and share a request
+        sched = scheduler.Scheduler(check, conf['crawler'].get('concurrency', DEFAULT_CONCURRENCY), urls.normalize)
+        monitor = looplag.LoopLagMonitor(_throttle(sched, conf['crawler'].get('max_loop_lag', DEFAULT_MAX_LOOP_LAG)))
+        metrics.REGISTRY.gauge(
+            'awm_crawler_queue_depth', 'Number of due checks waiting for a free worker').set_function(
+                lambda: sched.queue_depth)
+        metrics.REGISTRY.gauge(
+            'awm_crawler_scheduled_urls', 'Number of scheduled urls').set_function(lambda: len(sched))
+        if breaker is not None:
+            metrics.REGISTRY.gauge(
+                'awm_crawler_open_circuits', 'Number of hosts with an open circuit').set_function(
+                    lambda: breaker.open)
+        metrics.REGISTRY.gauge(
+            'awm_crawler_conditional_urls', 'Number of urls with validators for conditional requests').set_function(
+                lambda: len(url_fetcher))
+        metrics.REGISTRY.gauge(
+            'awm_crawler_concurrency_limit', 'Current maximum number of concurrently running checks').set_function(
+                lambda: sched.limit)
+        tasks = [sched.run(), monitor.run()]
+        reloader = None
+        if config_path is not None:
+            # url_confs is updated in place, so the checks use the reloaded config with their next run
+            reloader = reload.UrlReloader(config_path, conf, url_confs, sched, owns, forget)
+            tasks.append(reloader.run(conf['crawler'].get('reload_interval', reload.DEFAULT_RELOAD_INTERVAL)))
+        if coordinated:
+            from . import coordination
+            await asyncio.gather(*tasks, coordination.coordinate(conf, url_confs, sched, reloader, forget))
+            return
+        for url, url_conf in url_confs.items():
+            if owns is None or owns(url):
+                sched.add(url, url_conf.interval)
+        logger.info(f'scheduled {len(sched)} urls...')
+        await asyncio.gather(*tasks)
+
+
+def _adaptive(conf) -> Tuple[Optional[adaptive.AdaptiveIntervals], Optional[adaptive.CircuitBreaker]]:
+    """get the adaptive intervals and the circuit breaker configured in the crawler section. None if disabled"""
+    crawler_conf = conf['crawler']
+    intervals = None
+    adaptive_conf = crawler_conf.get('adaptive')
+    if adaptive_conf is not None:
+        intervals = adaptive.AdaptiveIntervals(adaptive_conf.get('max_interval'), adaptive_conf.get('confirm_interval'))
+    breaker = None
+    breaker_conf = crawler_conf.get('circuit_breaker')
+    if breaker_conf is not None:
+        breaker = adaptive.CircuitBreaker(
+            breaker_conf.get('failures', adaptive.DEFAULT_CIRCUIT_FAILURES),
+            breaker_conf.get('reset_timeout', adaptive.DEFAULT_CIRCUIT_RESET_TIMEOUT))
+    return intervals, breaker
+
+
+def _sharding(worker: int, workers: int) -> Optional[Callable[[str], bool]]:
+    """get the function which decides if a url is checked by the given worker process. None for a single worker"""
+    if workers <= 1:
+        return None
+    return lambda url: urls.shard(url, workers) == worker
+
+
+def _throttle(sched: scheduler.Scheduler, max_loop_lag: Optional[float]):
+    """get the callback of the loop lag monitor which throttles the scheduler. None to only measure the lag"""
+    if max_loop_lag is None:
+        return None
+    return lambda lag: sched.throttle(lag > max_loop_lag)
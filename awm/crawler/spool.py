@@ -0,0 +1,386 @@
+# Copyright (c) 2020 Thomas Bechtold <thomasbechtold@jpberlin.de>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""
+Spool the crawler results on the local disk before they are sent to kafka
+
+The checks append their results to the spool and never wait for kafka. A
+background task drains the spool to kafka in bulk. The spool is a
+directory of append-only segment files. A segment is deleted when all of
+its records are delivered. The position of the first undelivered record
+is stored in the `cursor` file, so the records that were not delivered
+are sent after a restart (at least once).
+
+The records appended during one iteration of the event loop are written
+with a single write. The number of records of a closed segment is stored
+next to it in a `.count` file, so a restart only reads the segments that
+were not closed (e.g. after a crash).
+
+Every record is stored as::
+
+    crc32 (4 bytes) | length (4 bytes) | payload
+
+The payload contains the key, the headers and the value of the kafka
+message. A record with a wrong checksum or length (e.g. a partially
+written record after a crash) ends the segment.
+"""
+
+import asyncio
+from collections import namedtuple
+import logging
+import os
+from pathlib import Path
+import struct
+from typing import Dict, List, Optional, Tuple
+import zlib
+
+from ..common import metrics
+
+
+logger = logging.getLogger(__name__)
+
+_drain_seconds = metrics.REGISTRY.histogram(
+    'awm_crawler_spool_drain_seconds', 'Time to deliver a bulk of spooled results to kafka')
+
+#: the default maximum size in bytes of all segments
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024
+#: the default size in bytes after which a new segment is started
+DEFAULT_SEGMENT_BYTES = 16 * 1024 * 1024
+#: the number of bytes read from a segment at once
+READ_BYTES = 1024 * 1024
+#: the suffix of the segment files
+SEGMENT_SUFFIX = '.seg'
+#: the suffix of the files with the number of records of a segment
+COUNT_SUFFIX = '.count'
+
+_RECORD_HEADER = struct.Struct('<II')
+_LEN = struct.Struct('<I')
+_HEADER_COUNT = struct.Struct('<H')
+
+#: a spooled kafka message
+Record = namedtuple('Record', ['key', 'value', 'headers'])
+
+
+def _pack_bytes(value: Optional[bytes]) -> bytes:
+    # None is stored as the maximum length
+    if value is None:
+        return _LEN.pack(0xffffffff)
+    return _LEN.pack(len(value)) + value
+
+
+def _unpack_bytes(data: bytes, pos: int) -> Tuple[Optional[bytes], int]:
+    length, = _LEN.unpack_from(data, pos)
+    pos += _LEN.size
+    if length == 0xffffffff:
+        return None, pos
+    return data[pos:pos + length], pos + length
+
+
+def encode_record(record: Record) -> bytes:
+    """encode a record including the record header"""
+    headers = record.headers or ()
+    parts = [_pack_bytes(record.key), _HEADER_COUNT.pack(len(headers))]
+    for key, value in headers:
+        parts.append(_pack_bytes(key.encode()))
+        parts.append(_pack_bytes(value))
+    parts.append(_pack_bytes(record.value))
+    payload = b''.join(parts)
+    return _RECORD_HEADER.pack(zlib.crc32(payload), len(payload)) + payload
+
+
+def decode_records(data: bytes, max_records: Optional[int] = None) -> Tuple[List[Record], int]:
+    """decode the complete and valid records at the start of the data
+
+    :return: a tuple with the records and the number of decoded bytes
+    :rtype: (list, int)
+    """
+    records: List[Record] = []
+    pos = 0
+    while pos + _RECORD_HEADER.size <= len(data) and (max_records is None or len(records) < max_records):
+        crc, length = _RECORD_HEADER.unpack_from(data, pos)
+        payload = data[pos + _RECORD_HEADER.size:pos + _RECORD_HEADER.size + length]
+        if len(payload) < length or zlib.crc32(payload) != crc:
+            break
+        key, p = _unpack_bytes(payload, 0)
+        count, = _HEADER_COUNT.unpack_from(payload, p)
+        p += _HEADER_COUNT.size
+        headers = []
+        for _ in range(count):
+            header_key, p = _unpack_bytes(payload, p)
+            header_value, p = _unpack_bytes(payload, p)
+            headers.append(((header_key or b'').decode(), header_value))
+        value, p = _unpack_bytes(payload, p)
+        records.append(Record(key, value, headers))
+        pos += _RECORD_HEADER.size + length
+    return records, pos
+
+
+class Spool:
+    """
+    An append-only on disk queue of kafka messages
+
+    New records are rejected (and counted in `dropped`) when the segments
+    would grow above `max_bytes`.
+
+    :param directory: the spool directory. Created if it doesn't exist
+    :type directory: str
+    :param max_bytes: the maximum size in bytes of all segments
+    :type max_bytes: int
+    :param segment_bytes: the size in bytes after which a new segment is started
+    :type segment_bytes: int
+    """
+    def __init__(self, directory: str, max_bytes: int = DEFAULT_MAX_BYTES,
+                 segment_bytes: int = DEFAULT_SEGMENT_BYTES):
+        self._dir = Path(directory)
+        self._dir.mkdir(parents=True, exist_ok=True)
+        self._max_bytes = max_bytes
+        self._segment_bytes = segment_bytes
+        self._sizes: Dict[int, int] = {}
+        for path in self._dir.glob(f'*{SEGMENT_SUFFIX}'):
+            self._sizes[int(path.stem)] = path.stat().st_size
+        # the position and the number of records delivered from the segment of the position
+        self._position, self._consumed = self._load_cursor()
+        for seq in [s for s in self._sizes if s < self._position[0]]:
+            self._delete(seq)
+        self._counts: Dict[int, int] = {}
+        self.depth = self._count()
+        self.dropped = 0
+        # records are never appended to the segments of a previous run
+        self._writer_seq = max(self._sizes, default=self._position[0]) + 1
+        self._writer = open(self._path(self._writer_seq), 'ab')
+        self._sizes[self._writer_seq] = 0
+        self._counts[self._writer_seq] = 0
+        # the encoded records that are not written yet
+        self._pending: List[bytes] = []
+        self._flush_handle: Optional[asyncio.Handle] = None
+        self._available = asyncio.Event()
+        if self.depth:
+            self._available.set()
+
+    @property
+    def size(self) -> int:
+        """the size in bytes of all segments"""
+        return sum(self._sizes.values())
+
+    @property
+    def segments(self) -> int:
+        """the number of segments"""
+        return len(self._sizes)
+
+    def _path(self, seq: int, suffix: str = SEGMENT_SUFFIX) -> Path:
+        return self._dir / f'{seq:020d}{suffix}'
+
+    def _load_cursor(self) -> Tuple[Tuple[int, int], int]:
+        start = (min(self._sizes, default=0), 0)
+        try:
+            fields = [int(f) for f in (self._dir / 'cursor').read_text().split()]
+        except FileNotFoundError:
+            return start, 0
+        except ValueError:
+            fields = []
+        if len(fields) == 2:
+            # written by a version without the number of delivered records
+            seq, offset = fields
+            try:
+                data = self._path(seq).read_bytes()[:offset]
+            except FileNotFoundError:
+                data = b''
+            return (seq, offset), len(decode_records(data)[0])
+        if len(fields) != 3:
+            logger.warning(f'invalid spool cursor in {self._dir}. Replaying all segments')
+            return start, 0
+        return (fields[0], fields[1]), fields[2]
+
+    def _store_cursor(self):
+        tmp = self._dir / 'cursor.tmp'
+        tmp.write_text(f'{self._position[0]} {self._position[1]} {self._consumed}')
+        os.replace(tmp, self._dir / 'cursor')
+
+    def _delete(self, seq: int):
+        self._sizes.pop(seq, None)
+        self._counts.pop(seq, None)
+        for path in (self._path(seq), self._path(seq, COUNT_SUFFIX)):
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+
+    def _count(self) -> int:
+        for seq in self._sizes:
+            try:
+                self._counts[seq] = int(self._path(seq, COUNT_SUFFIX).read_text())
+            except (FileNotFoundError, ValueError):
+                # the segment was not closed. Only this segment is read
+                self._counts[seq] = len(decode_records(self._path(seq).read_bytes())[0])
+        return sum(self._counts.values()) - self._consumed
+
+    def _store_count(self):
+        self._path(self._writer_seq, COUNT_SUFFIX).write_text(str(self._counts[self._writer_seq]))
+
+    def _flush(self):
+        """write the pending records with a single write"""
+        self._flush_handle = None
+        if not self._pending:
+            return
+        # the data is in the page cache when the process crashes
+        self._writer.write(b''.join(self._pending))
+        self._writer.flush()
+        self._pending = []
+        self._available.set()
+
+    def _rotate(self):
+        self._flush()
+        self._writer.close()
+        self._store_count()
+        self._writer_seq += 1
+        self._writer = open(self._path(self._writer_seq), 'ab')
+        self._sizes[self._writer_seq] = 0
+        self._counts[self._writer_seq] = 0
+
+    async def send(self, value: bytes, key: Optional[bytes] = None, headers: Optional[List] = None):
+        """append a message to the spool. Same signature as :meth:`awm.common.kafka_utils.Sender.send`"""
+        self.append(Record(key, value, headers))
+
+    def append(self, record: Record) -> bool:
+        """append a record
+
+        The record is written at the end of the current iteration of the event loop.
+
+        :return: False if the record was dropped because the spool is full
+        :rtype: bool
+        """
+        data = encode_record(record)
+        if self.size + len(data) > self._max_bytes:
+            self.dropped += 1
+            logger.warning(f'spool {self._dir} is full. Dropping record')
+            return False
+        if self._sizes[self._writer_seq] and self._sizes[self._writer_seq] + len(data) > self._segment_bytes:
+            self._rotate()
+        self._pending.append(data)
+        if self._flush_handle is None:
+            self._flush_handle = asyncio.get_event_loop().call_soon(self._flush)
+        self._sizes[self._writer_seq] += len(data)
+        self._counts[self._writer_seq] += 1
+        self.depth += 1
+        return True
+
+    def _read_segment(self, seq: int, offset: int, max_records: int) -> Tuple[List[Record], int, bool]:
+        """read and decode the records of a segment from the offset
+
+        :return: a tuple with the records, the number of decoded bytes and if there was data
+        :rtype: (list, int, bool)
+        """
+        try:
+            with open(self._path(seq), 'rb') as f:
+                f.seek(offset)
+                data = f.read(READ_BYTES)
+                records, length = decode_records(data, max_records)
+                if not records and len(data) == READ_BYTES:
+                    # a record larger than READ_BYTES
+                    data += f.read()
+                    records, length = decode_records(data, max_records)
+        except FileNotFoundError:
+            # deleted by close() while the spool shuts down
+            return [], 0, False
+        return records, length, bool(data)
+
+    async def read(self, max_records: int) -> Tuple[List[Record], Tuple[int, int]]:
+        """wait for records and read at most `max_records` of them
+
+        The records are read again until :meth:`Spool.commit` is called with the returned position.
+        The segments are read and decoded in the default executor, so replaying a large
+        backlog doesn't block the checks.
+
+        :return: a tuple with the records and the position after the records
+        :rtype: (list, tuple)
+        """
+        loop = asyncio.get_event_loop()
+        while True:
+            # cleared before the segments are read, records appended meanwhile set it again
+            self._available.clear()
+            for seq in sorted(s for s in self._sizes if s >= self._position[0]):
+                offset = self._position[1] if seq == self._position[0] else 0
+                # the segment may be rotated while it is read
+                writer_seq = self._writer_seq
+                records, length, data = await loop.run_in_executor(
+                    None, self._read_segment, seq, offset, max_records)
+                if records:
+                    return records, (seq, offset + length)
+                if seq != writer_seq and data:
+                    logger.warning(f'skipping invalid data at {offset} in {self._path(seq)}')
+            await self._available.wait()
+
+    def commit(self, position: Tuple[int, int], count: int):
+        """mark the records before the given position as delivered
+
+        :param position: the position returned by :meth:`Spool.read`
+        :type position: tuple
+        :param count: the number of delivered records
+        :type count: int
+        """
+        for seq in [s for s in self._sizes if s < position[0]]:
+            self._delete(seq)
+        # the records of a read are always from a single segment
+        self._consumed = self._consumed + count if position[0] == self._position[0] else count
+        self._position = position
+        self.depth -= count
+        self._store_cursor()
+
+    def close(self):
+        """write the pending records and close the current segment"""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+        self._flush()
+        self._writer.close()
+        if self._sizes.get(self._writer_seq):
+            self._store_count()
+        else:
+            self._delete(self._writer_seq)
+
+
+async def drain(spool: Spool, producer, topic: str, bulk_size: int):
+    """send the spooled records to kafka in bulk
+
+    A bulk is retried until all of its records are delivered. Then the
+    records are removed from the spool.
+
+    :param spool: the spool
+    :type spool: :class:`Spool`
+    :param producer: the kafka producer
+    :type producer: :class:`aiokafka.AIOKafkaProducer`
+    :param topic: the topic
+    :type topic: str
+    :param bulk_size: the maximum number of records sent at once
+    :type bulk_size: int
+    """
+    while True:
+        records, position = await spool.read(bulk_size)
+        start = asyncio.get_event_loop().time()
+        retry = 0
+        while True:
+            try:
+                futures = [await producer.send(topic, r.value, key=r.key, headers=r.headers) for r in records]
+                errors = [e for e in await asyncio.gather(*futures, return_exceptions=True) if isinstance(e, Exception)]
+                if errors:
+                    raise errors[0]
+                break
+            except Exception as e:
+                delay = min(2 ** retry, 30)
+                retry += 1
+                logger.error(f'sending {len(records)} spooled messages to {topic} failed. retry in {delay} s: {e}')
+                await asyncio.sleep(delay)
+        _drain_seconds.observe(asyncio.get_event_loop().time() - start)
+        spool.commit(position, len(records))
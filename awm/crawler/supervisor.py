@@ -0,0 +1,116 @@
+# Copyright (c) 2020 Thomas Bechtold <thomasbechtold@jpberlin.de>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""
+Run and supervise multiple worker processes
+"""
+
+import logging
+import multiprocessing
+import multiprocessing.connection
+import os
+import signal
+import time
+from typing import Callable, Dict, Optional
+
+
+logger = logging.getLogger(__name__)
+
+
+class Supervisor:
+    """
+    Start `workers` processes and restart them when they exit
+
+    Workers that crash quickly are restarted with an exponential backoff.
+
+    :param target: the function executed in the worker process. Gets the worker number as argument
+    :type target: callable
+    :param workers: the number of worker processes
+    :type workers: int
+    :param max_backoff: the maximum delay in seconds before a crashed worker gets restarted
+    :type max_backoff: float
+    """
+    def __init__(self, target: Callable[[int], None], workers: int, max_backoff: float = 60.0):
+        self._target = target
+        self._workers = workers
+        self._max_backoff = max_backoff
+        self._ctx = multiprocessing.get_context('fork')
+        self._processes: Dict[int, multiprocessing.process.BaseProcess] = {}
+        self._started: Dict[int, float] = {}
+        self._backoff: Dict[int, float] = {}
+        self._restart_at: Dict[int, float] = {}
+        self._stopping = False
+
+    def _run_worker(self, worker: int):
+        # the signal handlers of the supervisor are inherited by fork
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        # SIGHUP is forwarded by the supervisor. Ignore it until the worker installs its own handler
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        self._target(worker)
+
+    def _start(self, worker: int):
+        p = self._ctx.Process(target=self._run_worker, args=(worker,), name=f'awm-worker-{worker}')
+        p.start()
+        self._processes[worker] = p
+        self._started[worker] = time.monotonic()
+        logger.info(f'started worker {worker} (pid {p.pid})')
+
+    def _handle_exit(self, worker: int):
+        p = self._processes.pop(worker)
+        p.join()
+        lifetime = time.monotonic() - self._started[worker]
+        # a worker that ran for a while gets restarted immediately
+        backoff = 0.0 if lifetime > self._max_backoff else min(
+            max(1.0, self._backoff.get(worker, 0.0) * 2), self._max_backoff)
+        self._backoff[worker] = backoff
+        self._restart_at[worker] = time.monotonic() + backoff
+        logger.warning(f'worker {worker} (pid {p.pid}) exited with {p.exitcode}. restarting in {backoff:.1f} s')
+
+    def hangup(self, *args):
+        """forward SIGHUP to all workers (e.g. to reload the config). Can be used as signal handler"""
+        for p in self._processes.values():
+            if p.pid is not None:
+                os.kill(p.pid, signal.SIGHUP)
+
+    def stop(self, *args):
+        """stop all workers. Can be used as signal handler"""
+        self._stopping = True
+
+    def run(self, poll_interval: Optional[float] = 1.0):
+        """start the workers and supervise them until :meth:`Supervisor.stop` is called"""
+        handlers = {sig: signal.signal(sig, self.stop) for sig in (signal.SIGTERM, signal.SIGINT)}
+        handlers[signal.SIGHUP] = signal.signal(signal.SIGHUP, self.hangup)
+        for worker in range(self._workers):
+            self._start(worker)
+        try:
+            while not self._stopping:
+                sentinels = {p.sentinel: w for w, p in self._processes.items()}
+                for sentinel in multiprocessing.connection.wait(list(sentinels), poll_interval):
+                    self._handle_exit(sentinels[sentinel])  # type: ignore
+                now = time.monotonic()
+                for worker, restart_at in list(self._restart_at.items()):
+                    if restart_at <= now and not self._stopping:
+                        del self._restart_at[worker]
+                        self._start(worker)
+        finally:
+            for p in self._processes.values():
+                p.terminate()
+            for p in self._processes.values():
+                p.join()
+            for sig, handler in handlers.items():
+                signal.signal(sig, handler)
+            logger.info('all workers stopped')
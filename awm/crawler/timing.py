@@ -0,0 +1,121 @@
+# Copyright (c) 2020 Thomas Bechtold <thomasbechtold@jpberlin.de>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""
+Measure the phases of a check with the aiohttp request tracing
+
+The phases (see :class:`awm.common.result.Timings`) tell slow networks
+(DNS, connect) apart from slow servers (time to first byte, body). aiohttp
+doesn't signal the end of the TLS handshake, so it is part of the connect
+phase.
+"""
+
+import time
+from typing import TYPE_CHECKING, Callable, Optional
+
+from ..common.result import Timings
+
+if TYPE_CHECKING:
+    import aiohttp
+
+
+class PhaseTimer:
+    """
+    Collect the phase durations of a single request with a monotonic clock
+
+    Pass the timer as `timer` of the `trace_request_ctx` to a request of a
+    session with the :func:`trace_config`. Redirects add up the dns and connect phases.
+    """
+    __slots__ = ('_dns_start', '_connect_start', '_connect_dns', '_ready', '_headers',
+                 'dns', 'connect', 'ttfb', 'body')
+
+    def __init__(self):
+        self._dns_start = self._connect_start = self._ready = self._headers = 0.0
+        self._connect_dns = 0.0
+        self.dns: Optional[float] = None
+        self.connect: Optional[float] = None
+        self.ttfb: Optional[float] = None
+        self.body: Optional[float] = None
+
+    def request_start(self):
+        self._ready = time.monotonic()
+
+    def dns_start(self):
+        self._dns_start = time.monotonic()
+
+    def dns_end(self):
+        self.dns = (self.dns or 0.0) + time.monotonic() - self._dns_start
+
+    def dns_cache_hit(self):
+        self.dns = self.dns or 0.0
+
+    def connection_create_start(self):
+        self._connect_start = time.monotonic()
+        self._connect_dns = self.dns or 0.0
+
+    def connection_create_end(self):
+        now = time.monotonic()
+        # the host name is resolved while the connection is created
+        self.connect = (self.connect or 0.0) + now - self._connect_start - ((self.dns or 0.0) - self._connect_dns)
+        self._ready = now
+
+    def connection_reuse(self):
+        self._ready = time.monotonic()
+
+    def request_end(self):
+        self._headers = time.monotonic()
+        self.ttfb = self._headers - self._ready
+
+    def body_end(self):
+        """the response body was read"""
+        if self.ttfb is not None:
+            self.body = time.monotonic() - self._headers
+
+    def timings(self) -> Optional[Timings]:
+        """get the measured phase durations
+
+        :return: the durations or None if nothing was measured (e.g. without the :func:`trace_config`)
+        :rtype: :class:`awm.common.result.Timings` or None
+        """
+        if self.dns is None and self.connect is None and self.ttfb is None:
+            return None
+        return Timings(self.dns, self.connect, self.ttfb, self.body)
+
+
+def _callback(method: Callable[[PhaseTimer], None]):
+    async def callback(session, trace_config_ctx, params):
+        timer = (trace_config_ctx.trace_request_ctx or {}).get('timer')
+        if timer is not None:
+            method(timer)
+    return callback
+
+
+def trace_config() -> 'aiohttp.TraceConfig':
+    """get the trace config which reports the request events to the :class:`PhaseTimer` of a request
+
+    :rtype: :class:`aiohttp.TraceConfig`
+    """
+    import aiohttp
+    config = aiohttp.TraceConfig()
+    config.on_request_start.append(_callback(PhaseTimer.request_start))
+    config.on_dns_resolvehost_start.append(_callback(PhaseTimer.dns_start))
+    config.on_dns_resolvehost_end.append(_callback(PhaseTimer.dns_end))
+    config.on_dns_cache_hit.append(_callback(PhaseTimer.dns_cache_hit))
+    config.on_connection_create_start.append(_callback(PhaseTimer.connection_create_start))
+    config.on_connection_create_end.append(_callback(PhaseTimer.connection_create_end))
+    config.on_connection_reuseconn.append(_callback(PhaseTimer.connection_reuse))
+    config.on_request_end.append(_callback(PhaseTimer.request_end))
+    return config
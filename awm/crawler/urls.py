@@ -0,0 +1,266 @@
+# Copyright (c) 2020 Thomas Bechtold <thomasbechtold@jpberlin.de>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""
+The per url check configuration
+"""
+
+import re
+import zlib
+from typing import Dict, Optional, Pattern, Tuple
+from urllib.parse import urlsplit, urlunsplit
+
+from ..common.exception import AwmConfigError
+from . import inventory
+
+
+#: the default number of characters kept between body chunks for regex checks
+DEFAULT_REGEX_OVERLAP = 1024
+#: the ports which are omitted from normalized urls
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+
+class UrlSettings:
+    """
+    the check settings of a url
+
+    Urls with the same settings share a single instance (see :func:`url_configs`),
+    so the defaults are not copied for every url.
+
+    :param interval: the check interval in seconds
+    :type interval: float
+    :param regex: the compiled regular expression the response body is checked against
+    :type regex: Pattern or None
+    :param regex_overlap: the number of characters kept between body chunks for the regex check
+    :type regex_overlap: int
+    :param max_body_bytes: the maximum number of body bytes read for the regex check. None for no limit
+    :type max_body_bytes: int or None
+    :param head: send a HEAD request instead of a GET request when there is no regex configured
+    :type head: bool
+    """
+    __slots__ = ('interval', 'regex', 'regex_overlap', 'max_body_bytes', 'head')
+
+    def __init__(self, interval: float, regex: Optional[Pattern] = None,
+                 regex_overlap: int = DEFAULT_REGEX_OVERLAP, max_body_bytes: Optional[int] = None,
+                 head: bool = False):
+        self.interval = interval
+        self.regex = regex
+        self.regex_overlap = regex_overlap
+        self.max_body_bytes = max_body_bytes
+        self.head = head
+
+    def _key(self) -> Tuple:
+        # compiled patterns compare equal with the same pattern and flags
+        return (self.interval, self.regex, self.regex_overlap, self.max_body_bytes, self.head)
+
+    def __eq__(self, other):
+        if isinstance(other, UrlSettings):
+            return self._key() == other._key()
+        return False
+
+    def __hash__(self):
+        return hash(self._key())
+
+
+class UrlConfig:
+    """
+    the check configuration for a single url
+
+    :param url: the url to check
+    :type url: str
+    :param interval: the check interval in seconds
+    :type interval: float
+    :param regex: the compiled regular expression the response body is checked against
+    :type regex: Pattern or None
+    :param regex_overlap: the number of characters kept between body chunks for the regex check
+    :type regex_overlap: int
+    :param max_body_bytes: the maximum number of body bytes read for the regex check. None for no limit
+    :type max_body_bytes: int or None
+    :param head: send a HEAD request instead of a GET request when there is no regex configured
+    :type head: bool
+    """
+    __slots__ = ('url', 'settings')
+
+    def __init__(self, url: str, interval: float, regex: Optional[Pattern] = None,
+                 regex_overlap: int = DEFAULT_REGEX_OVERLAP, max_body_bytes: Optional[int] = None,
+                 head: bool = False):
+        self.url = url
+        self.settings = UrlSettings(interval, regex, regex_overlap, max_body_bytes, head)
+
+    @classmethod
+    def shared(cls, url: str, settings: UrlSettings) -> 'UrlConfig':
+        """create the check configuration of a url with (shared) settings
+
+        :param url: the url to check
+        :type url: str
+        :param settings: the check settings
+        :type settings: :class:`UrlSettings`
+
+        :rtype: :class:`UrlConfig`
+        """
+        url_conf = cls.__new__(cls)
+        url_conf.url = url
+        url_conf.settings = settings
+        return url_conf
+
+    @property
+    def interval(self) -> float:
+        return self.settings.interval
+
+    @property
+    def regex(self) -> Optional[Pattern]:
+        return self.settings.regex
+
+    @property
+    def regex_overlap(self) -> int:
+        return self.settings.regex_overlap
+
+    @property
+    def max_body_bytes(self) -> Optional[int]:
+        return self.settings.max_body_bytes
+
+    @property
+    def head(self) -> bool:
+        return self.settings.head
+
+    def __eq__(self, other):
+        if isinstance(other, UrlConfig):
+            return self.url == other.url and self.settings == other.settings
+        return False
+
+
+def _compile_regex(url: str, regex: Optional[str]) -> Optional[Pattern]:
+    if not regex:
+        return None
+    try:
+        return re.compile(regex)
+    except re.error as e:
+        raise AwmConfigError(f'invalid regex {regex} for {url}: {e}')
+
+
+def _number(value, integer: bool = False) -> bool:
+    # bool is an int, but not a valid number here
+    return isinstance(value, int if integer else (int, float)) and not isinstance(value, bool) and value >= 0
+
+
+def _settings(url: str, key: Tuple) -> UrlSettings:
+    """create the settings of a url after checking the types of the values"""
+    interval, regex, regex_overlap, max_body_bytes, head = key
+    if not _number(interval) or not interval:
+        raise AwmConfigError(f'invalid interval {interval!r} for {url}. Use a positive number')
+    if regex is not None and not isinstance(regex, str):
+        raise AwmConfigError(f'invalid regex {regex!r} for {url}. Use a string')
+    if not _number(regex_overlap, integer=True):
+        raise AwmConfigError(f'invalid regex_overlap {regex_overlap!r} for {url}. Use a non-negative integer')
+    if max_body_bytes is not None and not _number(max_body_bytes, integer=True):
+        raise AwmConfigError(f'invalid max_body_bytes {max_body_bytes!r} for {url}. Use a non-negative integer')
+    if not isinstance(head, bool):
+        raise AwmConfigError(f'invalid head {head!r} for {url}. Use true or false')
+    return UrlSettings(interval, _compile_regex(url, regex), regex_overlap, max_body_bytes, head)
+
+
+def url_configs(conf: Dict, database: bool = True) -> Dict[str, UrlConfig]:
+    """get the check configuration for all configured urls
+
+    The urls of the `crawler` section and of the inventory (see
+    :mod:`awm.crawler.inventory`) are used. An inventory url overrides an
+    url of the `crawler` section. Regular expressions are compiled once here
+    and reused for every check. Urls with the same settings share them.
+
+    :param conf: the configuration dict
+    :type conf: dict
+    :param database: read an inventory table. False to skip it (e.g. to validate the config offline)
+    :type database: bool
+
+    :raises AwmConfigError: Raised when a setting (e.g. a regular expression) or the inventory is invalid
+
+    :return: a dict with the url as key and the :class:`UrlConfig` as value
+    :rtype: dict
+    """
+    crawler_conf = conf['crawler']
+    defaults = (crawler_conf['interval'],
+                crawler_conf.get('regex_overlap', DEFAULT_REGEX_OVERLAP),
+                crawler_conf.get('max_body_bytes'),
+                crawler_conf.get('head', False))
+    settings: Dict[Tuple, UrlSettings] = {}
+    ret = {}
+    for url, url_conf in inventory.entries(conf, database):
+        if not isinstance(url_conf, dict):
+            raise AwmConfigError(f'invalid settings {url_conf!r} for {url}. Use a map')
+        key = (
+            # allow to override the check interval on a url base
+            url_conf.get('interval', defaults[0]),
+            url_conf.get('regex') or None,
+            url_conf.get('regex_overlap', defaults[1]),
+            url_conf.get('max_body_bytes', defaults[2]),
+            url_conf.get('head', defaults[3]))
+        try:
+            url_settings = settings.get(key)
+        except TypeError:
+            # unhashable values (e.g. a list) are invalid
+            url_settings = None
+        if url_settings is None:
+            url_settings = settings[key] = _settings(url, key)
+        ret[url] = UrlConfig.shared(url, url_settings)
+    return ret
+
+
+def normalize(url: str) -> str:
+    """get the normalized form of a url
+
+    The scheme and the host are lowercased, a default port (see
+    :data:`DEFAULT_PORTS`) and the fragment are removed and an empty path
+    becomes `/`. Only forms which name the same resource are normalized,
+    so a trailing slash or the order of the query parameters are kept.
+
+    :param url: the url
+    :type url: str
+
+    :return: the normalized url. The url itself if it can't be parsed
+    :rtype: str
+    """
+    try:
+        parts = urlsplit(url)
+        port = parts.port
+    except ValueError:
+        return url
+    scheme = parts.scheme.lower()
+    host = parts.hostname or ''
+    if ':' in host:
+        host = f'[{host}]'
+    if port is not None and port != DEFAULT_PORTS.get(scheme):
+        host = f'{host}:{port}'
+    userinfo, _, _ = parts.netloc.rpartition('@')
+    netloc = f'{userinfo}@{host}' if userinfo else host
+    return urlunsplit((scheme, netloc, parts.path or '/', parts.query, ''))
+
+
+def shard(url: str, shards: int) -> int:
+    """get the shard a url belongs to
+
+    The shard is stable across processes and restarts (unlike :func:`hash`).
+    The forms of a url with the same :func:`normalize` form share a shard,
+    so their checks can share a request.
+
+    :param url: the url
+    :type url: str
+    :param shards: the number of shards
+    :type shards: int
+
+    :return: the shard number between 0 and `shards` - 1
+    :rtype: int
+    """
+    return zlib.crc32(normalize(url).encode()) % shards
@@ -17,82 +17,29 @@
 
 """
 Persist awm messages from a kafka topic in a database
+
+Only the command line is defined here. The service (see
+:mod:`awm.persister.service`) and its dependencies are imported after
+the arguments are parsed, so `--help` starts fast.
 """
 
-import asyncio
 import argparse
-from pathlib import Path
-import logging
-import aiopg
-import json
-
-from ..common import config
-from ..common import kafka_utils
-from ..common import result
-
-logger = logging.getLogger(__name__)
-
-
-async def _db_create_table(cur):
-    """create the DB table if it does not already exist"""
-    sql = f"""
-    DO $$ BEGIN
-    CREATE TYPE result_status AS ENUM (
-    '{result.ResultStatus.SUCCESSFUL}',
-    '{result.ResultStatus.TIMEOUT}',
-    '{result.ResultStatus.CLIENT_ERROR}',
-    '{result.ResultStatus.UNKNOWN_ERROR}');
-    EXCEPTION
-    WHEN duplicate_object THEN null;
-    END $$;
-    """
-    await cur.execute(sql)
-
-    sql = """CREATE TABLE IF NOT EXISTS crawler_results (
-    url VARCHAR(255) NOT NULL,
-    start_time timestamp NOT NULL,
-    end_time timestamp,
-    response_time interval,
-    response_status SMALLINT,
-    response_regex_status BOOLEAN,
-    status result_status NOT NULL,
-    status_message text
-    );"""
-    await cur.execute(sql)
-    logger.info('database table setup done')
-
-
-async def _consume(conf):
-    async with aiopg.create_pool(conf['persister']['postgres']['uri']) as pool:
-        async with pool.acquire() as conn:
-            # prepare database first
-            async with conn.cursor() as cur:
-                await _db_create_table(cur)
-
-            async with kafka_utils.kafka_consumer(
-                    conf['kafka']['servers'], [conf['kafka']['topic_name']],
-                    'awm-group-1', conf['kafka']['ssl']) as consumer:
-                # FIXME: make this more rubust - in case there is an exception, the whole persister crashs
-                async for msg in consumer:
-                    logger.debug(f'consumed kafka msg: {msg.topic}, partition: {msg.partition}, '
-                                 f'offset: {msg.offset}, key: {msg.key}, val: {msg.value}, offset: {msg.offset}')
-                    res = result.Result.from_json(json.loads(msg.value.decode()))
-                    sql, sql_args = res.sql()
-                    async with conn.cursor() as cur:
-                        logger.debug(f'executing sql: {cur.mogrify(sql, (sql_args))}')
-                        await cur.execute(sql, (sql_args))
+import os
 
 
 def _parser():
     parser = argparse.ArgumentParser(
         description='Persist messages from kafka to the database')
+    # level names, so the logging module is not imported for --help
     parser.add_argument('-d', '--debug', help="set loglevel to DEBUG",
-                        action="store_const", dest="loglevel", const=logging.DEBUG,
-                        default=logging.WARNING)
+                        action="store_const", dest="loglevel", const='DEBUG',
+                        default='WARNING')
     parser.add_argument('-v', '--verbose', help="set loglevel to INFO",
-                        action="store_const", dest="loglevel", const=logging.INFO)
+                        action="store_const", dest="loglevel", const='INFO')
     parser.add_argument('-c', '--config', help="path to the config file. Default: %(default)s",
-                        default=f'{Path.home()}/.config/awm/config.json')
+                        default=os.path.expanduser('~/.config/awm/config.json'))
+    parser.add_argument('-t', '--check-config', help="validate the config file and exit",
+                        action='store_true')
     return parser
 
 
@@ -102,9 +49,23 @@ def main():
     """
     parser = _parser()
     args = parser.parse_args()
+    from ..common import config
+    from ..common.exception import AwmConfigError
+    try:
+        conf = config.get_config(args.config)
+        if args.check_config:
+            config.validate_persister(conf)
+    except AwmConfigError as e:
+        parser.exit(1, f'invalid config {args.config}: {e}\n')
+    if args.check_config:
+        parser.exit(0, f'config {args.config} is valid\n')
+    # imported after the validation, so -t doesn't pay for logging and the service
+    import asyncio
+    import logging
+    from . import service
     logging.basicConfig(level=args.loglevel)
-    conf = config.get_config(args.config)
-    asyncio.run(_consume(conf))
+    logging.getLogger(__name__).info(f'using config {args.config}')
+    asyncio.run(service._consume(conf))
 
 
 # for debugging
@@ -0,0 +1,126 @@
+# Copyright (c) 2020 Thomas Bechtold <thomasbechtold@jpberlin.de>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""
+Only persist state changes and periodic heartbeats of every url
+
+A result is written when its state (`response_status`,
+`response_regex_status` and `status`) differs from the previous result
+of the url or when the last written result of the url is older than the
+heartbeat interval. The `repeats` column of a written row contains the
+number of results with the same state that were skipped since the
+previous row, so the status history stays exact.
+
+The states are kept per kafka partition. The results of a url are in a
+single partition, so the states of a revoked partition can be written
+with :meth:`ChangeFilter.pending` and dropped with
+:meth:`ChangeFilter.forget` before another persister takes it over.
+"""
+
+import datetime
+from typing import Dict, Hashable, Optional, Tuple
+
+from ..common.result import Result, ResultBatch
+
+
+_URL = Result.SQL_COLUMNS.index('url')
+_START_TIME = Result.SQL_COLUMNS.index('start_time')
+_REPEATS = Result.SQL_COLUMNS.index('repeats')
+_STATE = tuple(Result.SQL_COLUMNS.index(c) for c in ('response_status', 'response_regex_status', 'status'))
+
+
+class _UrlState:
+    __slots__ = ('state', 'written', 'repeats', 'row')
+
+    def __init__(self, state: Tuple, written: datetime.datetime, repeats: int, row: Optional[Tuple] = None):
+        self.state = state
+        self.written = written
+        self.repeats = repeats
+        # the last skipped result
+        self.row = row
+
+
+class ChangeFilter:
+    """
+    Keep the last state of every url and drop results without a state change
+
+    :param heartbeat: the interval in seconds a result is written even without a state change
+    :type heartbeat: float
+    """
+    def __init__(self, heartbeat: float):
+        self._heartbeat = datetime.timedelta(seconds=heartbeat)
+        # partition -> url -> state
+        self._states: Dict[Hashable, Dict[str, _UrlState]] = {}
+
+    def __len__(self):
+        return sum(len(states) for states in self._states.values())
+
+    def filter(self, results: ResultBatch, partition: Hashable = None) -> Tuple[ResultBatch, Dict[str, _UrlState]]:
+        """get the results that need to be written
+
+        The url states are not updated until :meth:`ChangeFilter.update` is
+        called with the returned states, so a failed write can be retried.
+
+        :param results: the results
+        :type results: :class:`awm.common.result.ResultBatch`
+        :param partition: the kafka partition of the results
+
+        :return: a tuple with the results to write and the new url states
+        :rtype: (:class:`awm.common.result.ResultBatch`, dict)
+        """
+        changed = ResultBatch()
+        states: Dict[str, _UrlState] = {}
+        known = self._states.get(partition, {})
+        for row in results.rows():
+            url = row[_URL]
+            state = tuple(str(row[i]) if row[i] is not None else None for i in _STATE)
+            last = states.get(url) or known.get(url)
+            if last is not None and last.state == state and row[_START_TIME] - last.written < self._heartbeat:
+                states[url] = _UrlState(state, last.written, last.repeats + 1, row)
+                continue
+            values = list(row)
+            values[_REPEATS] = last.repeats if last is not None else 0
+            changed.append_row(tuple(values))
+            states[url] = _UrlState(state, row[_START_TIME], 0)
+        return changed, states
+
+    def update(self, states: Dict[str, _UrlState], partition: Hashable = None):
+        """update the url states after the results returned by :meth:`ChangeFilter.filter` were written"""
+        self._states.setdefault(partition, {}).update(states)
+
+    def pending(self, partition: Hashable = None) -> ResultBatch:
+        """get the last skipped result of every url of a partition with skipped results
+
+        The `repeats` of a returned row is the number of results skipped before it,
+        so writing the rows keeps the status history exact.
+
+        :param partition: the kafka partition
+        :rtype: :class:`awm.common.result.ResultBatch`
+        """
+        pending = ResultBatch()
+        for state in self._states.get(partition, {}).values():
+            if state.repeats and state.row is not None:
+                values = list(state.row)
+                values[_REPEATS] = state.repeats - 1
+                pending.append_row(tuple(values))
+        return pending
+
+    def forget(self, partition: Hashable = None):
+        """drop the url states of a partition (e.g. when it was revoked)
+
+        :param partition: the kafka partition
+        """
+        self._states.pop(partition, None)
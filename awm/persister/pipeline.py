@@ -0,0 +1,287 @@
+# Copyright (c) 2020 Thomas Bechtold <thomasbechtold@jpberlin.de>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""
+Persist the messages of every assigned kafka partition in an independent pipeline
+"""
+
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from aiokafka import ConsumerRebalanceListener
+
+from ..common import metrics
+
+
+logger = logging.getLogger(__name__)
+
+#: the delay in seconds before the first retry of a failed write. It doubles with every retry
+RETRY_DELAY = 1.0
+#: the maximum delay in seconds between the retries of a failed write
+MAX_RETRY_DELAY = 30.0
+
+_batch_size = metrics.REGISTRY.histogram(
+    'awm_persister_batch_size', 'Number of messages in a written batch',
+    buckets=(1, 10, 50, 100, 250, 500, 1000, 2500, 5000))
+_batch_seconds = metrics.REGISTRY.histogram(
+    'awm_persister_batch_write_seconds', 'Time to write and commit a batch including retries')
+_consumer_lag = metrics.REGISTRY.gauge(
+    'awm_persister_consumer_lag', 'Number of messages in a partition that are not written yet', ('partition',))
+
+
+class PartitionPipeline:
+    """
+    Batch and write the messages of a single partition in order
+
+    The offset of a batch is committed after the batch was written.
+    Failed writes and commits are retried, so a partition never skips a
+    batch. Once the partition is revoked, a failed write or commit is not
+    retried anymore and the pipeline stops without committing. The next
+    consumer of the partition gets the messages again.
+
+    The partition is paused in the consumer while `max_in_flight` messages
+    wait for their batch and resumed once at most half of them wait.
+
+    :param consumer: the kafka consumer
+    :type consumer: :class:`aiokafka.AIOKafkaConsumer`
+    :param tp: the partition
+    :type tp: :class:`aiokafka.TopicPartition`
+    :param write: the coroutine function writing a batch of messages
+    :type write: callable
+    :param batch_size: the maximum number of messages in a batch
+    :type batch_size: int
+    :param batch_timeout: the maximum time in seconds to wait for more messages for a batch
+    :type batch_timeout: float
+    :param max_in_flight: the maximum number of consumed but not yet written messages
+    :type max_in_flight: int
+    """
+    def __init__(self, consumer, tp, write: Callable[[List], Awaitable[None]],
+                 batch_size: int, batch_timeout: float, max_in_flight: int):
+        self._consumer = consumer
+        self._tp = tp
+        self._write = write
+        self._batch_size = batch_size
+        self._batch_timeout = batch_timeout
+        self._max_in_flight = max_in_flight
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._paused = False
+        self._closing = False
+        # set on stop and when the next retry of a failed write is due
+        self._retry = asyncio.Event()
+        #: the offset of the next message to write
+        self.committed: Optional[int] = None
+        self._task = asyncio.create_task(self._run())
+
+    @property
+    def queue_depth(self) -> int:
+        """the number of consumed messages waiting for their batch"""
+        return self._queue.qsize()
+
+    def put(self, msgs: List):
+        """add consumed messages. Pauses the partition when `max_in_flight` messages are waiting"""
+        if self._closing:
+            return
+        for msg in msgs:
+            self._queue.put_nowait(msg)
+        if not self._paused and self._queue.qsize() >= self._max_in_flight:
+            self._paused = True
+            self._consumer.pause(self._tp)
+
+    def _resume(self):
+        if self._paused and not self._closing and self._queue.qsize() <= self._max_in_flight // 2:
+            self._paused = False
+            self._consumer.resume(self._tp)
+
+    async def _next_batch(self) -> List:
+        loop = asyncio.get_event_loop()
+        batch: List = []
+        deadline = None
+        while len(batch) < self._batch_size:
+            if self._queue.empty():
+                if self._closing:
+                    break
+                timeout = None
+                if deadline is not None:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                try:
+                    msg = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+            else:
+                msg = self._queue.get_nowait()
+            # None only wakes up a closing pipeline
+            if msg is not None:
+                batch.append(msg)
+                if deadline is None:
+                    deadline = loop.time() + self._batch_timeout
+        return batch
+
+    def update_lag(self):
+        """update the consumer lag metric (the offset of the next message in the partition
+        minus the offset of the next message to write)"""
+        highwater = self._consumer.highwater(self._tp)
+        if highwater is not None and self.committed is not None:
+            _consumer_lag.set(max(highwater - self.committed, 0), str(self._tp))
+
+    async def _retried(self, action: str, call: Callable[[], Awaitable[None]]) -> bool:
+        """call `call` until it succeeds
+
+        :return: False when it failed after the partition was revoked
+        :rtype: bool
+        """
+        retry = 0
+        while True:
+            try:
+                await call()
+                return True
+            except Exception as e:
+                if self._closing:
+                    logger.error(f'{action} of {self._tp} failed. '
+                                 f'The partition is revoked, the messages are left uncommitted: {e}')
+                    return False
+                delay = min(RETRY_DELAY * 2 ** retry, MAX_RETRY_DELAY)
+                retry += 1
+                logger.exception(f'{action} of {self._tp} failed. retry in {delay} s: {e}')
+                # a revoked partition is retried once more right away. No wait_for,
+                # it can swallow a cancellation when the event is set at the same time
+                retry_due = asyncio.get_event_loop().call_later(delay, self._retry.set)
+                try:
+                    await self._retry.wait()
+                finally:
+                    retry_due.cancel()
+                if not self._closing:
+                    self._retry.clear()
+
+    async def _write_batch(self, batch: List) -> bool:
+        """write and commit a batch
+
+        The write and the commit are retried separately, so a failed commit
+        (e.g. during a rebalance) doesn't write the batch again.
+
+        :return: False when the write or the commit failed after the partition was revoked
+        :rtype: bool
+        """
+        start = asyncio.get_event_loop().time()
+        offset = batch[-1].offset + 1
+        if not await self._retried(f'writing {len(batch)} messages', lambda: self._write(batch)):
+            return False
+        if not await self._retried(f'committing offset {offset}', lambda: self._consumer.commit({self._tp: offset})):
+            return False
+        self.committed = offset
+        _batch_size.observe(len(batch))
+        _batch_seconds.observe(asyncio.get_event_loop().time() - start)
+        self.update_lag()
+        return True
+
+    async def _run(self):
+        while not (self._closing and self._queue.empty()):
+            batch = await self._next_batch()
+            self._resume()
+            if batch and not await self._write_batch(batch):
+                # later batches must not be committed before the failed one
+                break
+
+    async def stop(self):
+        """write and commit all consumed messages and stop the pipeline
+
+        A failing write or commit is retried once more and then given up.
+        """
+        self._closing = True
+        self._retry.set()
+        # wakes up a pipeline waiting for messages
+        self._queue.put_nowait(None)
+        await self._task
+
+
+class PartitionPipelines(ConsumerRebalanceListener):
+    """
+    Run one :class:`PartitionPipeline` per assigned partition
+
+    The pipelines of revoked partitions are drained before the partitions are
+    handed to another consumer, so every message is written only once.
+
+    See :class:`PartitionPipeline` for the other parameters.
+
+    :param revoked: the coroutine function called with every revoked partition
+                    after its pipeline wrote all consumed messages (also on stop)
+    :type revoked: callable or None
+    """
+    def __init__(self, consumer, write: Callable[[List], Awaitable[None]],
+                 batch_size: int, batch_timeout: float, max_in_flight: int,
+                 revoked: Optional[Callable[[Any], Awaitable[None]]] = None):
+        self._consumer = consumer
+        self._write = write
+        self._batch_size = batch_size
+        self._batch_timeout = batch_timeout
+        self._max_in_flight = max_in_flight
+        self._revoked = revoked
+        self._pipelines: Dict = {}
+
+    def __len__(self):
+        return len(self._pipelines)
+
+    @property
+    def queue_depth(self) -> int:
+        """the number of consumed messages waiting for their batch in all pipelines"""
+        return sum(p.queue_depth for p in self._pipelines.values())
+
+    async def _stop(self, tp, pipeline: PartitionPipeline):
+        await pipeline.stop()
+        if self._revoked is not None:
+            try:
+                await self._revoked(tp)
+            except Exception as e:
+                # the partition must be handed over anyway
+                logger.exception(f'cleaning up the revoked partition {tp} failed: {e}')
+
+    async def on_partitions_revoked(self, revoked):
+        await asyncio.gather(*[self._stop(tp, self._pipelines.pop(tp)) for tp in revoked if tp in self._pipelines])
+        for tp in revoked:
+            _consumer_lag.remove(str(tp))
+        logger.info(f'partitions revoked: {sorted(str(tp) for tp in revoked)}')
+
+    async def on_partitions_assigned(self, assigned):
+        for tp in assigned:
+            if tp not in self._pipelines:
+                self._pipelines[tp] = PartitionPipeline(self._consumer, tp, self._write, self._batch_size,
+                                                        self._batch_timeout, self._max_in_flight)
+        logger.info(f'partitions assigned: {sorted(str(tp) for tp in assigned)}')
+
+    def dispatch(self, data: Dict):
+        """hand consumed messages to the pipelines of their partitions
+
+        Never waits. A partition with `max_in_flight` waiting messages is
+        paused in the consumer until its pipeline caught up.
+
+        :param data: the consumed messages by partition (as returned by `getmany`)
+        :type data: dict
+        """
+        for tp, msgs in data.items():
+            pipeline = self._pipelines.get(tp)
+            if pipeline is None:
+                # the partition was revoked in the meantime
+                continue
+            if pipeline.committed is None and msgs:
+                pipeline.committed = msgs[0].offset
+            pipeline.update_lag()
+            pipeline.put(msgs)
+
+    async def stop(self):
+        """write and commit all consumed messages and stop all pipelines"""
+        await self.on_partitions_revoked(list(self._pipelines))
@@ -0,0 +1,154 @@
+# Copyright (c) 2020 Thomas Bechtold <thomasbechtold@jpberlin.de>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""
+Maintain per-minute and per-hour rollups of the results while they are persisted
+
+Every rollup row contains the number of results per :class:`ResultStatus`,
+the number of http error responses (status >= 400), the number of failed
+regex checks and a :class:`awm.common.sketch.LatencySketch` of the
+response times of a url within a time bucket.
+"""
+
+import datetime
+import json
+from typing import Dict, List, Optional, Tuple
+
+from ..common.result import ResultBatch, ResultStatus
+from ..common.sketch import LatencySketch
+
+
+#: the rollup tables and the size of their buckets in seconds
+TABLES = {
+    'crawler_rollup_minute': 60,
+    'crawler_rollup_hour': 3600,
+}
+#: the columns with the number of results per status
+STATUS_COLUMNS = {s: f'count_{s.value.lower()}' for s in ResultStatus}
+COLUMNS = ('url_id', 'bucket') + tuple(STATUS_COLUMNS.values()) + ('http_errors', 'regex_failures', 'latency')
+
+#: merges two :meth:`LatencySketch.to_json` objects
+MERGE_FUNCTION_SQL = """CREATE OR REPLACE FUNCTION awm_sketch_merge(a jsonb, b jsonb) RETURNS jsonb AS $$
+SELECT coalesce(jsonb_object_agg(key, total), '{}'::jsonb) FROM (
+  SELECT key, sum(value::bigint) AS total FROM (
+    SELECT * FROM jsonb_each_text(a) UNION ALL SELECT * FROM jsonb_each_text(b)) AS buckets
+  GROUP BY key) AS merged
+$$ LANGUAGE sql IMMUTABLE;"""
+
+_EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def create_table_sql(table: str) -> str:
+    """get the SQL statement creating a rollup table"""
+    counts = ',\n'.join(f'{c} INTEGER NOT NULL DEFAULT 0' for c in STATUS_COLUMNS.values())
+    return f"""CREATE TABLE IF NOT EXISTS {table} (
+    url_id INTEGER NOT NULL REFERENCES urls(id),
+    bucket timestamptz NOT NULL,
+    {counts},
+    http_errors INTEGER NOT NULL DEFAULT 0,
+    regex_failures INTEGER NOT NULL DEFAULT 0,
+    latency jsonb NOT NULL DEFAULT '{{}}',
+    PRIMARY KEY (url_id, bucket)
+    );"""
+
+
+def bucket(dt: datetime.datetime, seconds: int) -> datetime.datetime:
+    """get the start of the time bucket of a datetime. Naive datetimes are UTC
+
+    :param dt: the datetime
+    :type dt: datetime
+    :param seconds: the bucket size
+    :type seconds: int
+
+    :return: the start of the bucket (UTC)
+    :rtype: datetime
+    """
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=datetime.timezone.utc)
+    offset = (dt - _EPOCH) // datetime.timedelta(seconds=1)
+    return _EPOCH + datetime.timedelta(seconds=offset - offset % seconds)
+
+
+class RollupRow:
+    """the aggregated results of a url within a time bucket"""
+    __slots__ = ('counts', 'http_errors', 'regex_failures', 'latency')
+
+    def __init__(self):
+        self.counts: Dict[ResultStatus, int] = dict.fromkeys(ResultStatus, 0)
+        self.http_errors = 0
+        self.regex_failures = 0
+        self.latency = LatencySketch()
+
+    def add(self, status: str, response_status: Optional[int], response_regex_status: Optional[bool],
+            response_time: Optional[datetime.timedelta]):
+        self.counts[ResultStatus(status)] += 1
+        if response_status is not None and response_status >= 400:
+            self.http_errors += 1
+        if response_regex_status is False:
+            self.regex_failures += 1
+        if response_time is not None:
+            self.latency.add(response_time.total_seconds())
+
+
+def aggregate(results: ResultBatch, seconds: int) -> Dict[Tuple[str, datetime.datetime], RollupRow]:
+    """aggregate results by url and time bucket
+
+    :param results: the results
+    :type results: :class:`awm.common.result.ResultBatch`
+    :param seconds: the bucket size
+    :type seconds: int
+
+    :return: the rollup rows by url and bucket
+    :rtype: dict
+    """
+    rows: Dict[Tuple[str, datetime.datetime], RollupRow] = {}
+    for url, start_time, response_time, response_status, response_regex_status, status in zip(
+            results.column('url'), results.column('start_time'), results.column('response_time'),
+            results.column('response_status'), results.column('response_regex_status'), results.column('status')):
+        key = (url, bucket(start_time, seconds))
+        row = rows.get(key)
+        if row is None:
+            row = rows[key] = RollupRow()
+        row.add(status, response_status, response_regex_status, response_time)
+    return rows
+
+
+def upsert_sql(table: str, rows: Dict[Tuple[str, datetime.datetime], RollupRow],
+               url_ids: Dict[str, int]) -> Tuple[str, List]:
+    """get a single SQL statement adding the rows to the existing rollups
+
+    :param table: the rollup table
+    :type table: str
+    :param rows: the rollup rows by url and bucket (see :func:`aggregate`)
+    :type rows: dict
+    :param url_ids: the ids of the urls in the `urls` table
+    :type url_ids: dict
+
+    :return: a tuple with the sql statement and the needed arguments
+    :rtype: (str, list)
+    """
+    row = '({}, %s::jsonb)'.format(', '.join(['%s'] * (len(COLUMNS) - 1)))
+    updates = ', '.join(f'{c} = {table}.{c} + EXCLUDED.{c}' for c in COLUMNS[2:-1])
+    sql = f"""INSERT INTO {table}({', '.join(COLUMNS)}) VALUES {', '.join([row] * len(rows))}
+    ON CONFLICT (url_id, bucket) DO UPDATE SET {updates},
+    latency = awm_sketch_merge({table}.latency, EXCLUDED.latency);"""
+    sql_args: List = []
+    # a stable order avoids deadlocks between concurrent upserts
+    for (url, start), r in sorted(rows.items(), key=lambda item: (url_ids[item[0][0]], item[0][1])):
+        sql_args.extend([url_ids[url], start])
+        sql_args.extend(r.counts[s] for s in STATUS_COLUMNS)
+        sql_args.extend([r.http_errors, r.regex_failures, json.dumps(r.latency.to_json())])
+    return (sql, sql_args)
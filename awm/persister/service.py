@@ -0,0 +1,144 @@
+# Copyright (c) 2020 Thomas Bechtold <thomasbechtold@jpberlin.de>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""
+Persist the results from a kafka topic in the database
+
+The service behind `awm-persister` (see :func:`awm.persister.main`).
+"""
+
+import asyncio
+import logging
+from typing import Callable, Optional
+
+from ..common import kafka_utils
+from ..common import metrics
+from ..common import result
+from ..common.config import PERSISTER_MODES
+from ..common.exception import AwmConfigError
+from .changes import ChangeFilter
+from .store import ResultStore
+
+logger = logging.getLogger(__name__)
+
+#: the interval in seconds for creating upcoming partitions and dropping expired ones
+MAINTENANCE_INTERVAL = 3600
+#: the default number of days the rollups are kept
+DEFAULT_ROLLUP_RETENTION_DAYS = {
+    'crawler_rollup_minute': 7,
+    'crawler_rollup_hour': 400,
+}
+#: the default interval in seconds a result is written in the `changes` mode without a state change
+DEFAULT_HEARTBEAT_INTERVAL = 300
+
+
+def _decode(msgs) -> result.ResultBatch:
+    """decode kafka messages to results. Invalid messages are logged and skipped"""
+    results = result.ResultBatch()
+    for msg in msgs:
+        logger.debug(f'consumed kafka msg: {msg.topic}, partition: {msg.partition}, '
+                     f'offset: {msg.offset}, key: {msg.key}, val: {msg.value}')
+        try:
+            results.append(result.Result.decode(msg.value, kafka_utils.content_type(msg)))
+        except Exception as e:
+            logger.exception(f'unable to decode kafka msg {msg.topic}/{msg.partition}/{msg.offset}: {e}')
+    return results
+
+
+async def _maintain(pool, store: ResultStore, interval: float):
+    """regularly create upcoming partitions and drop expired ones"""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            async with pool.acquire() as conn:
+                async with conn.cursor() as cur:
+                    await store.maintain(cur)
+        except Exception as e:
+            logger.exception(e)
+
+
+def _change_filter(persister_conf) -> Optional[ChangeFilter]:
+    """get the change filter for the configured persister mode"""
+    mode = persister_conf.get('mode', 'all')
+    if mode not in PERSISTER_MODES:
+        raise AwmConfigError(f'unknown persister mode {mode}. Use one of {", ".join(PERSISTER_MODES)}')
+    if mode == 'all':
+        return None
+    return ChangeFilter(persister_conf.get('heartbeat_interval', DEFAULT_HEARTBEAT_INTERVAL))
+
+
+async def _consume(conf, consumer_factory: Callable = kafka_utils.kafka_consumer,
+                   pool_factory: Optional[Callable] = None):
+    """consume the results and write them to the database until cancelled
+
+    :param consumer_factory: the async context manager factory of the kafka consumer
+                             (see :func:`awm.common.kafka_utils.kafka_consumer`)
+    :type consumer_factory: callable
+    :param pool_factory: the factory of the database connection pool. Default is :func:`aiopg.create_pool`
+    :type pool_factory: callable or None
+    """
+    # aiopg and aiokafka are imported when needed, so the command line help starts fast
+    from aiokafka import TopicPartition
+    from . import pipeline
+    if pool_factory is None:
+        import aiopg
+        pool_factory = aiopg.create_pool
+
+    persister_conf = conf['persister']
+    change_filter = _change_filter(persister_conf)
+    async with metrics.http_server(persister_conf.get('metrics')), \
+            pool_factory(persister_conf['postgres']['uri'],
+                         maxsize=persister_conf['postgres'].get('pool_size', 10)) as pool:
+        store = ResultStore(persister_conf.get('retention_days'),
+                            persister_conf.get('rollup_retention_days', DEFAULT_ROLLUP_RETENTION_DAYS),
+                            change_filter)
+        # prepare database first
+        async with pool.acquire() as conn:
+            async with conn.cursor() as cur:
+                await store.setup(cur)
+        maintenance = asyncio.create_task(_maintain(pool, store, MAINTENANCE_INTERVAL))
+
+        async def write(msgs):
+            results = _decode(msgs)
+            if results:
+                async with pool.acquire() as conn:
+                    async with conn.cursor() as cur:
+                        # the batch of a pipeline is from a single partition
+                        await store.write(cur, results, TopicPartition(msgs[0].topic, msgs[0].partition))
+                logger.info(f'persisted {len(results)} results')
+
+        async def revoked(tp):
+            async with pool.acquire() as conn:
+                async with conn.cursor() as cur:
+                    await store.flush(cur, tp)
+
+        # offsets are committed manually per partition after a batch is stored in the database
+        async with consumer_factory(
+                conf['kafka']['servers'], [], 'awm-group-1', conf['kafka']['ssl'],
+                enable_auto_commit=False) as consumer:
+            pipelines = pipeline.PartitionPipelines(
+                consumer, write, persister_conf.get('batch_size', 500), persister_conf.get('batch_timeout', 1.0),
+                persister_conf.get('max_in_flight', 2000), revoked if change_filter is not None else None)
+            consumer.subscribe([conf['kafka']['topic_name']], listener=pipelines)
+            metrics.REGISTRY.gauge(
+                'awm_persister_queue_depth', 'Number of consumed messages waiting for their batch').set_function(
+                    lambda: pipelines.queue_depth)
+            try:
+                while True:
+                    pipelines.dispatch(await consumer.getmany(timeout_ms=1000))
+            finally:
+                await pipelines.stop()
+                maintenance.cancel()
@@ -0,0 +1,282 @@
+# Copyright (c) 2020 Thomas Bechtold <thomasbechtold@jpberlin.de>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""
+Manage the database schema and write results
+
+Results are stored in the `crawler_results` table which is range
+partitioned by day on `start_time`. The urls are normalised into the
+`urls` table and referenced by `url_id`. The `crawler_results_view`
+view joins both tables.
+
+With a :class:`awm.persister.changes.ChangeFilter`, only state changes
+and heartbeats are written to `crawler_results` while the rollups are
+still updated with every result.
+"""
+
+import asyncio
+import datetime
+import logging
+from typing import Dict, Hashable, Iterable, Optional, Set
+
+from ..common import metrics
+from ..common import result
+from . import rollup
+from .changes import ChangeFilter
+
+
+logger = logging.getLogger(__name__)
+
+PARTITION_PREFIX = 'crawler_results_'
+
+_results_total = metrics.REGISTRY.counter(
+    'awm_persister_results_total', 'Number of persisted results (including the rollups)')
+_rows_total = metrics.REGISTRY.counter(
+    'awm_persister_rows_total', 'Number of rows written to crawler_results')
+
+
+def _day(dt: datetime.datetime) -> datetime.date:
+    """the UTC day of a datetime. Naive datetimes are UTC"""
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(datetime.timezone.utc)
+    return dt.date()
+
+
+def partition_name(day: datetime.date) -> str:
+    """get the name of the `crawler_results` partition for the given day
+
+    :param day: the day
+    :type day: date
+
+    :return: the partition table name
+    :rtype: str
+    """
+    return f'{PARTITION_PREFIX}{day:%Y%m%d}'
+
+
+def partition_day(name: str) -> Optional[datetime.date]:
+    """get the day of a `crawler_results` partition. None if the name is not a partition name
+
+    :param name: the partition table name
+    :type name: str
+
+    :return: the day
+    :rtype: date or None
+    """
+    if not name.startswith(PARTITION_PREFIX):
+        return None
+    try:
+        return datetime.datetime.strptime(name[len(PARTITION_PREFIX):], '%Y%m%d').date()
+    except ValueError:
+        return None
+
+
+class ResultStore:
+    """
+    Write results into the partitioned `crawler_results` table
+
+    :param retention_days: drop partitions older than the given number of days. None to keep all
+    :type retention_days: int or None
+    :param rollup_retention_days: the number of days rollups are kept by rollup table. None to keep all
+    :type rollup_retention_days: dict or None
+    :param change_filter: only write state changes and heartbeats to `crawler_results`. None to write all results
+    :type change_filter: :class:`awm.persister.changes.ChangeFilter` or None
+    """
+    def __init__(self, retention_days: Optional[int] = None, rollup_retention_days: Optional[Dict] = None,
+                 change_filter: Optional[ChangeFilter] = None):
+        self._retention_days = retention_days
+        self._change_filter = change_filter
+        self._rollup_retention_days = rollup_retention_days or {}
+        self._url_ids: Dict[str, int] = {}
+        self._partitions: Set[datetime.date] = set()
+        self._lock = asyncio.Lock()
+
+    async def setup(self, cur):
+        """create the database types, tables and indexes if they do not already exist"""
+        sql = f"""
+        DO $$ BEGIN
+        CREATE TYPE result_status AS ENUM (
+        '{result.ResultStatus.SUCCESSFUL}',
+        '{result.ResultStatus.TIMEOUT}',
+        '{result.ResultStatus.CLIENT_ERROR}',
+        '{result.ResultStatus.UNKNOWN_ERROR}');
+        EXCEPTION
+        WHEN duplicate_object THEN null;
+        END $$;
+        """
+        await cur.execute(sql)
+
+        # the unpartitioned table of older versions is kept but not used anymore
+        sql = """
+        DO $$ BEGIN
+        IF EXISTS (SELECT 1 FROM pg_class WHERE relname = 'crawler_results' AND relkind = 'r') THEN
+        ALTER TABLE crawler_results RENAME TO crawler_results_legacy;
+        END IF;
+        END $$;
+        """
+        await cur.execute(sql)
+
+        sql = """CREATE TABLE IF NOT EXISTS urls (
+        id SERIAL PRIMARY KEY,
+        url TEXT NOT NULL UNIQUE
+        );"""
+        await cur.execute(sql)
+
+        sql = """CREATE TABLE IF NOT EXISTS crawler_results (
+        url_id INTEGER NOT NULL REFERENCES urls(id),
+        start_time timestamptz NOT NULL,
+        end_time timestamptz,
+        response_time interval,
+        response_status SMALLINT,
+        response_regex_status BOOLEAN,
+        status result_status NOT NULL,
+        status_message text,
+        response_body_truncated BOOLEAN,
+        repeats INTEGER,
+        scheduled_time timestamptz,
+        dns_time interval,
+        connect_time interval,
+        ttfb interval,
+        body_time interval
+        ) PARTITION BY RANGE (start_time);"""
+        await cur.execute(sql)
+
+        # columns added after the first release of the partitioned table. Partitions inherit them
+        await cur.execute('ALTER TABLE crawler_results ADD COLUMN IF NOT EXISTS repeats INTEGER;')
+        await cur.execute('ALTER TABLE crawler_results ADD COLUMN IF NOT EXISTS scheduled_time timestamptz;')
+        for column in ('dns_time', 'connect_time', 'ttfb', 'body_time'):
+            await cur.execute(f'ALTER TABLE crawler_results ADD COLUMN IF NOT EXISTS {column} interval;')
+
+        sql = """CREATE INDEX IF NOT EXISTS crawler_results_url_id_start_time_idx
+        ON crawler_results (url_id, start_time);"""
+        await cur.execute(sql)
+
+        sql = """CREATE OR REPLACE VIEW crawler_results_view AS
+        SELECT urls.url, crawler_results.* FROM crawler_results JOIN urls ON urls.id = crawler_results.url_id;"""
+        await cur.execute(sql)
+
+        await cur.execute(rollup.MERGE_FUNCTION_SQL)
+        for table in rollup.TABLES:
+            await cur.execute(rollup.create_table_sql(table))
+        await self.maintain(cur)
+        logger.info('database table setup done')
+
+    async def _ensure_partitions(self, cur, days: Iterable[datetime.date]):
+        missing = set(days) - self._partitions
+        if not missing:
+            return
+        async with self._lock:
+            for day in sorted(missing - self._partitions):
+                # other persisters might create the same partition at the same time
+                sql = f"""
+                DO $$ BEGIN
+                CREATE TABLE IF NOT EXISTS {partition_name(day)} PARTITION OF crawler_results
+                FOR VALUES FROM ('{day.isoformat()} 00:00:00+00') TO ('{day + datetime.timedelta(days=1)} 00:00:00+00');
+                EXCEPTION
+                WHEN duplicate_table OR unique_violation THEN null;
+                END $$;
+                """
+                await cur.execute(sql)
+                self._partitions.add(day)
+                logger.info(f'partition {partition_name(day)} ready')
+
+    async def _ensure_url_ids(self, cur, urls: Iterable[str]):
+        missing = list(set(urls) - self._url_ids.keys())
+        if not missing:
+            return
+        await cur.execute('INSERT INTO urls(url) SELECT unnest(%s::text[]) ON CONFLICT (url) DO NOTHING;', (missing,))
+        await cur.execute('SELECT id, url FROM urls WHERE url = ANY(%s);', (missing,))
+        for url_id, url in await cur.fetchall():
+            self._url_ids[url] = url_id
+
+    async def write(self, cur, results: result.ResultBatch, partition: Hashable = None):
+        """write the results with a single multi-row INSERT and update the rollups
+
+        The results and the rollups are written in a single transaction
+
+        :param cur: the database cursor
+        :param results: the results
+        :type results: :class:`awm.common.result.ResultBatch`
+        :param partition: the kafka partition of the results
+        """
+        await self._ensure_partitions(cur, {_day(dt) for dt in results.column('start_time')})
+        await self._ensure_url_ids(cur, results.column('url'))
+        rollups = {table: rollup.aggregate(results, seconds) for table, seconds in rollup.TABLES.items()}
+        changed, states = results, None
+        change_filter = self._change_filter
+        if change_filter is not None:
+            changed, states = change_filter.filter(results, partition)
+        async with cur.begin():
+            if changed:
+                sql, sql_args = changed.sql(self._url_ids)
+                await cur.execute(sql, sql_args)
+            for table, rows in rollups.items():
+                sql, sql_args = rollup.upsert_sql(table, rows, self._url_ids)
+                await cur.execute(sql, sql_args)
+        # only remember the states after the transaction succeeded, so a retried batch is written again
+        if change_filter is not None and states is not None:
+            change_filter.update(states, partition)
+        _results_total.inc(len(results))
+        _rows_total.inc(len(changed))
+
+    async def flush(self, cur, partition: Hashable = None):
+        """write the skipped results of a partition which are not counted by a written row yet
+        and forget the url states of the partition
+
+        Called when the partition is revoked, so the persister taking it over
+        starts without losing the `repeats` of its urls.
+        The rollups already contain the skipped results.
+
+        :param cur: the database cursor
+        :param partition: the kafka partition
+        """
+        change_filter = self._change_filter
+        if change_filter is None:
+            return
+        try:
+            pending = change_filter.pending(partition)
+            if pending:
+                await self._ensure_partitions(cur, {_day(dt) for dt in pending.column('start_time')})
+                await self._ensure_url_ids(cur, pending.column('url'))
+                sql, sql_args = pending.sql(self._url_ids)
+                await cur.execute(sql, sql_args)
+                _rows_total.inc(len(pending))
+        finally:
+            change_filter.forget(partition)
+
+    async def maintain(self, cur):
+        """create the partitions for today and tomorrow and drop the expired partitions and rollups
+
+        Should be called regularly (at least daily)
+        """
+        today = datetime.datetime.now(datetime.timezone.utc).date()
+        await self._ensure_partitions(cur, [today, today + datetime.timedelta(days=1)])
+        for table, days in self._rollup_retention_days.items():
+            if table in rollup.TABLES and days is not None:
+                await cur.execute(f"DELETE FROM {table} WHERE bucket < now() - interval '{int(days)} days';")
+        if self._retention_days is None:
+            return
+        await cur.execute("""SELECT child.relname FROM pg_inherits
+        JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+        JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+        WHERE parent.relname = 'crawler_results';""")
+        oldest = today - datetime.timedelta(days=self._retention_days)
+        for name, in await cur.fetchall():
+            day = partition_day(name)
+            if day is not None and day < oldest:
+                await cur.execute(f'DROP TABLE IF EXISTS {name};')
+                self._partitions.discard(day)
+                logger.info(f'dropped expired partition {name}')
@@ -0,0 +1,83 @@
+#!/usr/bin/python3
+# Copyright (c) 2020 Thomas Bechtold <thomasbechtold@jpberlin.de>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""
+Report uptime and response time percentiles from the rollup tables
+
+Only the command line is defined here. The queries (see
+:mod:`awm.query.report`) and their dependencies are imported after the
+arguments are parsed, so `--help` starts fast.
+"""
+
+import argparse
+import datetime
+import os
+import re
+
+_DURATION_UNITS = {'m': 'minutes', 'h': 'hours', 'd': 'days'}
+
+
+def _duration(value: str) -> datetime.timedelta:
+    """parse a duration like `30m`, `12h` or `7d`"""
+    match = re.fullmatch(r'(\d+)([mhd])', value)
+    if not match:
+        raise argparse.ArgumentTypeError(f'invalid duration {value}. Use e.g. 30m, 12h or 7d')
+    return datetime.timedelta(**{_DURATION_UNITS[match.group(2)]: int(match.group(1))})
+
+
+def _parser():
+    parser = argparse.ArgumentParser(
+        description='Report uptime and response times from the persisted rollups')
+    parser.add_argument('-d', '--debug', help="set loglevel to DEBUG",
+                        action="store_const", dest="loglevel", const='DEBUG',
+                        default='WARNING')
+    parser.add_argument('-v', '--verbose', help="set loglevel to INFO",
+                        action="store_const", dest="loglevel", const='INFO')
+    parser.add_argument('-c', '--config', help="path to the config file. Default: %(default)s",
+                        default=os.path.expanduser('~/.config/awm/config.json'))
+    parser.add_argument('-s', '--since', help="report the given time range (e.g. 30m, 12h, 7d). "
+                        "Default: %(default)s", type=_duration, default='24h')
+    parser.add_argument('-r', '--resolution', help="the rollup resolution. Default: hour if the time range "
+                        "is longer than 6 hours, otherwise minute", choices=['minute', 'hour'])
+    parser.add_argument('urls', nargs='*', help="the urls to report. Default: all urls")
+    return parser
+
+
+def main():
+    """main entry point for the query tool.
+    This is used by the executable `awm-query`
+    """
+    parser = _parser()
+    args = parser.parse_args()
+    import asyncio
+    import logging
+    from ..common import config
+    from ..common.exception import AwmConfigError
+    from . import report
+    logging.basicConfig(level=args.loglevel)
+    try:
+        conf = config.get_config(args.config)
+    except AwmConfigError as e:
+        parser.exit(1, f'invalid config {args.config}: {e}\n')
+    resolution = args.resolution or ('hour' if args.since > datetime.timedelta(hours=6) else 'minute')
+    for url_report in asyncio.run(report._query(conf, args.urls, args.since, f'crawler_rollup_{resolution}')):
+        print(url_report)
+
+
+# for debugging
+if __name__ == "__main__":
+    main()
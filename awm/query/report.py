@@ -0,0 +1,88 @@
+# Copyright (c) 2020 Thomas Bechtold <thomasbechtold@jpberlin.de>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""
+Merge the rollups of the urls into reports
+
+The queries behind `awm-query` (see :func:`awm.query.main`).
+"""
+
+import datetime
+import json
+from typing import Dict, List, Optional
+
+from ..common.result import ResultStatus
+from ..common.sketch import LatencySketch
+from ..persister import rollup
+
+
+class Report:
+    """the merged rollups of a url"""
+    def __init__(self, url: str):
+        self.url = url
+        self.counts: Dict[ResultStatus, int] = dict.fromkeys(ResultStatus, 0)
+        self.http_errors = 0
+        self.regex_failures = 0
+        self.latency = LatencySketch()
+
+    @property
+    def checks(self) -> int:
+        return sum(self.counts.values())
+
+    @property
+    def uptime(self) -> Optional[float]:
+        """the share of checks with a successful, non error response"""
+        if not self.checks:
+            return None
+        return (self.counts[ResultStatus.SUCCESSFUL] - self.http_errors) / self.checks
+
+    def __str__(self):
+        def ms(q):
+            value = self.latency.quantile(q)
+            return '-' if value is None else f'{value * 1000:.0f}ms'
+        uptime = '-' if self.uptime is None else f'{self.uptime * 100:.3f}%'
+        return (f'{self.url} checks: {self.checks} uptime: {uptime} regex failures: {self.regex_failures} '
+                f'p50: {ms(0.5)} p95: {ms(0.95)} p99: {ms(0.99)}')
+
+
+async def _query(conf, urls: List[str], since: datetime.timedelta, table: str) -> List[Report]:
+    columns = ', '.join(f'{table}.{c}' for c in rollup.COLUMNS[2:])
+    sql = f"""SELECT urls.url, {columns} FROM {table} JOIN urls ON urls.id = {table}.url_id
+    WHERE {table}.bucket >= %s"""
+    sql_args: List = [datetime.datetime.now(datetime.timezone.utc) - since]
+    if urls:
+        sql += ' AND urls.url = ANY(%s)'
+        sql_args.append(urls)
+    # imported when needed, so the command line help starts fast
+    import aiopg
+
+    reports: Dict[str, Report] = {}
+    async with aiopg.connect(conf['persister']['postgres']['uri']) as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(sql + ';', sql_args)
+            for url, *values in await cur.fetchall():
+                report = reports.get(url)
+                if report is None:
+                    report = reports[url] = Report(url)
+                for status, count in zip(rollup.STATUS_COLUMNS, values):
+                    report.counts[status] += count
+                http_errors, regex_failures, latency = values[len(rollup.STATUS_COLUMNS):]
+                report.http_errors += http_errors
+                report.regex_failures += regex_failures
+                if isinstance(latency, str):
+                    latency = json.loads(latency)
+                report.latency.merge(LatencySketch.from_json(latency))
+    return [reports[url] for url in sorted(reports)]
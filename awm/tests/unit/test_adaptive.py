@@ -0,0 +1,96 @@
+# Copyright (c) 2020 Thomas Bechtold <thomasbechtold@jpberlin.de>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import datetime
+
+from awm.common.result import Result, ResultStatus
+from awm.crawler import adaptive
+
+
+URL = 'https://localhost/1'
+start_dt = datetime.datetime(2020, 11, 1, 0, 0, 0)
+end_dt = datetime.datetime(2020, 11, 1, 0, 0, 1)
+OK = Result(URL, start_dt, end_dt, 200, None, ResultStatus.SUCCESSFUL, None)
+TIMEOUT = Result(URL, start_dt, None, None, None, ResultStatus.TIMEOUT, 'timeout')
+
+
+def test_adaptive_intervals_backoff():
+    intervals = adaptive.AdaptiveIntervals(max_interval=35)
+    delays = [intervals.delay(URL, 5, TIMEOUT) for _ in range(6)]
+    # the first failure gets the regular interval, then the interval doubles up to the maximum
+    assert delays == [None, 10, 20, 35, 35, 35]
+    # back to the regular interval after a successful check
+    assert intervals.delay(URL, 5, OK) is None
+    assert intervals.delay(URL, 5, TIMEOUT) is None
+
+
+def test_adaptive_intervals_confirm():
+    intervals = adaptive.AdaptiveIntervals(confirm_interval=1)
+    assert intervals.delay(URL, 5, OK) is None
+    # a state change is confirmed quickly
+    assert intervals.delay(URL, 5, TIMEOUT) == 1
+    assert intervals.delay(URL, 5, TIMEOUT) is None
+    # a confirmation check doesn't trigger another one
+    assert intervals.delay(URL, 5, OK) == 1
+    assert intervals.delay(URL, 5, TIMEOUT) is None
+    assert intervals.delay(URL, 5, OK) == 1
+    assert len(intervals) == 1
+    intervals.forget(URL)
+    assert len(intervals) == 0
+
+
+def test_circuit_breaker(monkeypatch):
+    now = 1000.0
+    monkeypatch.setattr(adaptive.time, 'monotonic', lambda: now)
+    breaker = adaptive.CircuitBreaker(failures=3, reset_timeout=60)
+    other = 'https://localhost/2'
+    for _ in range(2):
+        assert breaker.allow(URL)
+        breaker.record(URL, TIMEOUT)
+    assert breaker.open == 0
+    # failures of all urls of a host count
+    breaker.record(other, TIMEOUT)
+    assert breaker.open == 1
+    assert not breaker.allow(URL)
+    assert not breaker.allow(other)
+    assert breaker.allow('https://example.com')
+    # a single check is let through after the reset timeout
+    now += 60
+    assert breaker.allow(URL)
+    assert not breaker.allow(other)
+    breaker.record(URL, TIMEOUT)
+    assert not breaker.allow(other)
+    now += 60
+    assert breaker.allow(other)
+    breaker.record(other, OK)
+    assert breaker.open == 0
+    assert breaker.allow(URL)
+
+
+def test_circuit_breaker_lost_probe(monkeypatch):
+    now = 1000.0
+    monkeypatch.setattr(adaptive.time, 'monotonic', lambda: now)
+    breaker = adaptive.CircuitBreaker(failures=1, reset_timeout=60)
+    breaker.record(URL, TIMEOUT)
+    now += 60
+    # the result of the probe is never recorded (e.g. the check was cancelled)
+    assert breaker.allow(URL)
+    now += 30
+    assert not breaker.allow(URL)
+    now += 30
+    assert breaker.allow(URL)
+    breaker.record(URL, OK)
+    assert breaker.open == 0
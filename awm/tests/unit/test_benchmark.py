@@ -0,0 +1,80 @@
+# Copyright (c) 2020 Thomas Bechtold <thomasbechtold@jpberlin.de>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import json
+import pytest
+
+from awm import benchmark
+
+
+@pytest.mark.asyncio
+async def test_crawler_benchmark():
+    results = await benchmark.crawler_benchmark(urls=20, interval=0.2, duration=0.5, latency=0.0,
+                                                body_size=100, error_rate=0.5, regex='x+')
+    assert results['checks'] > 20
+    assert results['statuses']['SUCCESSFUL'] == results['checks']
+    assert 0 < results['http_errors'] < results['checks']
+    assert results['memory_per_url_bytes'] > 0
+
+
+@pytest.mark.parametrize('mode,format', [('all', 'json'), ('changes', 'binary')])
+@pytest.mark.asyncio
+async def test_persister_benchmark(mode, format):
+    results = await benchmark.persister_benchmark(messages=1000, urls=10, partitions=2, batch_size=100,
+                                                  wire_format=format, mode=mode)
+    if mode == 'all':
+        assert results['rows'] == 1000
+    else:
+        # at most the first result, the failures and the recoveries of every url
+        # and the last skipped result written on stop
+        assert 10 < results['rows'] <= 10 + 2 * 1000 // 50 + 10
+    assert results['transactions'] >= 10
+
+
+def test_parser():
+    args = benchmark._parser().parse_args(['-o', 'report.json', 'persister', '--messages', '10'])
+    assert args.benchmark == 'persister'
+    assert args.messages == 10
+    assert benchmark.report('persister', {'messages': 10}, {})['parameters'] == {'messages': 10}
+
+
+@pytest.mark.parametrize('module', ['awm.crawler', 'awm.crawler.service', 'awm.persister', 'awm.persister.service',
+                                    'awm.query', 'awm.query.report'])
+def test_heavy_modules_are_imported_lazily(module):
+    assert benchmark.heavy_modules(module) == []
+
+
+@pytest.mark.parametrize('module,service', [('awm.crawler', 'awm.crawler.service'),
+                                            ('awm.persister', 'awm.persister.service'),
+                                            ('awm.query', 'awm.query.report')])
+def test_command_line_imports_no_service(module, service):
+    # --help only needs argparse
+    loaded = f'(m for m in ("asyncio", "logging", "{service}") if m in sys.modules)'
+    out = benchmark._python(['-c', f'import sys, {module}; print(sorted{loaded})'])
+    assert out.stdout.decode().strip() == '[]'
+
+
+@pytest.mark.parametrize('module', ['awm.crawler', 'awm.persister'])
+def test_check_config_imports_no_service(tmp_path, module):
+    path = tmp_path / 'config.json'
+    path.write_text(json.dumps({'kafka': {'servers': 'localhost:9092', 'topic_name': 'awm', 'ssl': {}},
+                                'crawler': {'interval': 5, 'urls': {'https://localhost': {'regex': 'ok'}}},
+                                'persister': {'postgres': {'uri': 'postgres://localhost/awm'}}}))
+    out = benchmark._python(['-c', f'import sys, {module}; sys.argv = ["awm", "-t", "-c", "{path}"]\n'
+                                   f'try:\n    {module}.main()\nexcept SystemExit as e:\n'
+                                   f'    print(e.code, sorted(m for m in ("asyncio", "{module}.service") '
+                                   f'if m in sys.modules))'])
+    assert out.stdout.decode().strip() == "0 []"
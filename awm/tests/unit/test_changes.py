@@ -0,0 +1,79 @@
+# Copyright (c) 2020 Thomas Bechtold <thomasbechtold@jpberlin.de>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import datetime
+
+from awm.common import result
+from awm.persister import changes
+
+
+def _result(url, seconds, response_status=200):
+    start = datetime.datetime(2020, 11, 1, tzinfo=datetime.timezone.utc) + datetime.timedelta(seconds=seconds)
+    return result.Result(url, start, start + datetime.timedelta(seconds=0.1), response_status, None,
+                         result.ResultStatus.SUCCESSFUL, None)
+
+
+def _written(batch):
+    return [(url, start.second + start.minute * 60, repeats) for url, start, repeats in
+            zip(batch.column('url'), batch.column('start_time'), batch.column('repeats'))]
+
+
+def test_change_filter():
+    f = changes.ChangeFilter(heartbeat=120)
+    batch = result.ResultBatch([
+        _result('http://a', 0), _result('http://b', 0),
+        _result('http://a', 30), _result('http://a', 60, 500),
+        _result('http://a', 90, 500), _result('http://a', 120, 500), _result('http://a', 180, 500),
+    ])
+    changed, states = f.filter(batch)
+    # the first result of every url, the state change and the heartbeat
+    assert _written(changed) == [('http://a', 0, 0), ('http://b', 0, 0), ('http://a', 60, 1), ('http://a', 180, 2)]
+    assert len(f) == 0
+    f.update(states)
+    assert len(f) == 2
+
+    changed, states = f.filter(result.ResultBatch([_result('http://a', 200, 500), _result('http://b', 200, 500)]))
+    assert _written(changed) == [('http://b', 200, 0)]
+
+
+def test_change_filter_retry():
+    f = changes.ChangeFilter(heartbeat=120)
+    batch = result.ResultBatch([_result('http://a', 0)])
+    # without an update, e.g. after a failed write, the results are written again
+    assert len(f.filter(batch)[0]) == 1
+    assert len(f.filter(batch)[0]) == 1
+    f.update(f.filter(batch)[1])
+    assert len(f.filter(batch)[0]) == 0
+
+
+def test_change_filter_revoke_reassign():
+    f = changes.ChangeFilter(heartbeat=120)
+    changed, states = f.filter(result.ResultBatch([_result('http://a', 0), _result('http://b', 0)]), 0)
+    f.update(states, 0)
+    changed, states = f.filter(result.ResultBatch([_result('http://a', 30), _result('http://a', 60),
+                                                   _result('http://b', 30, 500)]), 0)
+    f.update(states, 0)
+    # other partitions have their own states
+    assert len(f.filter(result.ResultBatch([_result('http://c', 0)]), 1)[0]) == 1
+    assert len(f.pending(1)) == 0
+    # the last skipped result of a, counting the one skipped before it
+    assert _written(f.pending(0)) == [('http://a', 60, 1)]
+    f.forget(0)
+    assert len(f) == 0
+    assert len(f.pending(0)) == 0
+    # after the partition is assigned again, the next result is written
+    changed, _ = f.filter(result.ResultBatch([_result('http://a', 90)]), 0)
+    assert _written(changed) == [('http://a', 90, 0)]
@@ -0,0 +1,167 @@
+# Copyright (c) 2020 Thomas Bechtold <thomasbechtold@jpberlin.de>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import asyncio
+import pytest
+from aiokafka.structs import TopicPartition
+
+from awm.crawler import coordination
+from awm.crawler import scheduler
+from awm.crawler import urls
+
+
+TOPIC = 'awm-crawler-coordination'
+
+
+class FakeGroup:
+    """a local stand-in for a kafka broker running the consumer group protocol
+
+    Partitions are assigned round robin to the members. Like the kafka
+    eager rebalance protocol, all partitions are revoked from all members
+    before the new assignment is handed out.
+    """
+    def __init__(self, partitions):
+        self._partitions = partitions
+        self._members = []
+
+    def partitions_for_topic(self, topic):
+        return set(range(self._partitions)) if topic == TOPIC else None
+
+    async def _rebalance(self):
+        for member in self._members:
+            await member.listener.on_partitions_revoked(member.assigned)
+        for i, member in enumerate(self._members):
+            member.assigned = {TopicPartition(TOPIC, p) for p in range(i, self._partitions, len(self._members))}
+            await member.listener.on_partitions_assigned(member.assigned)
+
+    async def join(self, member):
+        self._members.append(member)
+        await self._rebalance()
+
+    async def leave(self, member):
+        self._members.remove(member)
+        await member.listener.on_partitions_revoked(member.assigned)
+        await self._rebalance()
+
+    async def add_partitions(self, partitions):
+        self._partitions += partitions
+        await self._rebalance()
+
+
+class Node:
+    """a crawler node with its own scheduler"""
+    def __init__(self, group, url_confs):
+        async def check(url):
+            pass
+        self.sched = scheduler.Scheduler(check, 1)
+        self.forgotten = []
+        self.listener = coordination.UrlAssignment(group, TOPIC, url_confs, self.sched, self.forgotten.append)
+        self.assigned = set()
+
+    def urls(self, url_confs):
+        return {url for url in url_confs if url in self.sched}
+
+
+@pytest.mark.asyncio
+async def test_url_assignment():
+    url_confs = {f'https://localhost/{i}': urls.UrlConfig(f'https://localhost/{i}', 5.0) for i in range(100)}
+    group = FakeGroup(8)
+    nodes = [Node(group, url_confs) for _ in range(3)]
+
+    await group.join(nodes[0])
+    assert nodes[0].urls(url_confs) == set(url_confs)
+
+    await group.join(nodes[1])
+    await group.join(nodes[2])
+    assigned = [n.urls(url_confs) for n in nodes]
+    # every url is checked by exactly one node
+    assert sum(len(a) for a in assigned) == len(url_confs)
+    assert set.union(*assigned) == set(url_confs)
+    assert all(assigned)
+
+    # the urls of a leaving node move to the remaining nodes
+    await group.leave(nodes[1])
+    assert nodes[1].urls(url_confs) == set()
+    assigned = [nodes[0].urls(url_confs), nodes[2].urls(url_confs)]
+    assert sum(len(a) for a in assigned) == len(url_confs)
+    assert set.union(*assigned) == set(url_confs)
+
+
+@pytest.mark.asyncio
+async def test_url_assignment_keeps_phase():
+    url = 'https://localhost'
+    url_confs = {url: urls.UrlConfig(url, 60.0)}
+    group = FakeGroup(1)
+    nodes = [Node(group, url_confs) for _ in range(2)]
+    await group.join(nodes[0])
+    due_before = nodes[0].sched._heap[-1][0]
+    await asyncio.sleep(0.01)
+    await group.join(nodes[1])
+    owner = nodes[0] if url in nodes[0].sched else nodes[1]
+    # the next run does not depend on the node or the time the url was assigned
+    assert owner.sched._heap[-1][0] == pytest.approx(due_before, abs=0.001)
+
+
+@pytest.mark.asyncio
+async def test_url_assignment_reload():
+    url_confs = {f'https://localhost/{i}': urls.UrlConfig(f'https://localhost/{i}', 5.0) for i in range(20)}
+    group = FakeGroup(4)
+    nodes = [Node(group, url_confs) for _ in range(2)]
+    await group.join(nodes[0])
+    await group.join(nodes[1])
+    # a reload adds urls to the shared url configuration
+    added = {f'https://localhost/new/{i}': urls.UrlConfig(f'https://localhost/new/{i}', 5.0) for i in range(20)}
+    url_confs.update(added)
+    for url in added:
+        owners = [n for n in nodes if n.listener.owns(url)]
+        assert len(owners) == 1
+        owners[0].sched.add(url, 5.0)
+    # added urls move with their partition
+    await group.leave(nodes[1])
+    assert nodes[0].urls(url_confs) == set(url_confs)
+
+
+@pytest.mark.asyncio
+async def test_url_assignment_forget():
+    url_confs = {f'https://localhost/{i}': urls.UrlConfig(f'https://localhost/{i}', 5.0) for i in range(20)}
+    group = FakeGroup(4)
+    nodes = [Node(group, url_confs) for _ in range(2)]
+    await group.join(nodes[0])
+    await group.join(nodes[1])
+    checked = nodes[1].urls(url_confs)
+    nodes[1].forgotten.clear()
+    await group.leave(nodes[1])
+    # the state of the urls which moved to the other node is dropped
+    assert set(nodes[1].forgotten) == checked
+
+
+@pytest.mark.asyncio
+async def test_url_assignment_added_partitions():
+    url_confs = {f'https://localhost/{i}': urls.UrlConfig(f'https://localhost/{i}', 5.0) for i in range(100)}
+    group = FakeGroup(2)
+    nodes = [Node(group, url_confs) for _ in range(4)]
+    for node in nodes:
+        await group.join(node)
+    # more nodes than partitions
+    assert [bool(n.urls(url_confs)) for n in nodes] == [True, True, False, False]
+    await group.add_partitions(6)
+    assigned = [n.urls(url_confs) for n in nodes]
+    # the urls are sharded over all partitions and every url is checked by exactly one node
+    assert all(assigned)
+    assert sum(len(a) for a in assigned) == len(url_confs)
+    assert set.union(*assigned) == set(url_confs)
+    for url in url_confs:
+        assert [n.listener.owns(url) for n in nodes].count(True) == 1
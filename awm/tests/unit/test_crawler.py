@@ -15,12 +15,21 @@
 
 
 import asyncio
+import sys
 import aiohttp
 import pytest
 from aioresponses import aioresponses
 
 from awm import crawler
+from awm.benchmark.server import TargetServer
+from awm.common import config
+from awm.common import metrics
 from awm.common import result
+from awm.common.exception import AwmConfigError
+from awm.crawler import adaptive
+from awm.crawler import fetcher
+from awm.crawler import service
+from awm.crawler import urls
 
 
 @pytest.mark.parametrize(
@@ -52,7 +61,7 @@ async def test__fetch_url(mock_response_code, mock_body, mock_raise, expected_re
     with aioresponses() as m:
         m.get(url, **mock_args)
         async with aiohttp.ClientSession() as session:
-            res = await crawler._fetch_url(session, url, None)
+            res = await fetcher.Fetcher(session).fetch(urls.UrlConfig(url, 5.0))
             assert res.status == expected_result_status
             # do some extra checks depending on the CrawlerResultStatus
             if res.status == result.ResultStatus.SUCCESSFUL:
@@ -65,15 +74,179 @@ async def test__fetch_url(mock_response_code, mock_body, mock_raise, expected_re
 
 
 @pytest.mark.parametrize(
-    'regex,text,expected_result',
+    'regex,body,expected_result',
     [
-        (None, '', None),
-        ('', '', None),
+        (None, 'foobar', None),
+        ('', 'foobar', None),
+        ('.*', '', True),
         ('.*', 'foobar', True),
         ('.*foobar.*', 'foobar', True),
         ('.*にち.*', 'こんにちは', True),
         ('test', 'foobar', False),
         ('^foobar.*', 'bar foobar', False),
     ])
-def test__response_regex_status(regex, text, expected_result):
-    assert crawler._response_regex_status(regex, text) == expected_result
+@pytest.mark.asyncio
+async def test__fetch_url_regex(regex, body, expected_result):
+    url = 'https://localhost'
+    with aioresponses() as m:
+        m.get(url, status=200, body=body)
+        async with aiohttp.ClientSession() as session:
+            res = await fetcher.Fetcher(session).fetch(urls.url_configs(
+                {'crawler': {'interval': 5.0, 'urls': {url: {'regex': regex}}}})[url])
+            assert res.response_regex_status == expected_result
+
+
+@pytest.mark.parametrize(
+    'regex,expected_result',
+    [
+        # ^ doesn't match at the start of the second chunk
+        ('^foobar', False),
+        ('^xfoobar', False),
+        ('^x', True),
+        # a match spanning the chunk border
+        ('xfoobar$', True),
+    ])
+@pytest.mark.asyncio
+async def test__fetch_url_regex_chunk_border(regex, expected_result):
+    url = 'https://localhost'
+    with aioresponses() as m:
+        # the body is checked in chunks. 'foobar' starts the second chunk
+        m.get(url, status=200, body='x' * fetcher.REGEX_CHUNK_SIZE + 'foobar')
+        async with aiohttp.ClientSession() as session:
+            res = await fetcher.Fetcher(session).fetch(urls.url_configs(
+                {'crawler': {'interval': 5.0, 'urls': {url: {'regex': regex}}}})[url])
+            assert res.response_regex_status == expected_result
+
+
+@pytest.mark.parametrize(
+    'regex,body,max_body_bytes,expected_regex_status,expected_truncated',
+    [
+        (None, 'foobar', 3, None, None),
+        ('foo', 'foobar', 3, True, False),
+        ('bar', 'foobar', 3, False, True),
+        ('bar', 'foobar', 6, True, False),
+        ('baz', 'foobar', 6, False, False),
+        ('baz', 'foobar', None, False, False),
+    ])
+@pytest.mark.asyncio
+async def test__fetch_url_max_body_bytes(regex, body, max_body_bytes, expected_regex_status, expected_truncated):
+    url = 'https://localhost'
+    with aioresponses() as m:
+        m.get(url, status=200, body=body)
+        async with aiohttp.ClientSession() as session:
+            res = await fetcher.Fetcher(session).fetch(urls.url_configs(
+                {'crawler': {'interval': 5.0, 'urls': {url: {'regex': regex, 'max_body_bytes': max_body_bytes}}}})[url])
+            assert res.response_regex_status == expected_regex_status
+            assert res.response_body_truncated == expected_truncated
+
+
+@pytest.mark.asyncio
+async def test__fetch_url_head():
+    url = 'https://localhost'
+    with aioresponses() as m:
+        m.head(url, status=204)
+        async with aiohttp.ClientSession() as session:
+            res = await fetcher.Fetcher(session).fetch(urls.UrlConfig(url, 5.0, head=True))
+            assert res.status == result.ResultStatus.SUCCESSFUL
+            assert res.response_status == 204
+
+
+@pytest.mark.asyncio
+async def test__connector():
+    connector = service._connector({'crawler': {'concurrency': 20, 'connector': {
+        'limit_per_host': 2, 'keepalive_timeout': 30, 'ttl_dns_cache': 300}}})
+    try:
+        assert connector.limit == 20
+        assert connector.limit_per_host == 2
+        service._connector_metrics(connector)
+        assert metrics.REGISTRY.gauge('awm_crawler_connections_limit', '').get() == 20
+    finally:
+        await connector.close()
+
+
+@pytest.mark.asyncio
+async def test__connector_metrics():
+    created = metrics.REGISTRY.counter('awm_crawler_connections_created_total', '')
+    reused = metrics.REGISTRY.counter('awm_crawler_connections_reused_total', '')
+    queued = metrics.REGISTRY.histogram('awm_crawler_connections_queued_seconds', '')
+    before = created.get(), reused.get(), queued.count()
+    async with TargetServer(latency=0.05) as server:
+        connector = service._connector({'crawler': {'concurrency': 1}})
+        trace_config = service._connector_metrics(connector)
+        async with aiohttp.ClientSession(connector=connector, trace_configs=[trace_config]) as session:
+
+            async def get():
+                async with session.get(server.url(0)) as response:
+                    await response.read()
+            # the second request waits for the connection of the first one
+            await asyncio.gather(get(), get())
+    assert created.get() - before[0] == 1
+    assert reused.get() - before[1] == 1
+    assert queued.count() - before[2] == 1
+
+
+class Sender:
+    def __init__(self):
+        self.sent = []
+
+    async def send(self, value, key=None, headers=None):
+        self.sent.append(value)
+
+
+@pytest.mark.asyncio
+async def test__check_url_circuit_breaker():
+    url = 'https://localhost'
+    sender = Sender()
+    breaker = adaptive.CircuitBreaker(failures=1, reset_timeout=60)
+    with aioresponses() as m:
+        m.get(url, exception=asyncio.TimeoutError())
+        async with aiohttp.ClientSession() as session:
+            url_fetcher = fetcher.Fetcher(session)
+            res = await service._check_url(sender, url_fetcher, urls.UrlConfig(url, 5.0), result.CONTENT_TYPE_JSON,
+                                           breaker=breaker)
+            assert res.status == result.ResultStatus.TIMEOUT
+            # the circuit of the host is open. The check is not sent
+            res = await service._check_url(sender, url_fetcher, urls.UrlConfig(url, 5.0), result.CONTENT_TYPE_JSON,
+                                           breaker=breaker)
+            assert res.status == result.ResultStatus.CLIENT_ERROR
+            assert res.status_message == 'circuit open for localhost'
+    assert len(m.requests) == 1
+    assert len(sender.sent) == 2
+
+
+def test__adaptive():
+    intervals, breaker = service._adaptive({'crawler': {}})
+    assert intervals is None and breaker is None
+    intervals, breaker = service._adaptive({'crawler': {'adaptive': {'max_interval': 60},
+                                                        'circuit_breaker': {}}})
+    assert isinstance(intervals, adaptive.AdaptiveIntervals)
+    assert isinstance(breaker, adaptive.CircuitBreaker)
+
+
+def test__validate():
+    conf = {'kafka': {'servers': 'localhost:9092', 'topic_name': 'awm', 'ssl': {}},
+            'crawler': {'interval': 5.0, 'urls': {'https://localhost': {'regex': 'ok'}}}}
+    config.validate_crawler(conf)
+    conf['crawler']['urls']['https://localhost']['regex'] = '('
+    with pytest.raises(AwmConfigError):
+        config.validate_crawler(conf)
+    del conf['crawler']['interval']
+    with pytest.raises(AwmConfigError):
+        config.validate_crawler(conf)
+    conf['crawler'] = []
+    with pytest.raises(AwmConfigError):
+        config.validate_crawler(conf)
+
+
+@pytest.mark.parametrize('content', [None, '{invalid', '{"kafka": {}}'])
+def test_main_check_config_invalid(tmp_path, monkeypatch, capsys, content):
+    path = tmp_path / 'config.json'
+    if content is not None:
+        path.write_text(content)
+    monkeypatch.setattr(sys, 'argv', ['awm-crawler', '-t', '-c', str(path)])
+    with pytest.raises(SystemExit) as e:
+        crawler.main()
+    assert e.value.code == 1
+    err = capsys.readouterr().err
+    assert err.startswith(f'invalid config {path}: ')
+    assert 'Traceback' not in err
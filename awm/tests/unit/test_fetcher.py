@@ -0,0 +1,128 @@
+# Copyright (c) 2020 Thomas Bechtold <thomasbechtold@jpberlin.de>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import asyncio
+import re
+import aiohttp
+import pytest
+from aioresponses import aioresponses
+from yarl import URL
+
+from awm.benchmark.server import TargetServer
+from awm.common import result
+from awm.crawler import fetcher
+from awm.crawler import urls
+
+
+@pytest.mark.asyncio
+async def test_fetch_coalesced():
+    async with TargetServer(latency=0.05) as server:
+        url = server.url(0)
+        url_confs = [urls.UrlConfig(url, 5.0, re.compile('x')),
+                     urls.UrlConfig(url.replace('http:', 'HTTP:') + '#top', 5.0, re.compile('y')),
+                     urls.UrlConfig(url, 5.0)]
+        async with aiohttp.ClientSession() as session:
+            url_fetcher = fetcher.Fetcher(session)
+            results = await asyncio.gather(*[url_fetcher.fetch(url_conf) for url_conf in url_confs])
+            # a single request is checked against both regexes
+            assert server.requests == 1
+            assert [res.url for res in results] == [url_conf.url for url_conf in url_confs]
+            assert [res.response_regex_status for res in results] == [True, False, None]
+            assert all(res.response_status == 200 for res in results)
+            # a later check sends its own request
+            res = await url_fetcher.fetch(urls.UrlConfig(url, 5.0, re.compile('z')))
+            assert res.response_regex_status is False
+            assert server.requests == 2
+
+
+@pytest.mark.asyncio
+async def test_fetch_not_coalesced():
+    async with TargetServer(latency=0.01) as server:
+        async with aiohttp.ClientSession() as session:
+            url_fetcher = fetcher.Fetcher(session, coalesce=False)
+            await asyncio.gather(*[url_fetcher.fetch(urls.UrlConfig(server.url(0), 5.0)) for _ in range(3)])
+    assert server.requests == 3
+
+
+def _headers(m, url, call):
+    return m.requests[('GET', URL(url))][call].kwargs['headers']
+
+
+@pytest.mark.asyncio
+async def test_fetch_conditional():
+    url = 'https://localhost/page'
+    foo = urls.UrlConfig(url, 5.0, re.compile('foo'))
+    with aioresponses() as m:
+        m.get(url, status=200, body='foo', headers={'ETag': '"v1"', 'Last-Modified': 'Mon, 12 Oct 2020 10:00:00 GMT'})
+        m.get(url, status=304)
+        m.get(url, status=200, body='foo', headers={'ETag': '"v1"'})
+        m.get(url, status=304)
+        async with aiohttp.ClientSession() as session:
+            url_fetcher = fetcher.Fetcher(session)
+            res = await url_fetcher.fetch(foo)
+            assert _headers(m, url, 0) == {}
+            assert len(url_fetcher) == 1
+            # not modified. The status and the regex status of the full response are repeated
+            res = await url_fetcher.fetch(foo)
+            assert _headers(m, url, 1) == {'If-None-Match': '"v1"',
+                                           'If-Modified-Since': 'Mon, 12 Oct 2020 10:00:00 GMT'}
+            assert res.status == result.ResultStatus.SUCCESSFUL
+            assert res.response_status == 200
+            assert res.response_regex_status is True
+            # the body is needed for a new regex
+            res = await url_fetcher.fetch(urls.UrlConfig(url, 5.0, re.compile('bar')))
+            assert _headers(m, url, 2) == {}
+            assert res.response_regex_status is False
+            res = await url_fetcher.fetch(urls.UrlConfig(url, 5.0, re.compile('bar')))
+            assert _headers(m, url, 3) == {'If-None-Match': '"v1"'}
+            assert res.response_regex_status is False
+            url_fetcher.forget(url)
+            assert len(url_fetcher) == 0
+
+
+@pytest.mark.asyncio
+async def test_fetch_conditional_changed():
+    url = 'https://localhost/page'
+    foo = urls.UrlConfig(url, 5.0, re.compile('foo'))
+    with aioresponses() as m:
+        m.get(url, status=200, body='foo', headers={'ETag': '"v1"'})
+        m.get(url, status=200, body='bar', headers={'ETag': '"v2"'})
+        m.get(url, status=500, body='foo')
+        m.get(url, status=200, body='foo')
+        async with aiohttp.ClientSession() as session:
+            url_fetcher = fetcher.Fetcher(session)
+            assert (await url_fetcher.fetch(foo)).response_regex_status is True
+            assert (await url_fetcher.fetch(foo)).response_regex_status is False
+            assert _headers(m, url, 1) == {'If-None-Match': '"v1"'}
+            # errors drop the validators
+            assert (await url_fetcher.fetch(foo)).response_status == 500
+            assert _headers(m, url, 2) == {'If-None-Match': '"v2"'}
+            await url_fetcher.fetch(foo)
+            assert _headers(m, url, 3) == {}
+            assert len(url_fetcher) == 0
+
+
+@pytest.mark.asyncio
+async def test_fetch_conditional_disabled():
+    url = 'https://localhost/page'
+    with aioresponses() as m:
+        m.get(url, status=200, body='foo', headers={'ETag': '"v1"'}, repeat=True)
+        async with aiohttp.ClientSession() as session:
+            url_fetcher = fetcher.Fetcher(session, conditional=False)
+            for _ in range(2):
+                await url_fetcher.fetch(urls.UrlConfig(url, 5.0, re.compile('foo')))
+            assert _headers(m, url, 1) == {}
+            assert len(url_fetcher) == 0
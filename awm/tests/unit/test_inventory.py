@@ -0,0 +1,98 @@
+# Copyright (c) 2020 Thomas Bechtold <thomasbechtold@jpberlin.de>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import io
+import pytest
+from collections import namedtuple
+from unittest import mock
+
+from awm.common.exception import AwmConfigError
+from awm.crawler import inventory
+from awm.crawler import urls
+
+
+Column = namedtuple('Column', ['name'])
+
+
+def test_read_ndjson():
+    f = io.StringIO('{"url": "http://a"}\n'
+                    '\n'
+                    '# a comment\n'
+                    '{"url": "http://b", "interval": 1, "regex": "foo", "head": true}\n')
+    assert list(inventory.read_ndjson(f)) == [
+        ('http://a', {}), ('http://b', {'interval': 1, 'regex': 'foo', 'head': True})]
+
+
+def test_read_csv():
+    f = io.StringIO('url,interval,regex,max_body_bytes,head\n'
+                    'http://a,,,,\n'
+                    'http://b,1.5,"foo, bar",1024,true\n')
+    assert list(inventory.read_csv(f)) == [
+        ('http://a', {}),
+        ('http://b', {'interval': 1.5, 'regex': 'foo, bar', 'max_body_bytes': 1024, 'head': True})]
+
+
+@pytest.mark.parametrize('data', [
+    '{"interval": 1}\n',
+    '{"url": "http://a", "foo": 1}\n',
+    '{"url": "http://a", "interval": "fast"}\n',
+    '["http://a"]\n',
+    '{"url": \n',
+])
+def test_read_ndjson_invalid(data):
+    with pytest.raises(AwmConfigError):
+        list(inventory.read_ndjson(io.StringIO(data)))
+
+
+@pytest.mark.parametrize('suffix,data', [
+    ('.csv', 'url,interval\nhttp://b,1\n'),
+    ('.ndjson', '{"url": "http://b", "interval": 1}\n'),
+])
+def test_url_configs_inventory(tmp_path, suffix, data):
+    path = tmp_path / f'urls{suffix}'
+    path.write_text(data)
+    conf = {'crawler': {'interval': 5.0, 'urls': {'http://a': {}}, 'inventory': {'path': str(path)}}}
+    url_confs = urls.url_configs(conf)
+    assert set(url_confs) == {'http://a', 'http://b'}
+    assert url_confs['http://b'].interval == 1.0
+    assert inventory.path(conf) == str(path)
+
+
+def test_url_configs_inventory_missing(tmp_path):
+    conf = {'crawler': {'interval': 5.0, 'inventory': {'path': str(tmp_path / 'urls.csv')}}}
+    with pytest.raises(AwmConfigError):
+        urls.url_configs(conf)
+
+
+def test_read_table():
+    cursor = mock.MagicMock()
+    cursor.__enter__.return_value = cursor
+    cursor.__iter__.return_value = iter([('http://a', None, None, 1), ('http://b', 2.0, 'foo', 2)])
+    cursor.description = [Column('url'), Column('interval'), Column('regex'), Column('id')]
+    conn = mock.Mock()
+    conn.cursor.return_value = cursor
+    conf = {'crawler': {'interval': 5.0, 'inventory': {'table': 'crawler_urls'}},
+            'persister': {'postgres': {'uri': 'postgres://localhost/awm'}}}
+    with mock.patch('psycopg2.connect', return_value=conn) as connect:
+        # the table is not read without database
+        assert urls.url_configs(conf, database=False) == {}
+        url_confs = urls.url_configs(conf)
+    connect.assert_called_once_with('postgres://localhost/awm')
+    conn.close.assert_called_once_with()
+    assert cursor.itersize == inventory.FETCH_ROWS
+    assert url_confs == {'http://a': urls.UrlConfig('http://a', 5.0),
+                         'http://b': urls.UrlConfig('http://b', 2.0, url_confs['http://b'].regex)}
+    assert url_confs['http://b'].regex.pattern == 'foo'
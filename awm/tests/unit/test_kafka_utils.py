@@ -14,6 +14,8 @@
 # limitations under the License.
 
 
+import asyncio
+from collections import namedtuple
 from unittest.mock import patch
 import pytest
 from awm.common import kafka_utils
@@ -27,6 +29,72 @@ from awm.common import kafka_utils
         ({}, {}),
         ({'enabled': False}, {})
     ])
-@patch('awm.common.kafka_utils.create_ssl_context', return_value='None')
+@patch('aiokafka.helpers.create_ssl_context', return_value='None')
 def test__kafka_ssl(create_ssl_context_patch, sslconf, expected):
     assert kafka_utils._kafka_ssl(sslconf) == expected
+
+
+def test_content_type():
+    Msg = namedtuple('Msg', ['headers'])
+    assert kafka_utils.content_type(Msg(kafka_utils.content_type_headers('application/json'))) == 'application/json'
+    assert kafka_utils.content_type(Msg([('other', b'')])) is None
+    assert kafka_utils.content_type(Msg(None)) is None
+
+
+class FakeProducer:
+    """a stand-in for :class:`aiokafka.AIOKafkaProducer` with manually completed deliveries"""
+    def __init__(self):
+        self.sent = []
+        # set to block the sends, e.g. while the buffer of the producer is full
+        self.blocked = None
+
+    async def send(self, topic, value, key=None, headers=None):
+        if self.blocked is not None:
+            await self.blocked.wait()
+        future = asyncio.get_event_loop().create_future()
+        self.sent.append((topic, value, key, headers, future))
+        return future
+
+
+@pytest.mark.asyncio
+async def test_sender_back_pressure():
+    producer = FakeProducer()
+    sender = kafka_utils.Sender(producer, 'awm', 2)
+    await sender.send(b'1', key=b'a')
+    await sender.send(b'2', key=b'b')
+    assert sender.in_flight == 2
+    # the limit is reached. The next send waits for a delivery
+    third = asyncio.create_task(sender.send(b'3'))
+    await asyncio.sleep(0)
+    assert not third.done()
+    producer.sent[0][4].set_result(None)
+    await asyncio.wait_for(third, 1)
+    assert sender.in_flight == 2
+    assert producer.sent[0][:3] == ('awm', b'1', b'a')
+
+
+@pytest.mark.asyncio
+async def test_sender_cancelled_send():
+    producer = FakeProducer()
+    producer.blocked = asyncio.Event()
+    sender = kafka_utils.Sender(producer, 'awm', 1)
+    send = asyncio.create_task(sender.send(b'1'))
+    await asyncio.sleep(0)
+    send.cancel()
+    await asyncio.gather(send, return_exceptions=True)
+    # the cancelled send gave its slot back
+    producer.blocked = None
+    await asyncio.wait_for(sender.send(b'2'), 1)
+    assert sender.in_flight == 1
+
+
+@pytest.mark.asyncio
+async def test_sender_failed_delivery():
+    producer = FakeProducer()
+    sender = kafka_utils.Sender(producer, 'awm', 2)
+    await sender.send(b'1')
+    producer.sent[0][4].set_exception(Exception('failed'))
+    await sender.flush()
+    await asyncio.sleep(0)
+    assert sender.in_flight == 0
+    assert sender.failed == 1
@@ -0,0 +1,35 @@
+# Copyright (c) 2020 Thomas Bechtold <thomasbechtold@jpberlin.de>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import asyncio
+import time
+import pytest
+
+from awm.crawler import looplag
+
+
+@pytest.mark.asyncio
+async def test_loop_lag_monitor():
+    lags = []
+    monitor = looplag.LoopLagMonitor(lags.append, interval=0.01)
+    task = asyncio.create_task(monitor.run())
+    await asyncio.sleep(0.02)
+    # block the event loop
+    time.sleep(0.1)
+    await asyncio.sleep(0.02)
+    task.cancel()
+    assert max(lags) >= 0.05
+    assert monitor.lag < 0.05
@@ -0,0 +1,60 @@
+# Copyright (c) 2020 Thomas Bechtold <thomasbechtold@jpberlin.de>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import re
+import pytest
+
+from awm.crawler.matcher import StreamMatcher
+
+
+def _match(regex, text, chunk_size, overlap=1024):
+    data = text.encode()
+    matcher = StreamMatcher(re.compile(regex), overlap)
+    for i in range(0, len(data), chunk_size):
+        if matcher.feed(data[i:i + chunk_size]):
+            return True
+    return matcher.finish()
+
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 3, 1024])
+@pytest.mark.parametrize(
+    'regex,text,expected_result',
+    [
+        ('.*', '', True),
+        ('.*', 'foobar', True),
+        ('.*foobar.*', 'foobar', True),
+        ('.*にち.*', 'こんにちは', True),
+        ('test', 'foobar', False),
+        ('^foobar.*', 'bar foobar', False),
+        ('^bar', 'bar foobar', True),
+        (r'\bbar', 'foobar', False),
+        ('obar f', 'foobar foobar', True),
+    ])
+def test_stream_matcher(chunk_size, regex, text, expected_result):
+    assert _match(regex, text, chunk_size) == expected_result
+
+
+def test_stream_matcher_overlap_too_small():
+    # the match is longer than the kept overlap so it can not be found across chunks
+    assert _match('abcdef', 'abcdef', 2, overlap=2) is False
+    assert _match('abcdef', 'abcdef', 2, overlap=5) is True
+
+
+def test_stream_matcher_stops_after_match():
+    matcher = StreamMatcher(re.compile('foo'), 10)
+    assert matcher.feed(b'foo') is True
+    assert matcher.feed(b'bar') is True
+    assert matcher.matched is True
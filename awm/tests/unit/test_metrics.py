@@ -0,0 +1,95 @@
+# Copyright (c) 2020 Thomas Bechtold <thomasbechtold@jpberlin.de>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import aiohttp
+import pytest
+
+from awm.common import metrics
+
+
+def test_counter():
+    registry = metrics.Registry()
+    c = registry.counter('awm_test_total', 'test counter', ('status',))
+    c.inc(1, 'ok')
+    c.inc(2, 'ok')
+    c.inc(1, 'failed')
+    assert c.get('ok') == 3
+    assert registry.counter('awm_test_total', 'test counter', ('status',)) is c
+    with pytest.raises(ValueError):
+        c.inc(-1, 'ok')
+    with pytest.raises(ValueError):
+        c.inc(1)
+    assert registry.render() == (
+        '# HELP awm_test_total test counter\n'
+        '# TYPE awm_test_total counter\n'
+        'awm_test_total{status="failed"} 1\n'
+        'awm_test_total{status="ok"} 3\n')
+
+
+def test_gauge():
+    registry = metrics.Registry()
+    g = registry.gauge('awm_test', 'test gauge')
+    g.set(5)
+    g.dec(2)
+    assert g.get() == 3
+    g.set_function(lambda: 42)
+    assert g.get() == 42
+    assert registry.render().endswith('awm_test 42\n')
+
+
+def test_registry_type_mismatch():
+    registry = metrics.Registry()
+    registry.gauge('awm_test', 'test gauge')
+    with pytest.raises(ValueError):
+        registry.counter('awm_test', 'test counter')
+
+
+def test_histogram():
+    registry = metrics.Registry()
+    h = registry.histogram('awm_test_seconds', 'test histogram', ('status',), buckets=(0.1, 1))
+    for value in (0.05, 0.1, 0.5, 5):
+        h.observe(value, 'ok')
+    assert h.count('ok') == 4
+    assert h.sum('ok') == 5.65
+    assert h.count('failed') == 0
+    assert registry.render() == (
+        '# HELP awm_test_seconds test histogram\n'
+        '# TYPE awm_test_seconds histogram\n'
+        'awm_test_seconds_bucket{status="ok",le="0.1"} 2\n'
+        'awm_test_seconds_bucket{status="ok",le="1.0"} 3\n'
+        'awm_test_seconds_bucket{status="ok",le="+Inf"} 4\n'
+        'awm_test_seconds_sum{status="ok"} 5.65\n'
+        'awm_test_seconds_count{status="ok"} 4\n')
+    h.remove('ok')
+    assert h.count('ok') == 0
+
+
+@pytest.mark.asyncio
+async def test_http_server(unused_tcp_port):
+    registry = metrics.Registry()
+    registry.counter('awm_test_total', 'test counter').inc()
+    async with metrics.http_server({'host': '127.0.0.1', 'port': unused_tcp_port}, registry=registry):
+        async with aiohttp.ClientSession() as session:
+            async with session.get(f'http://127.0.0.1:{unused_tcp_port}/metrics') as response:
+                assert response.status == 200
+                assert response.headers['Content-Type'] == metrics.CONTENT_TYPE
+                assert 'awm_test_total 1' in await response.text()
+
+
+@pytest.mark.asyncio
+async def test_http_server_disabled():
+    async with metrics.http_server(None):
+        pass
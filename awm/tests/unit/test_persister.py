@@ -0,0 +1,81 @@
+# Copyright (c) 2020 Thomas Bechtold <thomasbechtold@jpberlin.de>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import datetime
+import sys
+from collections import namedtuple
+import pytest
+
+from awm import persister
+from awm.persister import service
+from awm.common import config
+from awm.common import kafka_utils
+from awm.common import result
+from awm.common.exception import AwmConfigError
+
+
+Msg = namedtuple('Msg', ['topic', 'partition', 'offset', 'key', 'value', 'headers'])
+
+
+def _msg(offset, value=None, content_type=None):
+    if value is None:
+        value = result.Result('http://localhost', datetime.datetime(2020, 11, 1), None, None, None,
+                              result.ResultStatus.TIMEOUT, 'timeout').encode(content_type or result.CONTENT_TYPE_JSON)
+    headers = kafka_utils.content_type_headers(content_type) if content_type else ()
+    return Msg('awm', 0, offset, None, value, headers)
+
+
+def test__decode_skips_invalid():
+    results = service._decode([_msg(0), _msg(1, b'invalid'), _msg(2)])
+    assert len(results) == 2
+
+
+def test__decode_content_types():
+    # during a rollout both formats can be in the topic
+    results = service._decode([_msg(0), _msg(1, content_type=result.CONTENT_TYPE_JSON),
+                               _msg(2, content_type=result.CONTENT_TYPE_BINARY)])
+    rows = list(results.rows())
+    assert len(rows) == 3
+    assert rows[0] == rows[1] == rows[2]
+
+
+def test__change_filter():
+    assert service._change_filter({}) is None
+    assert service._change_filter({'mode': 'all'}) is None
+    assert service._change_filter({'mode': 'changes', 'heartbeat_interval': 60}) is not None
+    with pytest.raises(AwmConfigError):
+        service._change_filter({'mode': 'unknown'})
+
+
+def test__validate():
+    conf = {'kafka': {'servers': 'localhost:9092', 'topic_name': 'awm', 'ssl': {}},
+            'persister': {'postgres': {'uri': 'postgres://localhost/awm'}, 'mode': 'changes'}}
+    config.validate_persister(conf)
+    conf['persister']['mode'] = 'unknown'
+    with pytest.raises(AwmConfigError):
+        config.validate_persister(conf)
+    del conf['persister']['postgres']
+    with pytest.raises(AwmConfigError):
+        config.validate_persister(conf)
+
+
+def test_main_check_config_missing(tmp_path, monkeypatch, capsys):
+    path = tmp_path / 'missing.json'
+    monkeypatch.setattr(sys, 'argv', ['awm-persister', '-t', '-c', str(path)])
+    with pytest.raises(SystemExit) as e:
+        persister.main()
+    assert e.value.code == 1
+    assert capsys.readouterr().err == f'invalid config {path}: config file {path} not found\n'
@@ -0,0 +1,215 @@
+# Copyright (c) 2020 Thomas Bechtold <thomasbechtold@jpberlin.de>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import asyncio
+import pytest
+from collections import namedtuple
+from aiokafka.structs import TopicPartition
+
+from awm.common import metrics
+from awm.persister import pipeline
+
+
+Msg = namedtuple('Msg', ['offset'])
+TP0 = TopicPartition('awm', 0)
+TP1 = TopicPartition('awm', 1)
+
+
+class FakeConsumer:
+    """records the committed offsets like :class:`aiokafka.AIOKafkaConsumer` would"""
+    def __init__(self, fail=0):
+        self.committed = {}
+        self.highwaters = {}
+        self.paused = set()
+        self._fail = fail
+
+    def pause(self, *partitions):
+        self.paused.update(partitions)
+
+    def resume(self, *partitions):
+        self.paused.difference_update(partitions)
+
+    async def commit(self, offsets):
+        if self._fail:
+            self._fail -= 1
+            raise Exception('CommitFailedError')
+        self.committed.update(offsets)
+
+    def highwater(self, tp):
+        return self.highwaters.get(tp)
+
+
+class Writer:
+    def __init__(self, fail=0, delay=0):
+        self.batches = []
+        self._fail = fail
+        self._delay = delay
+
+    async def __call__(self, msgs):
+        await asyncio.sleep(self._delay)
+        if self._fail:
+            self._fail -= 1
+            raise Exception('write failed')
+        self.batches.append([m.offset for m in msgs])
+
+
+def _pipelines(writer, batch_size=3, batch_timeout=0.01, max_in_flight=100, revoked=None, commit_fail=0):
+    consumer = FakeConsumer(commit_fail)
+    return consumer, pipeline.PartitionPipelines(consumer, writer, batch_size, batch_timeout, max_in_flight,
+                                                 revoked)
+
+
+@pytest.mark.asyncio
+async def test_pipelines_batches_per_partition():
+    writer = Writer()
+    consumer, pipelines = _pipelines(writer)
+    await pipelines.on_partitions_assigned([TP0, TP1])
+    assert len(pipelines) == 2
+    pipelines.dispatch({TP0: [Msg(i) for i in range(7)], TP1: [Msg(i) for i in range(10, 12)]})
+    await asyncio.sleep(0.05)
+    # batches are written by size or timeout and keep the partition order
+    assert sorted(writer.batches) == [[0, 1, 2], [3, 4, 5], [6], [10, 11]]
+    assert consumer.committed == {TP0: 7, TP1: 12}
+    await pipelines.stop()
+
+
+@pytest.mark.asyncio
+async def test_pipelines_revoke_drains():
+    writer = Writer(delay=0.01)
+    consumer, pipelines = _pipelines(writer, batch_timeout=10)
+    await pipelines.on_partitions_assigned([TP0, TP1])
+    pipelines.dispatch({TP0: [Msg(0)], TP1: [Msg(1)]})
+    # the pending messages are written before the partition is handed over
+    await pipelines.on_partitions_revoked([TP0])
+    assert consumer.committed == {TP0: 1}
+    # messages of revoked partitions are ignored
+    pipelines.dispatch({TP0: [Msg(2)]})
+    assert len(pipelines) == 1
+    await pipelines.stop()
+    assert consumer.committed == {TP0: 1, TP1: 2}
+    assert len(pipelines) == 0
+
+
+@pytest.mark.asyncio
+async def test_pipelines_revoked_callback():
+    writer = Writer(delay=0.01)
+    revoked = []
+
+    async def on_revoked(tp):
+        # called after the messages of the partition were written
+        revoked.append((tp, list(writer.batches)))
+        if tp == TP1:
+            raise Exception('cleanup failed')
+    consumer, pipelines = _pipelines(writer, batch_timeout=10, revoked=on_revoked)
+    await pipelines.on_partitions_assigned([TP0, TP1])
+    pipelines.dispatch({TP0: [Msg(0)]})
+    await pipelines.on_partitions_revoked([TP0])
+    assert revoked == [(TP0, [[0]])]
+    # a reassigned partition gets a new pipeline
+    await pipelines.on_partitions_assigned([TP0])
+    pipelines.dispatch({TP0: [Msg(1)]})
+    # a failing callback doesn't stop the revocation
+    await pipelines.stop()
+    assert sorted(tp for tp, _ in revoked) == [TP0, TP0, TP1]
+    assert consumer.committed == {TP0: 2}
+    assert len(pipelines) == 0
+
+
+@pytest.mark.asyncio
+async def test_pipelines_retry_failed_write(monkeypatch):
+    monkeypatch.setattr(pipeline, 'RETRY_DELAY', 0.001)
+    writer = Writer(fail=2)
+    consumer, pipelines = _pipelines(writer, batch_size=1)
+    await pipelines.on_partitions_assigned([TP0])
+    pipelines.dispatch({TP0: [Msg(0)]})
+    await asyncio.sleep(0.05)
+    assert writer.batches == [[0]]
+    assert consumer.committed == {TP0: 1}
+    await pipelines.stop()
+
+
+@pytest.mark.asyncio
+async def test_pipelines_retry_failed_commit(monkeypatch):
+    monkeypatch.setattr(pipeline, 'RETRY_DELAY', 0.001)
+    writer = Writer()
+    consumer, pipelines = _pipelines(writer, batch_size=1, commit_fail=2)
+    await pipelines.on_partitions_assigned([TP0])
+    pipelines.dispatch({TP0: [Msg(0)]})
+    await asyncio.sleep(0.05)
+    # only the commit is retried
+    assert writer.batches == [[0]]
+    assert consumer.committed == {TP0: 1}
+    pipelines.dispatch({TP0: [Msg(1)]})
+    await pipelines.stop()
+    assert consumer.committed == {TP0: 2}
+
+
+@pytest.mark.asyncio
+async def test_pipelines_revoke_failing_commit():
+    writer = Writer()
+    consumer, pipelines = _pipelines(writer, batch_size=1, commit_fail=10)
+    await pipelines.on_partitions_assigned([TP0])
+    pipelines.dispatch({TP0: [Msg(0), Msg(1)]})
+    await asyncio.sleep(0.01)
+    # the revocation finishes without waiting for the next retry
+    await asyncio.wait_for(pipelines.on_partitions_revoked([TP0]), 0.5)
+    assert writer.batches == [[0]]
+    assert consumer.committed == {}
+
+
+@pytest.mark.asyncio
+async def test_pipelines_revoke_failing_write():
+    writer = Writer(fail=10)
+    consumer, pipelines = _pipelines(writer, batch_size=1)
+    await pipelines.on_partitions_assigned([TP0])
+    pipelines.dispatch({TP0: [Msg(0), Msg(1)]})
+    await asyncio.sleep(0.01)
+    # the revocation doesn't wait for the next retry and gives up the failing partition
+    await asyncio.wait_for(pipelines.on_partitions_revoked([TP0]), 0.5)
+    assert writer.batches == []
+    assert consumer.committed == {}
+    assert len(pipelines) == 0
+
+
+@pytest.mark.asyncio
+async def test_pipelines_back_pressure():
+    writer = Writer(delay=0.05)
+    consumer, pipelines = _pipelines(writer, batch_size=1, max_in_flight=4)
+    await pipelines.on_partitions_assigned([TP0, TP1])
+    # dispatching never waits for the pipelines
+    pipelines.dispatch({TP0: [Msg(i) for i in range(5)], TP1: [Msg(10)]})
+    assert consumer.paused == {TP0}
+    await asyncio.sleep(0.15)
+    # resumed once at most half of max_in_flight wait
+    assert consumer.paused == set()
+    await pipelines.stop()
+    assert [b for b in writer.batches if b[0] < 10] == [[0], [1], [2], [3], [4]]
+
+
+@pytest.mark.asyncio
+async def test_pipelines_consumer_lag():
+    lag = metrics.REGISTRY.gauge('awm_persister_consumer_lag', '', ('partition',))
+    writer = Writer()
+    consumer, pipelines = _pipelines(writer, batch_size=2, batch_timeout=10)
+    consumer.highwaters[TP0] = 10
+    await pipelines.on_partitions_assigned([TP0])
+    pipelines.dispatch({TP0: [Msg(i) for i in range(5, 8)]})
+    await asyncio.sleep(0.01)
+    # offset 7 waits for its batch
+    assert lag.get(str(TP0)) == 3
+    await pipelines.stop()
+    # the lag of revoked partitions isn't reported anymore
+    assert str(TP0) not in lag.render()
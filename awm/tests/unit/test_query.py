@@ -0,0 +1,51 @@
+# Copyright (c) 2020 Thomas Bechtold <thomasbechtold@jpberlin.de>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import argparse
+import datetime
+import pytest
+
+from awm import query
+from awm.query import report as query_report
+from awm.common.result import ResultStatus
+
+
+@pytest.mark.parametrize(
+    'value,expected',
+    [
+        ('30m', datetime.timedelta(minutes=30)),
+        ('12h', datetime.timedelta(hours=12)),
+        ('7d', datetime.timedelta(days=7)),
+    ])
+def test__duration(value, expected):
+    assert query._duration(value) == expected
+
+
+def test__duration_invalid():
+    with pytest.raises(argparse.ArgumentTypeError):
+        query._duration('7 days')
+
+
+def test_report():
+    report = query_report.Report('http://localhost')
+    assert report.uptime is None
+    report.counts[ResultStatus.SUCCESSFUL] = 8
+    report.counts[ResultStatus.TIMEOUT] = 2
+    report.http_errors = 2
+    report.latency.add(0.1)
+    assert report.checks == 10
+    assert report.uptime == 0.6
+    assert 'uptime: 60.000%' in str(report)
@@ -0,0 +1,203 @@
+# Copyright (c) 2020 Thomas Bechtold <thomasbechtold@jpberlin.de>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import asyncio
+import json
+import os
+import signal
+import time
+import pytest
+
+from awm.crawler import reload
+from awm.crawler import scheduler
+from awm.crawler import urls
+
+
+def _conf(url_map, interval=60):
+    return {'kafka': {'servers': 'localhost:9092'}, 'crawler': {'interval': interval, 'urls': url_map}}
+
+
+def _write(path, conf):
+    with open(path, 'w') as f:
+        json.dump(conf, f)
+
+
+def _reloader(tmp_path, conf, owns=None, forget=None):
+    path = tmp_path / 'config.json'
+    _write(path, conf)
+
+    async def check(url, due):
+        pass
+    sched = scheduler.Scheduler(check, 1)
+    url_confs = urls.url_configs(conf)
+    for url, url_conf in url_confs.items():
+        if owns is None or owns(url):
+            sched.add(url, url_conf.interval)
+    return path, sched, url_confs, reload.UrlReloader(str(path), conf, url_confs, sched, owns, forget)
+
+
+def test_diff():
+    old = urls.url_configs(_conf({'http://a': {}, 'http://b': {}, 'http://c': {'regex': 'foo'}}))
+    new = urls.url_configs(_conf({'http://b': {}, 'http://c': {'regex': 'bar'}, 'http://d': {}}))
+    assert reload.diff(old, new) == ({'http://d'}, {'http://a'}, {'http://c'})
+    assert reload.diff(old, urls.url_configs(_conf({'http://a': {}, 'http://b': {}, 'http://c': {'regex': 'foo'}}))) \
+        == (set(), set(), set())
+
+
+@pytest.mark.asyncio
+async def test_reload(tmp_path):
+    conf = _conf({'http://a': {}, 'http://b': {}, 'http://c': {}})
+    path, sched, url_confs, reloader = _reloader(tmp_path, conf)
+    heap_b = [entry for entry in sched._heap if entry[2] == 'http://b']
+    _write(path, _conf({'http://b': {}, 'http://c': {'interval': 30, 'regex': 'foo'}, 'http://d': {}}))
+    assert await reloader.reload() == ({'http://d'}, {'http://a'}, {'http://c'})
+    assert set(url_confs) == {'http://b', 'http://c', 'http://d'}
+    assert 'http://a' not in sched and 'http://d' in sched
+    # the changed config is used by the next check of the url
+    assert url_confs['http://c'].interval == 30
+    assert url_confs['http://c'].regex.pattern == 'foo'
+    # unchanged urls keep their schedule
+    assert [entry for entry in sched._heap if entry[2] == 'http://b'] == heap_b
+
+
+@pytest.mark.asyncio
+async def test_reload_forget(tmp_path):
+    forgotten = []
+    path, sched, url_confs, reloader = _reloader(tmp_path, _conf({'http://a': {}, 'http://b': {}, 'http://c': {}}),
+                                                 forget=forgotten.append)
+    _write(path, _conf({'http://b': {}, 'http://c': {'regex': 'foo'}}))
+    await reloader.reload()
+    # the state of removed and changed urls is dropped, so a re-added url starts fresh
+    assert sorted(forgotten) == ['http://a', 'http://c']
+
+
+@pytest.mark.asyncio
+async def test_reload_invalid_config(tmp_path):
+    conf = _conf({'http://a': {}})
+    path, sched, url_confs, reloader = _reloader(tmp_path, conf)
+    _write(path, _conf({'http://b': {'regex': '('}}))
+    assert await reloader.reload() == (set(), set(), set())
+    assert set(url_confs) == {'http://a'}
+    assert 'http://a' in sched
+
+
+@pytest.mark.parametrize('url_map', [
+    {'http://b': []},
+    {'http://b': {'interval': '10'}},
+])
+@pytest.mark.asyncio
+async def test_reload_invalid_types(tmp_path, url_map):
+    conf = _conf({'http://a': {}})
+    path, sched, url_confs, reloader = _reloader(tmp_path, conf)
+    _write(path, _conf(url_map))
+    assert await reloader.reload() == (set(), set(), set())
+    # nothing is removed before the new config is checked
+    assert set(url_confs) == {'http://a'}
+    assert 'http://a' in sched and len(sched) == 1
+
+
+@pytest.mark.asyncio
+async def test_reload_run_error(tmp_path, monkeypatch):
+    conf = _conf({'http://a': {}})
+    path, sched, url_confs, reloader = _reloader(tmp_path, conf)
+
+    def apply(*args):
+        raise RuntimeError('unexpected')
+    monkeypatch.setattr(reloader, '_apply', apply)
+    task = asyncio.create_task(reloader.run(0.01))
+    await asyncio.sleep(0.02)
+    _write(path, _conf({'http://b': {}}))
+    os.utime(path, (0, 0))
+    await asyncio.sleep(0.05)
+    os.kill(os.getpid(), signal.SIGHUP)
+    await asyncio.sleep(0.02)
+    # the errors are logged and the reloader keeps running
+    assert not task.done()
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+
+
+@pytest.mark.asyncio
+async def test_reload_owns(tmp_path):
+    conf = _conf({})
+    path, sched, url_confs, reloader = _reloader(tmp_path, conf, owns=lambda url: url != 'http://b')
+    _write(path, _conf({'http://a': {}, 'http://b': {}}))
+    await reloader.reload()
+    # urls of other processes are known but not scheduled
+    assert set(url_confs) == {'http://a', 'http://b'}
+    assert len(sched) == 1 and 'http://a' in sched
+
+
+@pytest.mark.asyncio
+async def test_reload_run(tmp_path):
+    conf = _conf({'http://a': {}})
+    path, sched, url_confs, reloader = _reloader(tmp_path, conf)
+    task = asyncio.create_task(reloader.run(0.01))
+    await asyncio.sleep(0.02)
+    _write(path, _conf({'http://a': {}, 'http://b': {}}))
+    os.utime(path, (0, 0))
+    await asyncio.sleep(0.05)
+    assert 'http://b' in sched
+    # SIGHUP reloads without a changed modification time
+    _write(path, _conf({'http://a': {}, 'http://b': {}, 'http://c': {}}))
+    os.utime(path, (0, 0))
+    os.kill(os.getpid(), signal.SIGHUP)
+    await asyncio.sleep(0.02)
+    assert 'http://c' in sched
+    # a SIGHUP at the same time doesn't swallow the cancellation
+    os.kill(os.getpid(), signal.SIGHUP)
+    task.cancel()
+    await asyncio.wait_for(asyncio.gather(task, return_exceptions=True), 1)
+    assert task.cancelled()
+
+
+@pytest.mark.asyncio
+async def test_reload_inventory_change(tmp_path):
+    inventory_path = tmp_path / 'urls.ndjson'
+    inventory_path.write_text('{"url": "http://a"}\n')
+    conf = _conf({})
+    conf['crawler']['inventory'] = {'path': str(inventory_path)}
+    path, sched, url_confs, reloader = _reloader(tmp_path, conf)
+    assert 'http://a' in sched
+    inventory_path.write_text('{"url": "http://b"}\n')
+    os.utime(inventory_path, (0, 0))
+    assert reloader._changed()
+    await reloader.reload()
+    assert set(url_confs) == {'http://b'}
+    assert 'http://b' in sched and 'http://a' not in sched
+
+
+@pytest.mark.asyncio
+async def test_reload_in_executor(tmp_path, monkeypatch):
+    conf = _conf({'http://a': {}})
+    path, sched, url_confs, reloader = _reloader(tmp_path, conf)
+    _write(path, _conf({'http://a': {}, 'http://b': {}}))
+    url_configs = urls.url_configs
+
+    def slow_url_configs(conf):
+        # e.g. a large inventory table
+        time.sleep(0.2)
+        return url_configs(conf)
+    monkeypatch.setattr(reload.urls, 'url_configs', slow_url_configs)
+    task = asyncio.ensure_future(reloader.reload())
+    # the event loop keeps running while the inventory is read
+    ticks = 0
+    while not task.done():
+        await asyncio.sleep(0.01)
+        ticks += 1
+    assert ticks > 10
+    assert task.result() == ({'http://b'}, set(), set())
+    assert 'http://b' in sched
@@ -17,6 +17,7 @@
 import datetime
 import pytest
 import json
+from dateutil import parser
 from awm.common import result
 
 
@@ -59,3 +60,133 @@ def test_result_ro_properties():
         r.status = None
         r.status_message = None
         r.duration = None
+
+
+def test_result_batch_sql():
+    results = [
+        result.Result("http://localhost", start_dt, end_dt, 200, True, result.ResultStatus.SUCCESSFUL, None),
+        result.Result("http://localhost/2", start_dt, None, None, None, result.ResultStatus.TIMEOUT, None),
+    ]
+    url_ids = {'http://localhost': 1, 'http://localhost/2': 2}
+    sql, sql_args = result.ResultBatch(results).sql(url_ids)
+    row = '({})'.format(', '.join(['%s'] * len(result.Result.SQL_COLUMNS)))
+    assert sql.startswith('INSERT INTO crawler_results(url_id, start_time,')
+    assert sql.count(row) == 2
+    assert len(sql_args) == 2 * len(result.Result.SQL_COLUMNS)
+    assert sql_args[:len(result.Result.SQL_COLUMNS)] == [1] + list(results[0].sql_values())[1:]
+    assert sql_args[len(result.Result.SQL_COLUMNS)] == 2
+    # the status message of unsuccessful results is never NULL
+    assert sql_args[len(sql_args) - len(result.Result.SQL_COLUMNS) +
+                    result.Result.SQL_COLUMNS.index('status_message')] == ''
+    assert results[1].sql(url_ids) == (sql.replace(f', {row}', ''), sql_args[len(result.Result.SQL_COLUMNS):])
+
+
+@pytest.mark.parametrize(
+    'start_dt,end_dt,response_status,response_regex_status,status,status_message,response_body_truncated',
+    [
+        (start_dt, end_dt, 200, True, result.ResultStatus.SUCCESSFUL, None, False),
+        (start_dt, end_dt, 404, False, result.ResultStatus.SUCCESSFUL, None, True),
+        (start_dt, end_dt, 200, None, result.ResultStatus.SUCCESSFUL, None, None),
+        (start_dt, None, None, None, result.ResultStatus.TIMEOUT, 'timeout', None),
+        (start_dt, None, None, None, result.ResultStatus.CLIENT_ERROR, '', None),
+        (datetime.datetime(2020, 11, 1, 0, 0, 0, 123456, tzinfo=datetime.timezone.utc),
+         datetime.datetime(2020, 11, 1, 0, 0, 1, tzinfo=datetime.timezone.utc),
+         200, None, result.ResultStatus.SUCCESSFUL, None, None),
+    ])
+@pytest.mark.parametrize('content_type', [result.CONTENT_TYPE_JSON, result.CONTENT_TYPE_BINARY])
+def test_result_encode_decode(content_type, start_dt, end_dt, response_status, response_regex_status,
+                              status, status_message, response_body_truncated):
+    r = result.Result('http://localhost/こんにちは', start_dt, end_dt, response_status, response_regex_status,
+                      status, status_message, response_body_truncated)
+    r_new = result.Result.decode(r.encode(content_type), content_type)
+    assert r == r_new
+    assert (r_new.start_dt.tzinfo is None) == (start_dt.tzinfo is None)
+
+
+@pytest.mark.parametrize('content_type', [result.CONTENT_TYPE_JSON, result.CONTENT_TYPE_BINARY])
+def test_result_scheduled_dt(content_type):
+    scheduled_dt = start_dt - datetime.timedelta(seconds=2)
+    r = result.Result('http://localhost', start_dt, end_dt, 200, True, result.ResultStatus.SUCCESSFUL, None,
+                      scheduled_dt=scheduled_dt)
+    assert r.lateness == datetime.timedelta(seconds=2)
+    r_new = result.Result.decode(r.encode(content_type), content_type)
+    assert r_new.scheduled_dt == scheduled_dt
+    assert r_new == r
+    assert result.Result('http://localhost', start_dt, None, None, None, result.ResultStatus.TIMEOUT,
+                         'timeout').lateness is None
+
+
+@pytest.mark.parametrize('timings', [
+    result.Timings(0.001, 0.0025, 0.1, 0.5),
+    result.Timings(None, None, 0.1, None),
+])
+@pytest.mark.parametrize('content_type', [result.CONTENT_TYPE_JSON, result.CONTENT_TYPE_BINARY])
+def test_result_timings(content_type, timings):
+    r = result.Result('http://localhost', start_dt, end_dt, 200, True, result.ResultStatus.SUCCESSFUL, None,
+                      scheduled_dt=start_dt, timings=timings)
+    r_new = result.Result.decode(r.encode(content_type), content_type)
+    assert r_new.timings == timings
+    assert r_new == r
+    values = dict(zip(result.Result.SQL_COLUMNS, r.sql_values()))
+    assert values['ttfb'] == datetime.timedelta(seconds=0.1)
+    assert values['dns_time'] == (datetime.timedelta(seconds=0.001) if timings.dns is not None else None)
+    # the phases before a failure are kept
+    r = result.Result('http://localhost', start_dt, None, None, None, result.ResultStatus.TIMEOUT, 'timeout',
+                      timings=timings)
+    assert dict(zip(result.Result.SQL_COLUMNS, r.sql_values()))['ttfb'] == datetime.timedelta(seconds=0.1)
+    assert result.Result.decode(r.encode(content_type), content_type).timings == timings
+
+
+def test_result_binary_is_compact():
+    r = result.Result('http://localhost', start_dt, end_dt, 200, True, result.ResultStatus.SUCCESSFUL, None)
+    assert len(r.as_bytes()) < len(r.as_json()) / 4
+
+
+def test_result_from_bytes_unknown_version():
+    with pytest.raises(ValueError):
+        result.Result.from_bytes(b'\xff')
+
+
+@pytest.mark.parametrize(
+    'value,expected',
+    [
+        (str(start_dt), start_dt),
+        (str(start_dt.replace(tzinfo=datetime.timezone.utc)), start_dt.replace(tzinfo=datetime.timezone.utc)),
+        ('2020-11-01 00:00:00.000001+00:00',
+         datetime.datetime(2020, 11, 1, 0, 0, 0, 1, tzinfo=datetime.timezone.utc)),
+        # fallback to dateutil
+        ('Nov 1 2020 00:00:00', start_dt),
+    ])
+def test__parse_dt(value, expected):
+    assert result._parse_dt(value) == expected
+
+
+def test_result_from_json_without_dateutil(monkeypatch):
+    # the timestamps written by as_json are parsed without the (slow) dateutil fallback
+    def parse(value):
+        raise AssertionError(f'dateutil used for {value}')
+    monkeypatch.setattr(parser, 'parse', parse)
+    r = result.Result('http://localhost', start_dt.replace(tzinfo=datetime.timezone.utc),
+                      end_dt.replace(tzinfo=datetime.timezone.utc), 200, True, result.ResultStatus.SUCCESSFUL, None,
+                      scheduled_dt=start_dt.replace(tzinfo=datetime.timezone.utc))
+    assert result.Result.from_json(json.loads(r.as_json())) == r
+
+
+def test_result_slots():
+    r = result.Result('http://localhost', start_dt, end_dt, None, None, result.ResultStatus.SUCCESSFUL, None)
+    assert not hasattr(r, '__dict__')
+    with pytest.raises(AttributeError):
+        r.foo = 'bar'
+
+
+def test_result_batch():
+    results = [
+        result.Result('http://localhost/1', start_dt, end_dt, 200, True, result.ResultStatus.SUCCESSFUL, None),
+        result.Result('http://localhost/2', start_dt, None, None, None, result.ResultStatus.TIMEOUT, 'timeout'),
+    ]
+    batch = result.ResultBatch(results[:1])
+    batch.append(results[1])
+    assert len(batch) == 2
+    assert batch.column('url') == ['http://localhost/1', 'http://localhost/2']
+    assert batch.column('response_time') == [datetime.timedelta(seconds=1), None]
+    assert list(batch.rows()) == [r.sql_values() for r in results]
@@ -0,0 +1,68 @@
+# Copyright (c) 2020 Thomas Bechtold <thomasbechtold@jpberlin.de>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import datetime
+import json
+
+from awm.common import result
+from awm.persister import rollup
+
+
+utc = datetime.timezone.utc
+
+
+def test_bucket():
+    dt = datetime.datetime(2020, 11, 1, 10, 42, 13, 5, tzinfo=utc)
+    assert rollup.bucket(dt, 60) == datetime.datetime(2020, 11, 1, 10, 42, tzinfo=utc)
+    assert rollup.bucket(dt, 3600) == datetime.datetime(2020, 11, 1, 10, tzinfo=utc)
+    assert rollup.bucket(dt.replace(tzinfo=None), 3600) == datetime.datetime(2020, 11, 1, 10, tzinfo=utc)
+
+
+def _result(url, second, response_status=200, regex_status=None, status=result.ResultStatus.SUCCESSFUL):
+    start = datetime.datetime(2020, 11, 1, 10, 0, second, tzinfo=utc)
+    if status != result.ResultStatus.SUCCESSFUL:
+        return result.Result(url, start, None, None, None, status, 'failed')
+    return result.Result(url, start, start + datetime.timedelta(milliseconds=100), response_status, regex_status,
+                         status, None)
+
+
+def test_aggregate():
+    batch = result.ResultBatch([
+        _result('http://a', 0),
+        _result('http://a', 10, 500),
+        _result('http://a', 20, regex_status=False),
+        _result('http://a', 30, status=result.ResultStatus.TIMEOUT),
+        _result('http://b', 0),
+    ])
+    rows = rollup.aggregate(batch, 60)
+    assert len(rows) == 2
+    row = rows[('http://a', datetime.datetime(2020, 11, 1, 10, tzinfo=utc))]
+    assert row.counts[result.ResultStatus.SUCCESSFUL] == 3
+    assert row.counts[result.ResultStatus.TIMEOUT] == 1
+    assert row.http_errors == 1
+    assert row.regex_failures == 1
+    assert row.latency.count == 3
+
+
+def test_upsert_sql():
+    rows = rollup.aggregate(result.ResultBatch([_result('http://a', 0), _result('http://b', 0)]), 60)
+    sql, sql_args = rollup.upsert_sql('crawler_rollup_minute', rows, {'http://a': 2, 'http://b': 1})
+    assert 'ON CONFLICT (url_id, bucket) DO UPDATE' in sql
+    assert 'count_successful = crawler_rollup_minute.count_successful + EXCLUDED.count_successful' in sql
+    assert len(sql_args) == 2 * len(rollup.COLUMNS)
+    # ordered by url id
+    assert sql_args[0] == 1
+    assert json.loads(sql_args[len(rollup.COLUMNS) - 1]) == rows[('http://b', sql_args[1])].latency.to_json()
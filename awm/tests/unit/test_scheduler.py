@@ -0,0 +1,212 @@
+# Copyright (c) 2020 Thomas Bechtold <thomasbechtold@jpberlin.de>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import asyncio
+import datetime
+import collections
+import pytest
+
+from awm.crawler import scheduler
+
+
+@pytest.mark.parametrize('interval', [1.0, 5.0, 60.0])
+def test_phase(interval):
+    phases = [scheduler.phase(f'https://localhost/{i}', interval) for i in range(1000)]
+    assert all(0 <= p < interval for p in phases)
+    # stable for the same key
+    assert phases[0] == scheduler.phase('https://localhost/0', interval)
+    # spread over the whole interval
+    assert min(phases) < interval * 0.05
+    assert max(phases) > interval * 0.95
+
+
+async def _run(sched, duration):
+    task = asyncio.create_task(sched.run())
+    await asyncio.sleep(duration)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+
+
+@pytest.mark.asyncio
+async def test_scheduler_runs_periodically():
+    calls = collections.Counter()
+
+    async def check(key, due):
+        calls[key] += 1
+
+    sched = scheduler.Scheduler(check, 2)
+    for i in range(10):
+        sched.add(f'key{i}', 0.05)
+    await _run(sched, 0.32)
+    assert len(calls) == 10
+    assert all(5 <= c <= 7 for c in calls.values())
+
+
+@pytest.mark.asyncio
+async def test_scheduler_bounded_concurrency():
+    running = 0
+    max_running = 0
+
+    async def check(key, due):
+        nonlocal running, max_running
+        running += 1
+        max_running = max(max_running, running)
+        await asyncio.sleep(0.02)
+        running -= 1
+
+    sched = scheduler.Scheduler(check, 3)
+    loop = asyncio.get_event_loop()
+    for i in range(20):
+        # all checks are due at the same time
+        sched.add(f'key{i}', 0.01, first_run=loop.time())
+    await _run(sched, 0.1)
+    assert max_running == 3
+
+
+@pytest.mark.asyncio
+async def test_scheduler_remove_and_replace():
+    calls = collections.Counter()
+
+    async def check(key, due):
+        calls[key] += 1
+
+    sched = scheduler.Scheduler(check, 2)
+    loop = asyncio.get_event_loop()
+    sched.add('removed', 0.01, first_run=loop.time() + 0.05)
+    sched.add('replaced', 0.01, first_run=loop.time())
+    sched.remove('removed')
+    # replacing a check doesn't run it twice per interval
+    sched.add('replaced', 0.05, first_run=loop.time())
+    assert 'removed' not in sched
+    assert len(sched) == 1
+    await _run(sched, 0.12)
+    assert calls['removed'] == 0
+    assert 2 <= calls['replaced'] <= 4
+
+
+@pytest.mark.asyncio
+async def test_scheduler_check_exception():
+    calls = collections.Counter()
+
+    async def check(key, due):
+        calls[key] += 1
+        raise Exception('failed')
+
+    sched = scheduler.Scheduler(check, 1)
+    sched.add('key', 0.02, first_run=asyncio.get_event_loop().time())
+    await _run(sched, 0.05)
+    assert calls['key'] >= 2
+
+
+@pytest.mark.asyncio
+async def test_scheduler_passes_due_time():
+    lateness = []
+
+    async def check(key, due):
+        lateness.append(asyncio.get_event_loop().time() - due)
+
+    sched = scheduler.Scheduler(check, 1)
+    sched.add('key', 0.02, first_run=asyncio.get_event_loop().time())
+    await _run(sched, 0.05)
+    assert lateness and all(0 <= late < 0.02 for late in lateness)
+
+
+@pytest.mark.asyncio
+async def test_scheduler_skips_missed_runs():
+    dues = []
+
+    async def check(key, due):
+        dues.append(due)
+        # much longer than the interval
+        await asyncio.sleep(0.05)
+
+    sched = scheduler.Scheduler(check, 1)
+    first_run = asyncio.get_event_loop().time()
+    sched.add('key', 0.02, first_run=first_run)
+    await _run(sched, 0.12)
+    # the following runs keep the phase of the first run instead of running right after the previous one
+    assert len(dues) >= 2
+    assert all(abs(round((due - first_run) / 0.02) * 0.02 - (due - first_run)) < 1e-6 for due in dues)
+    assert all(b - a > 0.02 for a, b in zip(dues, dues[1:]))
+
+
+@pytest.mark.asyncio
+async def test_scheduler_throttle():
+    running = 0
+    max_running = 0
+
+    async def check(key, due):
+        nonlocal running, max_running
+        running += 1
+        max_running = max(max_running, running)
+        await asyncio.sleep(0.02)
+        running -= 1
+
+    sched = scheduler.Scheduler(check, 8)
+    sched.throttle(True)
+    sched.throttle(True)
+    assert sched.limit == 2
+    loop = asyncio.get_event_loop()
+    for i in range(20):
+        sched.add(f'key{i}', 1, first_run=loop.time())
+    await _run(sched, 0.05)
+    assert max_running == 2
+    for _ in range(10):
+        sched.throttle(False)
+    assert sched.limit == 8
+
+
+@pytest.mark.asyncio
+async def test_scheduler_check_returns_next_run():
+    loop = asyncio.get_event_loop()
+    dues = []
+
+    async def check(key, due):
+        dues.append(due)
+        # back off once
+        return loop.time() + 0.1 if len(dues) == 1 else None
+
+    sched = scheduler.Scheduler(check, 1)
+    sched.add('key', 0.04, first_run=loop.time())
+    await _run(sched, 0.2)
+    assert dues[1] - dues[0] >= 0.1
+    assert len(dues) >= 4
+    # back at the regular phase of the key
+    regular = scheduler.next_run('key', 0.04)
+    assert all(abs((regular - due) / 0.04 - round((regular - due) / 0.04)) < 0.05 for due in dues[2:])
+
+
+@pytest.mark.asyncio
+async def test_scheduler_phase_key():
+    async def check(key, due):
+        pass
+
+    sched = scheduler.Scheduler(check, 1, phase_key=lambda key: key.rstrip('#'))
+    sched.add('key#', 60)
+    sched.add('key', 60)
+    # both keys share the phase of 'key'
+    assert abs(sched._heap[0][0] - sched._heap[1][0]) < 0.01
+
+
+def test_wall_clock():
+    loop = asyncio.new_event_loop()
+    try:
+        asyncio.set_event_loop(loop)
+        dt = scheduler.wall_clock(loop.time() - 10)
+        assert 9 < (datetime.datetime.now(datetime.timezone.utc) - dt).total_seconds() < 11
+    finally:
+        loop.close()
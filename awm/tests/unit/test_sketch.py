@@ -0,0 +1,50 @@
+# Copyright (c) 2020 Thomas Bechtold <thomasbechtold@jpberlin.de>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import random
+import pytest
+
+from awm.common import sketch
+
+
+def test_sketch_quantiles():
+    values = [random.uniform(0.001, 2.0) for _ in range(10000)]
+    s = sketch.LatencySketch()
+    for v in values:
+        s.add(v)
+    values.sort()
+    max_error = (sketch.GAMMA - 1) / (sketch.GAMMA + 1)
+    for q in (0.5, 0.95, 0.99):
+        expected = values[int(q * (len(values) - 1))]
+        assert s.quantile(q) == pytest.approx(expected, rel=max_error * 1.01)
+    assert s.count == len(values)
+
+
+def test_sketch_merge_and_json():
+    a = sketch.LatencySketch()
+    b = sketch.LatencySketch()
+    for v in (0.01, 0.02, 0.03):
+        a.add(v)
+    for v in (0.5, 0.00001):
+        b.add(v)
+    a.merge(sketch.LatencySketch.from_json(b.to_json()))
+    assert a.count == 5
+    assert a.quantile(0) == sketch.MIN_VALUE
+    assert a.quantile(1) == pytest.approx(0.5, rel=0.05)
+
+
+def test_sketch_empty():
+    assert sketch.LatencySketch().quantile(0.5) is None
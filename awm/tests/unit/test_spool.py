@@ -0,0 +1,232 @@
+# Copyright (c) 2020 Thomas Bechtold <thomasbechtold@jpberlin.de>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import asyncio
+import time
+import pytest
+
+from awm.crawler import spool
+
+
+def _record(i):
+    return spool.Record(f'key{i}'.encode(), f'value{i}'.encode() * 10, [('content-type', b'application/json')])
+
+
+def test_record_roundtrip():
+    records = [_record(0), spool.Record(None, b'', [])]
+    data = b''.join(spool.encode_record(r) for r in records)
+    assert spool.decode_records(data) == (records, len(data))
+    assert spool.decode_records(data, 1) == (records[:1], len(spool.encode_record(records[0])))
+    # a partially written record is ignored
+    assert spool.decode_records(data[:-1]) == (records[:1], len(spool.encode_record(records[0])))
+
+
+@pytest.mark.asyncio
+async def test_spool_read_commit(tmp_path):
+    s = spool.Spool(str(tmp_path), segment_bytes=200)
+    for i in range(5):
+        assert s.append(_record(i))
+    assert s.depth == 5
+    assert s.segments > 1
+    records, position = await s.read(3)
+    assert records == [_record(i) for i in range(len(records))]
+    # the records are read again until they are committed
+    assert (await s.read(3))[0] == records
+    s.commit(position, len(records))
+    assert s.depth == 5 - len(records)
+    read = list(records)
+    while s.depth:
+        records, position = await s.read(3)
+        read += records
+        s.commit(position, len(records))
+    assert read == [_record(i) for i in range(5)]
+    # fully delivered segments are deleted
+    assert s.segments == 1
+    s.close()
+
+
+@pytest.mark.asyncio
+async def test_spool_read_waits(tmp_path):
+    s = spool.Spool(str(tmp_path))
+    read = asyncio.ensure_future(s.read(10))
+    await asyncio.sleep(0)
+    assert not read.done()
+    s.append(_record(0))
+    assert (await asyncio.wait_for(read, 1))[0] == [_record(0)]
+    s.close()
+
+
+@pytest.mark.asyncio
+async def test_spool_read_in_executor(tmp_path, monkeypatch):
+    s = spool.Spool(str(tmp_path))
+    s.append(_record(0))
+    read_segment = s._read_segment
+
+    def slow_read_segment(*args):
+        time.sleep(0.2)
+        return read_segment(*args)
+    monkeypatch.setattr(s, '_read_segment', slow_read_segment)
+    read = asyncio.ensure_future(s.read(10))
+    # the event loop keeps running while the segment is read
+    ticks = 0
+    while not read.done():
+        await asyncio.sleep(0.01)
+        ticks += 1
+    assert ticks > 10
+    assert read.result()[0] == [_record(0)]
+    s.close()
+
+
+@pytest.mark.asyncio
+async def test_spool_replay(tmp_path):
+    s = spool.Spool(str(tmp_path))
+    for i in range(4):
+        s.append(_record(i))
+    records, position = await s.read(2)
+    s.commit(position, len(records))
+    # simulate a crash while a record is written
+    s._writer.write(spool.encode_record(_record(4))[:-3])
+    s.close()
+
+    s = spool.Spool(str(tmp_path))
+    assert s.depth == 2
+    records, position = await s.read(10)
+    assert records == [_record(2), _record(3)]
+    s.commit(position, len(records))
+    s.append(_record(5))
+    records, position = await s.read(10)
+    assert records == [_record(5)]
+    s.close()
+
+
+@pytest.mark.asyncio
+async def test_spool_batched_writes(tmp_path, monkeypatch):
+    s = spool.Spool(str(tmp_path))
+    writes = []
+    write = s._writer.write
+
+    def counting_write(data):
+        writes.append(data)
+        return write(data)
+    monkeypatch.setattr(s._writer, 'write', counting_write)
+    for i in range(3):
+        s.append(_record(i))
+    # nothing is written before the end of the loop iteration
+    assert not writes
+    await asyncio.sleep(0)
+    assert writes == [b''.join(spool.encode_record(_record(i)) for i in range(3))]
+    assert (await s.read(10))[0] == [_record(i) for i in range(3)]
+    s.close()
+
+
+@pytest.mark.asyncio
+async def test_spool_restart_count(tmp_path, monkeypatch):
+    s = spool.Spool(str(tmp_path), segment_bytes=200)
+    for i in range(5):
+        s.append(_record(i))
+    records, position = await s.read(1)
+    s.commit(position, len(records))
+    s.close()
+
+    def no_decode(*args):
+        raise AssertionError('segment read')
+    # the number of records is stored with the closed segments and the cursor
+    monkeypatch.setattr(spool, 'decode_records', no_decode)
+    s = spool.Spool(str(tmp_path), segment_bytes=200)
+    assert s.depth == 4
+    s.close()
+
+
+@pytest.mark.asyncio
+async def test_spool_restart_after_crash(tmp_path):
+    s = spool.Spool(str(tmp_path), segment_bytes=200)
+    for i in range(5):
+        s.append(_record(i))
+    for _ in range(2):
+        records, position = await s.read(1)
+        s.commit(position, len(records))
+    # simulate a crash: the current segment has no count
+    s._flush()
+    s._writer.close()
+
+    s = spool.Spool(str(tmp_path), segment_bytes=200)
+    assert s.depth == 3
+    s.close()
+    # a cursor without the number of delivered records
+    (tmp_path / 'cursor').write_text(f'{position[0]} {position[1]}')
+    s = spool.Spool(str(tmp_path), segment_bytes=200)
+    assert s.depth == 3
+    read = []
+    while s.depth:
+        records, position = await s.read(10)
+        read += records
+        s.commit(position, len(records))
+    assert read == [_record(i) for i in range(2, 5)]
+    s.close()
+
+
+@pytest.mark.asyncio
+async def test_spool_full(tmp_path):
+    size = len(spool.encode_record(_record(0)))
+    s = spool.Spool(str(tmp_path), max_bytes=2 * size)
+    assert s.append(_record(0))
+    assert s.append(_record(1))
+    assert not s.append(_record(2))
+    assert s.dropped == 1
+    assert s.depth == 2
+    s.close()
+
+
+class FakeProducer:
+    def __init__(self, fail=0):
+        self.sent = []
+        self._fail = fail
+
+    async def send(self, topic, value, key=None, headers=None):
+        future = asyncio.get_event_loop().create_future()
+        if self._fail:
+            self._fail -= 1
+            future.set_exception(Exception('broker unavailable'))
+        else:
+            self.sent.append(value)
+            future.set_result(None)
+        return future
+
+
+@pytest.mark.asyncio
+async def test_drain(tmp_path, monkeypatch):
+    real_sleep = asyncio.sleep
+
+    async def sleep(delay):
+        # don't wait for the retry
+        await real_sleep(0)
+
+    s = spool.Spool(str(tmp_path))
+    for i in range(3):
+        s.append(_record(i))
+    producer = FakeProducer(fail=1)
+    monkeypatch.setattr(asyncio, 'sleep', sleep)
+    task = asyncio.ensure_future(spool.drain(s, producer, 'awm', 2))
+    for _ in range(100):
+        if not s.depth:
+            break
+        # the segments are read in an executor
+        await real_sleep(0.01)
+    task.cancel()
+    assert s.depth == 0
+    # the whole failed bulk is sent again (at least once)
+    assert producer.sent == [_record(i).value for i in (1, 0, 1, 2)]
+    s.close()
@@ -0,0 +1,161 @@
+# Copyright (c) 2020 Thomas Bechtold <thomasbechtold@jpberlin.de>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import datetime
+import pytest
+
+from awm.common import result
+from awm.persister import store
+from awm.persister.changes import ChangeFilter
+
+
+class Transaction:
+    def __init__(self, cur):
+        self._cur = cur
+
+    async def __aenter__(self):
+        self._cur.executed.append(('BEGIN', None))
+
+    async def __aexit__(self, *args):
+        self._cur.executed.append(('COMMIT', None))
+
+
+class FakeCursor:
+    """records the executed statements and answers the queries of the store"""
+    def __init__(self, partitions=()):
+        self.executed = []
+        self._partitions = partitions
+        self._urls = {}
+        self._fetch = []
+
+    async def execute(self, sql, args=None):
+        self.executed.append((sql, args))
+        if sql.startswith('INSERT INTO urls'):
+            for url in args[0]:
+                self._urls.setdefault(url, len(self._urls) + 1)
+        elif sql.startswith('SELECT id, url FROM urls'):
+            self._fetch = [(self._urls[url], url) for url in args[0]]
+        elif 'pg_inherits' in sql:
+            self._fetch = [(p,) for p in self._partitions]
+
+    def begin(self):
+        return Transaction(self)
+
+    async def fetchall(self):
+        return self._fetch
+
+    def statements(self, prefix):
+        return [sql for sql, _ in self.executed if sql.strip().startswith(prefix)]
+
+
+def test_partition_name():
+    day = datetime.date(2020, 11, 1)
+    assert store.partition_name(day) == 'crawler_results_20201101'
+    assert store.partition_day(store.partition_name(day)) == day
+    assert store.partition_day('crawler_results_legacy') is None
+    assert store.partition_day('urls') is None
+
+
+@pytest.mark.asyncio
+async def test_store_write():
+    cur = FakeCursor()
+    s = store.ResultStore()
+    start_dt = datetime.datetime(2020, 11, 1, 23, 59, 59, tzinfo=datetime.timezone(datetime.timedelta(hours=-1)))
+    batch = result.ResultBatch([
+        result.Result('http://a', start_dt, None, None, None, result.ResultStatus.TIMEOUT, 'timeout'),
+        result.Result('http://b', start_dt, None, None, None, result.ResultStatus.TIMEOUT, 'timeout'),
+    ])
+    await s.write(cur, batch)
+    # the partition of the UTC day is created
+    assert len(cur.statements('DO $$')) == 1
+    assert 'crawler_results_20201102 PARTITION OF' in cur.statements('DO $$')[0]
+    assert len(cur.statements('INSERT INTO urls')) == 1
+    # the results and rollups are written in one transaction
+    statements = [sql for sql, _ in cur.executed]
+    begin = statements.index('BEGIN')
+    assert statements[begin + 1].startswith('INSERT INTO crawler_results(url_id,')
+    assert statements[begin + 2].startswith('INSERT INTO crawler_rollup_minute')
+    assert statements[begin + 3].startswith('INSERT INTO crawler_rollup_hour')
+    assert statements[begin + 4] == 'COMMIT'
+    args = cur.executed[begin + 1][1]
+    assert {args[0], args[len(result.Result.SQL_COLUMNS)]} == {1, 2}
+
+    # partitions and url ids are cached
+    cur.executed.clear()
+    await s.write(cur, batch)
+    assert len(cur.executed) == 5
+
+
+@pytest.mark.asyncio
+async def test_store_maintain_retention():
+    today = datetime.datetime.now(datetime.timezone.utc).date()
+    days = [today - datetime.timedelta(days=d) for d in range(10)]
+    cur = FakeCursor([store.partition_name(d) for d in days] + ['crawler_results_legacy'])
+    await store.ResultStore(retention_days=7, rollup_retention_days={'crawler_rollup_minute': 7}).maintain(cur)
+    assert cur.statements('DELETE FROM') == [
+        "DELETE FROM crawler_rollup_minute WHERE bucket < now() - interval '7 days';"]
+    dropped = cur.statements('DROP TABLE')
+    assert dropped == [f'DROP TABLE IF EXISTS {store.partition_name(d)};' for d in days[8:]]
+    # today and tomorrow are created
+    assert len(cur.statements('DO $$')) == 2
+
+
+@pytest.mark.asyncio
+async def test_store_maintain_without_retention():
+    cur = FakeCursor(['crawler_results_20000101'])
+    await store.ResultStore().maintain(cur)
+    assert cur.statements('DROP TABLE') == []
+
+
+@pytest.mark.asyncio
+async def test_store_write_changes():
+    cur = FakeCursor()
+    s = store.ResultStore(change_filter=ChangeFilter(300))
+    start_dt = datetime.datetime(2020, 11, 1, tzinfo=datetime.timezone.utc)
+    batch = result.ResultBatch([
+        result.Result('http://a', start_dt, None, None, None, result.ResultStatus.TIMEOUT, 'timeout'),
+    ])
+    await s.write(cur, batch)
+    assert len(cur.statements('INSERT INTO crawler_results(')) == 1
+    # the unchanged result only updates the rollups
+    cur.executed.clear()
+    await s.write(cur, batch)
+    assert cur.statements('INSERT INTO crawler_results(') == []
+    assert len(cur.statements('INSERT INTO crawler_rollup_')) == 2
+
+
+@pytest.mark.asyncio
+async def test_store_flush_changes():
+    cur = FakeCursor()
+    s = store.ResultStore(change_filter=ChangeFilter(300))
+    start_dt = datetime.datetime(2020, 11, 1, tzinfo=datetime.timezone.utc)
+    for seconds in range(3):
+        await s.write(cur, result.ResultBatch([
+            result.Result('http://a', start_dt + datetime.timedelta(seconds=seconds), None, None, None,
+                          result.ResultStatus.TIMEOUT, 'timeout'),
+        ]), 0)
+    # the last skipped result is written when the partition is revoked
+    cur.executed.clear()
+    await s.flush(cur, 0)
+    assert len(cur.statements('INSERT INTO crawler_results(')) == 1
+    args = cur.executed[-1][1]
+    assert args[result.Result.SQL_COLUMNS.index('repeats')] == 1
+    # and the states of the partition are forgotten
+    cur.executed.clear()
+    await s.flush(cur, 0)
+    assert cur.executed == []
+    await store.ResultStore().flush(cur, 0)
+    assert cur.executed == []
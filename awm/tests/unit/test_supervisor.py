@@ -0,0 +1,56 @@
+# Copyright (c) 2020 Thomas Bechtold <thomasbechtold@jpberlin.de>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import multiprocessing
+import signal
+import sys
+import threading
+import time
+
+from awm.crawler import supervisor
+
+
+def test_supervisor_restarts_crashed_workers():
+    starts = multiprocessing.get_context('fork').Array('i', 2)
+
+    def target(worker):
+        starts[worker] += 1
+        if worker == 0:
+            sys.exit(1)
+        time.sleep(10)
+
+    sup = supervisor.Supervisor(target, 2, max_backoff=0.05)
+    threading.Timer(0.5, sup.stop).start()
+    sup.run(poll_interval=0.01)
+    # the crashing worker got restarted, the other one is still running
+    assert starts[0] >= 3
+    assert starts[1] == 1
+
+
+def test_supervisor_forwards_hangup():
+    hangups = multiprocessing.get_context('fork').Array('i', 2)
+
+    def target(worker):
+        def hangup(*args):
+            hangups[worker] += 1
+        signal.signal(signal.SIGHUP, hangup)
+        time.sleep(10)
+
+    sup = supervisor.Supervisor(target, 2)
+    threading.Timer(0.3, sup.hangup).start()
+    threading.Timer(0.6, sup.stop).start()
+    sup.run(poll_interval=0.01)
+    assert list(hangups) == [1, 1]
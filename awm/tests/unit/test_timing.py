@@ -0,0 +1,54 @@
+# Copyright (c) 2020 Thomas Bechtold <thomasbechtold@jpberlin.de>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import re
+import aiohttp
+import pytest
+
+from awm.benchmark.server import TargetServer
+from awm.common import result
+from awm.crawler import fetcher
+from awm.crawler import timing
+from awm.crawler import urls
+
+
+@pytest.mark.asyncio
+async def test_fetch_url_timings():
+    async with TargetServer(latency=0.05, body_size=1024) as server:
+        url = server.url(0).replace('127.0.0.1', 'localhost')
+        async with aiohttp.ClientSession(trace_configs=[timing.trace_config()]) as session:
+            res = await fetcher.Fetcher(session).fetch(urls.UrlConfig(url, 5.0, re.compile('y')))
+            assert res.status == result.ResultStatus.SUCCESSFUL
+            timings = res.timings
+            assert timings.dns is not None and timings.dns >= 0
+            assert timings.connect > 0
+            # the server delays the response headers
+            assert timings.ttfb >= 0.05
+            assert timings.body is not None and timings.body < timings.ttfb
+            # the connection and the resolved host name are reused
+            res = await fetcher.Fetcher(session).fetch(urls.UrlConfig(url, 5.0))
+            assert res.timings.connect is None
+            assert res.timings.ttfb >= 0.05
+            # without regex, the body is not read
+            assert res.timings.body is None
+
+
+@pytest.mark.asyncio
+async def test_fetch_url_timings_without_trace_config():
+    async with TargetServer() as server:
+        async with aiohttp.ClientSession() as session:
+            res = await fetcher.Fetcher(session).fetch(urls.UrlConfig(server.url(0), 5.0))
+    assert res.timings is None
@@ -0,0 +1,91 @@
+# Copyright (c) 2020 Thomas Bechtold <thomasbechtold@jpberlin.de>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import pytest
+
+from awm.common.exception import AwmConfigError
+from awm.crawler import urls
+
+
+def test_url_configs():
+    conf = {'crawler': {'interval': 5.0, 'regex_overlap': 10, 'urls': {
+        'http://a': {},
+        'http://b': {'interval': 1.0, 'regex': 'foo', 'regex_overlap': 20},
+    }}}
+    url_confs = urls.url_configs(conf)
+    assert url_confs['http://a'].interval == 5.0
+    assert url_confs['http://a'].regex is None
+    assert url_confs['http://a'].regex_overlap == 10
+    assert url_confs['http://b'].interval == 1.0
+    assert url_confs['http://b'].regex.pattern == 'foo'
+    assert url_confs['http://b'].regex_overlap == 20
+
+
+def test_url_configs_invalid_regex():
+    with pytest.raises(AwmConfigError):
+        urls.url_configs({'crawler': {'interval': 5.0, 'urls': {'http://a': {'regex': '('}}}})
+
+
+@pytest.mark.parametrize('url_conf', [
+    [],
+    {'interval': '10'},
+    {'interval': 0},
+    {'interval': True},
+    {'interval': [10]},
+    {'regex': ['foo']},
+    {'regex_overlap': 1.5},
+    {'max_body_bytes': -1},
+    {'head': 'yes'},
+])
+def test_url_configs_invalid_types(url_conf):
+    with pytest.raises(AwmConfigError):
+        urls.url_configs({'crawler': {'interval': 5.0, 'urls': {'http://a': url_conf}}})
+
+
+def test_url_configs_shared_settings():
+    conf = {'crawler': {'interval': 5.0, 'urls': {
+        'http://a': {},
+        'http://b': {'interval': 5.0},
+        'http://c': {'regex': 'foo'},
+        'http://d': {'regex': 'foo'},
+    }}}
+    url_confs = urls.url_configs(conf)
+    # urls with the same settings share them
+    assert url_confs['http://a'].settings is url_confs['http://b'].settings
+    assert url_confs['http://c'].settings is url_confs['http://d'].settings
+    assert url_confs['http://a'].settings is not url_confs['http://c'].settings
+    assert url_confs['http://c'] == urls.UrlConfig('http://c', 5.0, url_confs['http://d'].regex)
+    assert not hasattr(url_confs['http://a'], '__dict__')
+
+
+def test_shard():
+    shards = [urls.shard(f'https://localhost/{i}', 4) for i in range(1000)]
+    assert set(shards) == {0, 1, 2, 3}
+    assert all(shards.count(s) > 150 for s in range(4))
+    assert shards[0] == urls.shard('https://localhost/0', 4)
+
+
+@pytest.mark.parametrize('url,expected', [
+    ('HTTPS://Example.COM', 'https://example.com/'),
+    ('https://example.com:443/a?b=1#top', 'https://example.com/a?b=1'),
+    ('http://example.com:8080/a/', 'http://example.com:8080/a/'),
+    ('http://user@Example.com:80', 'http://user@example.com/'),
+    ('http://[::1]:80/a', 'http://[::1]/a'),
+    ('http://example.com:port/', 'http://example.com:port/'),
+])
+def test_normalize(url, expected):
+    assert urls.normalize(url) == expected
+    assert urls.shard(url, 4) == urls.shard(expected, 4)
@@ -135,6 +135,7 @@ pytest
 %license LICENSE
 %{python3_sitelib}/awm/
 %{python3_sitelib}/awm-*.egg-info
+%{_bindir}/awm-benchmark
 
 %files doc
 %license LICENSE
@@ -148,6 +149,7 @@ pytest
 %files persister
 %license LICENSE
 %{_bindir}/awm-persister
+%{_bindir}/awm-query
 %{_unitdir}/%{name}-persister.service
 
 %changelog